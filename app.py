@@ -4,7 +4,10 @@ A social platform for Georgian developers
 """
 
 from flask import Flask, session, redirect, url_for, flash, render_template
-from models import db, User, Notification
+from models import db, User, Post, Notification, PostFacet
+from facets import rebuild_facets
+from sessions import init_sessions
+from user_cache import get_cached_user
 from werkzeug.security import generate_password_hash, check_password_hash
 import os
 import logging
@@ -28,18 +31,74 @@ else:
 
 SECRET_KEY = os.environ.get('SECRET_KEY', 'my-secret-key')
 
+# Debug mode (reloader, debugger, template auto reload), never in production
+DEBUG = os.environ.get('DEBUG', '0') == '1'
+
+# Compiled templates are kept here across restarts (empty disables the cache)
+TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR', os.path.join(basedir, '.template_cache'))
+
+# Run background jobs (trending scores, cleanup) in a thread of this process
+RUN_JOBS = os.environ.get('RUN_JOBS', '0') == '1'
+
+# Where sessions are stored: 'sql' (shared by all workers) or 'local' (one process only)
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'sql')
+
+# Read notifications are deleted after this many days, unread ones after UNREAD_RETENTION_DAYS
+NOTIFICATION_RETENTION_DAYS = int(os.environ.get('NOTIFICATION_RETENTION_DAYS', 90))
+UNREAD_RETENTION_DAYS = int(os.environ.get('UNREAD_RETENTION_DAYS', 365))
+
+# Read direct messages older than this many days move to the compressed archive
+MESSAGE_ARCHIVE_DAYS = int(os.environ.get('MESSAGE_ARCHIVE_DAYS', 180))
+
+# Weekly digest: links point to SITE_URL, mail goes to DIGEST_SINK
+# ('smtp://host:port' or a directory for .eml files)
+SITE_URL = os.environ.get('SITE_URL', 'http://localhost:5000')
+DIGEST_SINK = os.environ.get('DIGEST_SINK', os.path.join(basedir, 'digests'))
+DIGEST_FROM = os.environ.get('DIGEST_FROM', 'devlog@localhost')
+# Render processes for the digest job (0 renders in the job thread)
+DIGEST_WORKERS = int(os.environ.get('DIGEST_WORKERS', 0))
+
+# PostgreSQL only: partition the messages table by conversation ('hash', into
+# MESSAGE_PARTITIONS tables) or by month ('month'), empty keeps a plain table
+MESSAGE_PARTITIONING = os.environ.get('MESSAGE_PARTITIONING', '')
+MESSAGE_PARTITIONS = int(os.environ.get('MESSAGE_PARTITIONS', 16))
+
+# Database connections kept per worker process (gunicorn.conf.py raises it for gevent)
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+
 # Create Flask app
 app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_size': DB_POOL_SIZE,
+    'max_overflow': DB_MAX_OVERFLOW,
+    'pool_pre_ping': True,
+}
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = SECRET_KEY
 app.config['SESSION_PERMANENT'] = False
 app.config['PERMANENT_SESSION_LIFETIME'] = 3600
+app.config['SESSION_BACKEND'] = SESSION_BACKEND
+app.config['NOTIFICATION_RETENTION_DAYS'] = NOTIFICATION_RETENTION_DAYS
+app.config['UNREAD_RETENTION_DAYS'] = UNREAD_RETENTION_DAYS
+app.config['MESSAGE_ARCHIVE_DAYS'] = MESSAGE_ARCHIVE_DAYS
+app.config['MESSAGE_PARTITIONING'] = MESSAGE_PARTITIONING
+app.config['MESSAGE_PARTITIONS'] = MESSAGE_PARTITIONS
+app.config['SITE_URL'] = SITE_URL
+app.config['DIGEST_SINK'] = DIGEST_SINK
+app.config['DIGEST_FROM'] = DIGEST_FROM
+app.config['DIGEST_WORKERS'] = DIGEST_WORKERS
+app.config['TEMPLATES_AUTO_RELOAD'] = DEBUG
+app.config['TEMPLATE_CACHE_DIR'] = TEMPLATE_CACHE_DIR
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
 # Initialize database
 db.init_app(app)
 
+# Keep sessions on the server, the cookie only holds the session id
+init_sessions(app)
+
 
 # Function to get logged in user
 def get_current_user():
@@ -49,33 +108,75 @@ def get_current_user():
     return None
 
 
+# Function to get the cached hot fields of the logged in user (no query most of the time)
+def get_current_user_info():
+    if 'user_id' in session:
+        return get_cached_user(session['user_id'])
+    return None
+
+
 # Function to check unread notifications
 def get_unread_count():
-    user = get_current_user()
+    user = get_current_user_info()
     if user:
-        # Get all unread notifications
-        notifications = Notification.query.filter_by(user_id=user.id, is_read=False).all()
-        count = len(notifications)
-        return count
+        # Counted in the database (ix_notifications_user_read), rows are not loaded
+        return Notification.query.filter_by(user_id=user.id, is_read=False).count()
     return 0
 
 
 # Make user available in templates
 @app.context_processor
 def inject_globals():
-    user = get_current_user()
-    if user:
-        user.is_authenticated = True
+    user = get_current_user_info()
     return {
         'current_user': user,
         'unread_notifications_count': get_unread_count()
     }
 
 
+# Compiled templates cached on disk
+from templating import init_templates
+init_templates(app)
+
 # Import all routes
 from routes import setup_routes
 setup_routes(app)
 
+# Fingerprinted, precompressed static files
+from assets import setup_assets
+setup_assets(app)
+
+# Compressed pages and 304 answers for pages the browser already has
+from compression import init_compression
+from conditional import init_conditional
+init_compression(app)
+init_conditional(app)
+
+
+# Follow-up work after posts are approved in the admin panel or deleted
+import moderation
+import purge
+import mentions
+import feeds
+from rendering import render_posts
+moderation.on_published.append(render_posts)
+moderation.on_published.append(mentions.notify_post_mentions)
+moderation.on_published.append(feeds.posts_published)
+purge.on_deleted.append(feeds.posts_deleted)
+
+
+# Command line tools and background jobs
+from cli import devlog_cli
+import trending
+import rollups
+import related
+import suggestions
+import archive
+import maintenance
+import digest
+import message_partitions
+app.cli.add_command(devlog_cli)
+
 
 # Error handlers
 @app.errorhandler(404)
@@ -92,12 +193,31 @@ def server_error(error):
     return render_template('500.html'), 500
 
 
-# Initialize database on startup
+# Create missing tables and the demo users (flask devlog init-db)
 def init_database(app):
     with app.app_context():
+        # A new PostgreSQL database gets the partitioned messages table (MESSAGE_PARTITIONING)
+        message_partitions.create_messages_table(db.engine)
         db.create_all()
         logger.info("Database tables created")
 
+        # Substring user search on PostgreSQL (needs the pg_trgm extension)
+        if db.engine.dialect.name == 'postgresql':
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(db.text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                    conn.execute(db.text(
+                        "CREATE INDEX IF NOT EXISTS ix_users_username_trgm "
+                        "ON users USING gin (lower(username) gin_trgm_ops)"
+                    ))
+            except Exception as e:
+                logger.warning(f"Trigram index not created, substring user search will scan the table: {e}")
+
+        # Fill the filter counts the first time
+        if PostFacet.query.first() is None and Post.query.first() is not None:
+            rebuild_facets()
+            logger.info("Post filter counts rebuilt")
+
         # Check if users already exist
         existing_user = User.query.first()
         if existing_user is not None:
@@ -132,15 +252,24 @@ def init_database(app):
         logger.info("  Admin: admin / admin123")
 
 
-# Ensure database exists when the app loads (covers gunicorn)
-init_database(app)
+# Tables and demo users are not created on import (every gunicorn worker would
+# do it). Run `flask --app app devlog init-db` on deploy, or INIT_DB=1 with
+# gunicorn.conf.py.
+
+# Under gunicorn the scheduler is started in each worker after fork (gunicorn.conf.py)
+if RUN_JOBS and 'gunicorn' not in os.environ.get('SERVER_SOFTWARE', ''):
+    from jobs import start_scheduler
+    start_scheduler(app)
 
 
 # Run the app
 if __name__ == '__main__':
+    init_database(app)
     port = int(os.environ.get('PORT', 5000))
     print("\nDevLog started")
     print("Demo user: demo / password123")
     print("Admin user: admin / admin123")
     print(f"\nhttp://localhost:{port}/\n")
-    app.run(host='0.0.0.0', port=port, debug=True)
+    if not DEBUG:
+        print("DEBUG=1 for the reloader and debugger\n")
+    app.run(host='0.0.0.0', port=port, debug=DEBUG)
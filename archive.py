@@ -0,0 +1,122 @@
+"""
+Archive of old direct messages
+Read messages older than MESSAGE_ARCHIVE_DAYS are packed per conversation
+into message_archives rows (zlib-compressed JSON, up to CHUNK_MESSAGES each)
+and removed from the messages table. The thread page loads them back only
+when the user asks for older messages.
+"""
+
+import json
+import logging
+import zlib
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from jobs import job
+from models import db, Message, MessageArchive
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+
+# Messages read (and deleted) per transaction
+ARCHIVE_BATCH = 5000
+# Messages per archive row
+CHUNK_MESSAGES = 500
+
+
+class ArchivedMessage:
+    """A message unpacked from the archive, looks like Message to templates"""
+
+    is_read = True
+    archived = True
+
+    def __init__(self, sender_id, receiver_id, content, created_at):
+        self.sender_id = sender_id
+        self.receiver_id = receiver_id
+        self.content = content
+        self.created_at = datetime.fromisoformat(created_at) if created_at else None
+
+
+def pair_of(user_id, other_id):
+    """Conversation key, smaller id first"""
+    return (user_id, other_id) if user_id < other_id else (other_id, user_id)
+
+
+def pack(messages):
+    """Messages -> compressed bytes"""
+    rows = [[m.sender_id, m.receiver_id, m.content, m.created_at.isoformat() if m.created_at else None]
+            for m in messages]
+    return zlib.compress(json.dumps(rows, ensure_ascii=False, separators=(',', ':')).encode(), 9)
+
+
+def unpack(data):
+    """Compressed bytes -> ArchivedMessage list"""
+    return [ArchivedMessage(*row) for row in json.loads(zlib.decompress(data))]
+
+
+@job('archive_messages', interval=6 * 3600)
+def archive_messages():
+    """Move old read messages into the compressed archive"""
+    cutoff = datetime.now() - timedelta(days=current_app.config.get('MESSAGE_ARCHIVE_DAYS', 180))
+    stats = {'messages': 0, 'archives': 0, 'raw_bytes': 0, 'stored_bytes': 0}
+    while True:
+        messages = db.session.query(Message.id, Message.sender_id, Message.receiver_id,
+                                    Message.content, Message.created_at)\
+                             .filter(Message.created_at < cutoff, Message.is_read == db.true())\
+                             .order_by(Message.id)\
+                             .limit(ARCHIVE_BATCH)\
+                             .all()
+        if not messages:
+            break
+
+        by_pair = defaultdict(list)
+        for message in messages:
+            by_pair[pair_of(message.sender_id, message.receiver_id)].append(message)
+        for (user_a_id, user_b_id), pair_messages in by_pair.items():
+            pair_messages.sort(key=lambda m: (m.created_at, m.id))
+            for start in range(0, len(pair_messages), CHUNK_MESSAGES):
+                chunk = pair_messages[start:start + CHUNK_MESSAGES]
+                data = pack(chunk)
+                db.session.add(MessageArchive(
+                    user_a_id=user_a_id, user_b_id=user_b_id, count=len(chunk), data=data,
+                    first_at=chunk[0].created_at, last_at=chunk[-1].created_at
+                ))
+                stats['archives'] += 1
+                stats['stored_bytes'] += len(data)
+                stats['raw_bytes'] += sum(len((m.content or '').encode()) for m in chunk)
+
+        db.session.execute(db.delete(Message).where(Message.id.in_([m.id for m in messages])))
+        db.session.commit()
+        stats['messages'] += len(messages)
+    return stats
+
+
+def archived_count(user_id, other_id):
+    """Number of archived messages between two users"""
+    user_a_id, user_b_id = pair_of(user_id, other_id)
+    return db.session.query(db.func.coalesce(db.func.sum(MessageArchive.count), 0))\
+                     .filter(MessageArchive.user_a_id == user_a_id, MessageArchive.user_b_id == user_b_id)\
+                     .scalar()
+
+
+def archived_partners(user_id):
+    """Ids of users with archived conversations with this user"""
+    rows = db.session.query(MessageArchive.user_a_id, MessageArchive.user_b_id)\
+                     .filter((MessageArchive.user_a_id == user_id) | (MessageArchive.user_b_id == user_id))\
+                     .distinct()
+    return {user_b_id if user_a_id == user_id else user_a_id for user_a_id, user_b_id in rows}
+
+
+def load_archive(user_id, other_id):
+    """Archived messages between two users, oldest first"""
+    user_a_id, user_b_id = pair_of(user_id, other_id)
+    archives = db.session.query(MessageArchive.data)\
+                         .filter(MessageArchive.user_a_id == user_a_id, MessageArchive.user_b_id == user_b_id)\
+                         .order_by(MessageArchive.first_at, MessageArchive.id)\
+                         .all()
+    messages = [message for (data,) in archives for message in unpack(data)]
+    messages.sort(key=lambda m: m.created_at or datetime.min)
+    return messages
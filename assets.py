@@ -0,0 +1,175 @@
+"""
+Static asset pipeline
+Minifies css, fingerprints css/js/svg files, writes gzip/brotli copies
+and serves them with long-lived cache headers.
+"""
+
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+
+from flask import current_app, request, url_for, send_file, redirect, abort
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always written
+    brotli = None
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+
+# Folders inside static/ that are fingerprinted
+SOURCE_DIRS = ('css', 'js', 'images')
+# Files that are worth compressing (png/jpg are compressed already)
+COMPRESS_EXTENSIONS = {'.css', '.js', '.svg'}
+# Output folder inside static/
+BUILD_DIR = 'dist'
+# One year, files never change under the same name
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# 'css/style.css' -> 'css/style.1a2b3c4d5e6f.css'
+manifest = {}
+# Reverse lookup: fingerprinted name -> original name
+built_files = {}
+
+HASHED_NAME_RE = re.compile(r'^(?P<stem>.+)\.[0-9a-f]{12}(?P<ext>\.[^.]+)$')
+
+
+def minify_css(text):
+    """Remove comments and extra whitespace from CSS"""
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'\s*([{}:;,>])\s*', r'\1', text)
+    return text.replace(';}', '}').strip()
+
+
+# JS is shipped as written: without a real tokenizer, stripping lines or
+# comments breaks template literals and strings; gzip/brotli get most of the gain
+MINIFIERS = {
+    '.css': minify_css,
+}
+
+
+def write_file(path, data):
+    """Write atomically so several workers can build at the same time"""
+    if os.path.exists(path):
+        return
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def build_asset(static_folder, name):
+    """Minify, fingerprint and compress one file, returns the new name"""
+    with open(os.path.join(static_folder, name), 'rb') as f:
+        data = f.read()
+
+    stem, ext = os.path.splitext(name)
+    minify = MINIFIERS.get(ext)
+    if minify:
+        data = minify(data.decode('utf-8')).encode('utf-8')
+
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    hashed_name = f'{stem}.{digest}{ext}'
+    out_path = os.path.join(static_folder, BUILD_DIR, hashed_name)
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+
+    # Same content hash: built by an earlier start, nothing to do
+    if os.path.exists(out_path):
+        return hashed_name
+
+    # Compressed copies first, the plain file last marks the build as complete
+    if ext in COMPRESS_EXTENSIONS:
+        write_file(out_path + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli is not None:
+            write_file(out_path + '.br', brotli.compress(data, quality=11))
+    write_file(out_path, data)
+    return hashed_name
+
+
+def build_assets(app):
+    """Build every file in SOURCE_DIRS and fill the manifest"""
+    static_folder = app.static_folder
+    manifest.clear()
+    built_files.clear()
+    for folder in SOURCE_DIRS:
+        for root, dirs, files in os.walk(os.path.join(static_folder, folder)):
+            for filename in files:
+                name = os.path.relpath(os.path.join(root, filename), static_folder).replace(os.sep, '/')
+                hashed_name = build_asset(static_folder, name)
+                manifest[name] = hashed_name
+                built_files[hashed_name] = name
+    logger.info(f'Built {len(manifest)} static assets')
+    return manifest
+
+
+def asset_url(filename):
+    """URL of the fingerprinted file (plain static URL if it was not built)"""
+    hashed_name = manifest.get(filename)
+    if hashed_name is None or current_app.debug:
+        return url_for('static', filename=filename)
+    return url_for('serve_asset', filename=hashed_name)
+
+
+def pick_encoding(path):
+    """Best precompressed copy the browser accepts -> (path, encoding)"""
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings[encoding] and os.path.exists(path + suffix):
+            return path + suffix, encoding
+    return path, None
+
+
+def setup_assets(app):
+    """Build assets and register the /assets route and template helper"""
+
+    @app.route('/assets/<path:filename>')
+    def serve_asset(filename):
+        """Serve a fingerprinted file, cached forever"""
+        if filename not in built_files:
+            # Old or unknown fingerprint: send the browser to the current file
+            match = HASHED_NAME_RE.match(filename)
+            original = f'{match.group("stem")}{match.group("ext")}' if match else filename
+            if original in manifest:
+                response = redirect(url_for('serve_asset', filename=manifest[original]))
+                response.cache_control.no_cache = True
+                return response
+            abort(404)
+
+        path = os.path.join(app.static_folder, BUILD_DIR, filename)
+        served_path, encoding = pick_encoding(path)
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response = send_file(served_path, mimetype=mimetype, conditional=True,
+                             max_age=IMMUTABLE_MAX_AGE)
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        response.vary.add('Accept-Encoding')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        return response
+
+    @app.after_request
+    def cache_uploads(response):
+        """Uploaded files get unique names, so they can be cached forever"""
+        if request.path.startswith('/static/uploads/') and response.status_code == 200:
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+        return response
+
+    app.jinja_env.globals['asset_url'] = asset_url
+    build_assets(app)
+
+
+def content_hash(file):
+    """Short hash of an uploaded file, used to give it a unique name"""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: file.read(65536), b''):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()[:12]
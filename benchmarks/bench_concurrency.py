@@ -0,0 +1,134 @@
+"""
+Benchmark: sync vs gevent gunicorn workers under many connections
+Starts the app with gunicorn.conf.py once per worker class. Slow clients
+keep connections open (like phones on a bad network) while fast clients
+measure how many pages per second still get served.
+Run: python benchmarks/bench_concurrency.py [--path /posts] [--slow-clients 20]
+"""
+
+import argparse
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_server(mode, port, workers, database_url):
+    """Start gunicorn with one worker class and wait until it answers"""
+    env = dict(os.environ, WORKER_CLASS=mode, WEB_CONCURRENCY=str(workers),
+               DATABASE_URL=database_url, RUN_JOBS='0')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+         '--bind', f'127.0.0.1:{port}', 'app:app'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            fetch(port, '/')
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f'{mode} server did not start')
+
+
+def fetch(port, path):
+    """One GET request, returns the status code"""
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        conn.request('GET', path)
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    finally:
+        conn.close()
+
+
+def slow_client(port, path, hold, stop):
+    """Send the request headers slowly, holding a connection open"""
+    while not stop.is_set():
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=60) as sock:
+                sock.sendall(f'GET {path} HTTP/1.1\r\nHost: localhost\r\n'.encode())
+                stop.wait(hold)
+                sock.sendall(b'Connection: close\r\n\r\n')
+                while sock.recv(65536):
+                    pass
+        except OSError:
+            time.sleep(0.1)
+
+
+def run_mode(mode, args, port, database_url):
+    """Measure fast-client throughput with slow clients in the background"""
+    process = start_server(mode, port, args.workers, database_url)
+    stop = threading.Event()
+    slow_threads = [threading.Thread(target=slow_client, args=(port, args.path, args.hold, stop), daemon=True)
+                    for _ in range(args.slow_clients)]
+    try:
+        for thread in slow_threads:
+            thread.start()
+        time.sleep(0.5)
+
+        latencies = []
+
+        def timed_fetch(_):
+            started = time.perf_counter()
+            status = fetch(port, args.path)
+            latencies.append(time.perf_counter() - started)
+            return status
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            statuses = list(pool.map(timed_fetch, range(args.requests)))
+        elapsed = time.perf_counter() - started
+    finally:
+        stop.set()
+        process.terminate()
+        process.wait()
+
+    latencies.sort()
+    errors = sum(1 for status in statuses if status != 200)
+    return {
+        'rps': args.requests / elapsed,
+        'p50': latencies[len(latencies) // 2] * 1000,
+        'p95': latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        'errors': errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--path', default='/posts')
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--slow-clients', type=int, default=20)
+    parser.add_argument('--hold', type=float, default=2.0, help='seconds a slow client takes to send its headers')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--modes', default='sync,gevent')
+    args = parser.parse_args()
+
+    # Same data for every mode: DATABASE_URL if set, otherwise a fresh SQLite file
+    tmpdir = tempfile.mkdtemp()
+    database_url = os.environ.get('DATABASE_URL', f'sqlite:///{tmpdir}/bench.db')
+    # Create tables once, before several workers start at the same time
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'devlog', 'init-db'], cwd=ROOT, check=True,
+                   env=dict(os.environ, DATABASE_URL=database_url), stderr=subprocess.DEVNULL)
+
+    print(f'path: {args.path}  requests: {args.requests}  concurrency: {args.concurrency}  '
+          f'slow clients: {args.slow_clients} x {args.hold}s  workers: {args.workers}')
+    print(f'{"mode":8} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"errors":>7}')
+    for port, mode in enumerate(args.modes.split(','), start=8701):
+        result = run_mode(mode, args, port, database_url)
+        print(f'{mode:8} {result["rps"]:8.1f} {result["p50"]:8.1f} {result["p95"]:8.1f} {result["errors"]:7}')
+
+
+if __name__ == '__main__':
+    main()
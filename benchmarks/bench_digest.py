@@ -0,0 +1,116 @@
+"""
+Benchmark: weekly digest for 20,000 users
+Fills a fresh database (DATABASE_URL, or a temporary SQLite file) with users,
+follows, a week of posts and likes and unread notifications, then runs the
+digest pipeline into a sink that only counts messages
+Run: python benchmarks/bench_digest.py [--users 20000] [--workers 0 2]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FOLLOWS_PER_USER = 30
+POSTS_PER_USER = 0.25
+LIKES_PER_POST = 10
+NOTIFICATIONS_PER_USER = 5
+INSERT_BATCH = 10000
+
+
+class CountingSink:
+    """Drops the messages, keeps their number and size"""
+
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+
+    def send(self, messages):
+        self.messages += len(messages)
+        self.bytes += sum(len(data) for _, _, data in messages)
+        return len(messages)
+
+    def close(self):
+        pass
+
+
+def insert(db, table, rows):
+    for start in range(0, len(rows), INSERT_BATCH):
+        db.session.execute(db.insert(table), rows[start:start + INSERT_BATCH])
+    db.session.commit()
+
+
+def fill(db, users):
+    """Synthetic users, follows, posts, likes and notifications"""
+    from models import User, Post, Like, Notification, follow_table
+    rng = np.random.default_rng(42)
+    now = datetime.now()
+
+    # Ids after the demo users of init_database()
+    first = (db.session.query(db.func.max(User.id)).scalar() or 0) + 1
+    insert(db, User.__table__, [{'id': first + i, 'username': f'bench{i}', 'email': f'bench{i}@example.com',
+                                 'password': 'x'} for i in range(users)])
+    follower = np.repeat(np.arange(first, first + users), FOLLOWS_PER_USER)
+    followed = (rng.pareto(1.2, size=len(follower)) * users / 50).astype(np.int64) % users + first
+    edges = {(a, b) for a, b in zip(follower.tolist(), followed.tolist()) if a != b}
+    insert(db, follow_table, [{'follower_id': a, 'followed_id': b} for a, b in edges])
+
+    post_count = int(users * POSTS_PER_USER)
+    authors = rng.integers(first, first + users, size=post_count)
+    first_post = (db.session.query(db.func.max(Post.id)).scalar() or 0) + 1
+    insert(db, Post.__table__, [
+        {'id': first_post + i, 'title': f'Post {i}', 'content': 'text ' * 100, 'excerpt': 'text ' * 40,
+         'author_id': int(author), 'is_published': True, 'created_at': now - timedelta(hours=i % 160)}
+        for i, author in enumerate(authors)
+    ])
+    likes = rng.integers(first_post, first_post + post_count, size=post_count * LIKES_PER_POST)
+    likers = rng.integers(first, first + users, size=len(likes))
+    insert(db, Like.__table__, [{'post_id': int(p), 'author_id': int(u), 'created_at': now}
+                                for p, u in zip(likes, likers)])
+    receivers = rng.integers(first, first + users, size=users * NOTIFICATIONS_PER_USER)
+    insert(db, Notification.__table__, [
+        {'user_id': int(u), 'sender_id': first, 'action': 'like', 'message': 'bench0-მა მოიწონა თქვენი პოსტი',
+         'is_read': False, 'created_at': now - timedelta(minutes=i % 5000)}
+        for i, u in enumerate(receivers)
+    ])
+    return len(edges), post_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=20_000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 2],
+                        help='render processes per run (0 renders in this process)')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    os.environ.setdefault('DATABASE_URL', f'sqlite:///{tmpdir}/bench.db')
+    os.environ['RUN_JOBS'] = '0'
+    from app import app, init_database
+    from models import db
+    from digest import send_digests
+    init_database(app)
+
+    with app.app_context():
+        started = time.perf_counter()
+        edges, posts = fill(db, args.users)
+        print(f'users:     {args.users:,}')
+        print(f'follows:   {edges:,}')
+        print(f'posts:     {posts:,} (this week)')
+        print(f'fill:      {time.perf_counter() - started:.1f} s')
+
+        for workers in args.workers:
+            sink = CountingSink()
+            stats = send_digests(sink, workers=workers, restart=True)
+            print(f'workers={workers}: {stats.sent:,} digests in {stats.elapsed:.1f} s '
+                  f'({stats.users / stats.elapsed:,.0f} users/s, {sink.bytes / max(sink.messages, 1) / 1024:.1f} KB each)')
+
+
+if __name__ == '__main__':
+    main()
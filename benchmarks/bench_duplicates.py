@@ -0,0 +1,87 @@
+"""
+Benchmark: duplicate lookups against 1,000,000 posts
+Builds the LSH index from synthetic MinHash signatures (a tenth of them
+near-copies of others), then times lookups of edited copies and of new
+posts, with the same code a submission uses
+Run: python benchmarks/bench_duplicates.py [--posts 1000000] [--queries 1000]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from duplicates import NUM_PERM, DUPLICATE_THRESHOLD
+from minhash import LSHIndex, minhash, similarity
+
+# Share of the minimum hashes an edited copy changes
+EDIT_RATE = 0.2
+WORDS = 300
+
+
+def edited(rng, signatures):
+    """Copies of signatures with EDIT_RATE of their values replaced"""
+    copies = signatures.copy()
+    mask = rng.random(copies.shape) < EDIT_RATE
+    copies[mask] = rng.integers(0, 2 ** 32, size=mask.sum(), dtype=np.uint32)
+    return copies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--posts', type=int, default=1_000_000)
+    parser.add_argument('--queries', type=int, default=1000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    signatures = rng.integers(0, 2 ** 32, size=(args.posts, NUM_PERM), dtype=np.uint32)
+    copies = rng.choice(args.posts, size=args.posts // 10, replace=False)
+    signatures[copies] = edited(rng, signatures[rng.integers(0, args.posts, size=len(copies))])
+    post_ids = np.arange(1, args.posts + 1)
+
+    started = time.perf_counter()
+    index = LSHIndex.build(post_ids, signatures)
+    build_time = time.perf_counter() - started
+
+    def lookup(signature):
+        candidates = index.candidates(signature)
+        if not candidates:
+            return None
+        scores = similarity(signature, signatures[np.array(candidates) - 1])
+        best = int(scores.argmax())
+        return candidates[best] if scores[best] >= DUPLICATE_THRESHOLD else None
+
+    originals = rng.integers(0, args.posts, size=args.queries)
+    results = {}
+    for name, queries in (('edited copies', edited(rng, signatures[originals])),
+                          ('new posts', rng.integers(0, 2 ** 32, size=(args.queries, NUM_PERM), dtype=np.uint32))):
+        latencies, found = [], []
+        for query in queries:
+            started = time.perf_counter()
+            found.append(lookup(query))
+            latencies.append(time.perf_counter() - started)
+        results[name] = (latencies, found)
+
+    words = ' '.join(f'w{i}' for i in rng.integers(0, 20000, size=WORDS))
+    started = time.perf_counter()
+    for _ in range(100):
+        minhash('title', words)
+    signature_time = (time.perf_counter() - started) / 100
+
+    print(f'posts:          {args.posts:,}')
+    print(f'index build:    {build_time:.1f} s ({index.keys.nbytes / 2 ** 20:.0f} MB keys)')
+    print(f'signature:      {signature_time * 1000:.2f} ms ({WORDS} words)')
+    for name, (latencies, found) in results.items():
+        latencies.sort()
+        hits = sum(f is not None for f in found)
+        print(f'{name + ":":15} {statistics.median(latencies) * 1000:.2f} ms median, '
+              f'{latencies[int(len(latencies) * 0.99)] * 1000:.2f} ms p99, flagged {hits}/{len(found)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Benchmark: related posts at 100,000 posts
+Builds the TF-IDF index for synthetic posts (Zipf-distributed words) with
+the same code the job uses, then times related lists for single new posts,
+like the related_updates job does for new approvals
+Run: python benchmarks/bench_related.py [--posts 100000] [--words 150]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tfidf import RelatedIndex
+
+LANGUAGES = ['Python', 'JavaScript', 'HTML', 'CSS', 'Bash', 'C++', 'Java']
+LEVELS = ['junior', 'middle', 'senior']
+VOCABULARY = 50_000
+QUERIES = 50
+
+
+def make_posts(rng, count, words, first_id=1):
+    """(id, title, content, language, level) with Zipf word frequencies"""
+    ranks = np.minimum(rng.zipf(1.3, size=(count, words + 6)), VOCABULARY)
+    posts = []
+    for i, row in enumerate(ranks):
+        text = [f'w{r}' for r in row.tolist()]
+        posts.append((first_id + i, ' '.join(text[:6]), ' '.join(text[6:]),
+                      LANGUAGES[i % len(LANGUAGES)], LEVELS[i % len(LEVELS)]))
+    return posts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--posts', type=int, default=100_000)
+    parser.add_argument('--words', type=int, default=150)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    posts = make_posts(rng, args.posts, args.words)
+
+    started = time.perf_counter()
+    index = RelatedIndex.build(posts)
+    vectors_done = time.perf_counter()
+    post_ids, related_ids, scores = index.nearest(np.arange(len(posts)))
+    build_done = time.perf_counter()
+
+    # One approval at a time: vectorize, append, top-k against everything
+    latencies = []
+    for post in make_posts(rng, QUERIES, args.words, first_id=args.posts + 1):
+        started_one = time.perf_counter()
+        rows = index.add([post])
+        index.nearest(rows)
+        latencies.append(time.perf_counter() - started_one)
+
+    print(f'posts:             {args.posts:,}')
+    print(f'index nnz:         {index.vectors.nnz:,}')
+    print(f'vectors:           {vectors_done - started:.1f} s')
+    print(f'all related lists: {build_done - vectors_done:.1f} s ({len(post_ids):,} rows)')
+    print(f'add one post:      {statistics.median(latencies) * 1000:.1f} ms median, '
+          f'{max(latencies) * 1000:.1f} ms max ({QUERIES} posts)')
+
+
+if __name__ == '__main__':
+    main()
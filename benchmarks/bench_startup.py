@@ -0,0 +1,58 @@
+"""
+Benchmark: application startup time
+Each round starts a fresh Python process, like a gunicorn worker boot.
+Compares importing the app with importing it and running init_database()
+(what every worker did before init-db became a separate command).
+Run: python benchmarks/bench_startup.py [--rounds 5]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = {
+    'import app': 'import app',
+    'import app + init_database': 'import app; app.init_database(app.app)',
+}
+
+TIMER = '''
+import time
+started = time.perf_counter()
+{code}
+print(time.perf_counter() - started)
+'''
+
+
+def time_once(code, env):
+    """Seconds a fresh interpreter needs to run the code"""
+    result = subprocess.run([sys.executable, '-c', TIMER.format(code=code)], cwd=ROOT, env=env,
+                            check=True, capture_output=True, text=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    database_url = os.environ.get('DATABASE_URL', f'sqlite:///{tmpdir}/bench.db')
+    env = dict(os.environ, DATABASE_URL=database_url, RUN_JOBS='0')
+    # Existing database, like a restart; also builds the static assets once
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'devlog', 'init-db'], cwd=ROOT, env=env,
+                   check=True, capture_output=True)
+
+    print(f'rounds: {args.rounds}')
+    print(f'{"scenario":30} {"median ms":>10} {"min ms":>8}')
+    for name, code in SCENARIOS.items():
+        times = [time_once(code, env) for _ in range(args.rounds)]
+        print(f'{name:30} {statistics.median(times) * 1000:10.1f} {min(times) * 1000:8.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""
+Benchmark: follow suggestions for a large graph
+Ranks suggestions for a synthetic 1,000,000-edge follow graph with the same
+code the job uses (popular users get most of the follows)
+Run: python benchmarks/bench_suggestions.py [--users 100000] [--edges 1000000]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from follow_graph import rank_suggestions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--edges', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    follower = rng.integers(0, args.users, size=args.edges, dtype=np.int64)
+    # Zipf-like popularity: a few users have most of the followers
+    followed = (rng.pareto(1.2, size=args.edges) * args.users / 50).astype(np.int64) % args.users
+    levels = rng.integers(0, 3, size=args.users, dtype=np.int64)
+    languages = rng.integers(-1, 8, size=args.users, dtype=np.int64)
+
+    started = time.perf_counter()
+    users, candidates, scores, mutual = rank_suggestions(follower, followed, levels, languages)
+    elapsed = time.perf_counter() - started
+
+    print(f'users:        {args.users:,}')
+    print(f'edges:        {args.edges:,}')
+    print(f'suggestions:  {len(users):,} ({(mutual > 0).sum():,} friends of friends)')
+    print(f'time:         {elapsed:.2f} s')
+
+
+if __name__ == '__main__':
+    main()
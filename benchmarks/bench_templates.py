@@ -0,0 +1,80 @@
+"""
+Benchmark: first requests of a new worker
+Each round starts a fresh Python process, imports the app and times the
+first request to each page, which is when Jinja compiles its templates.
+Compares no bytecode cache, a warm TEMPLATE_CACHE_DIR, and the cache plus
+precompile_templates() at startup (what gunicorn.conf.py does per worker).
+Run: python benchmarks/bench_templates.py [--rounds 5]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PAGES = ['/', '/posts', '/login', '/register', '/user/demo']
+
+# (TEMPLATE_CACHE_DIR used, precompile at startup)
+SCENARIOS = {
+    'no cache': (False, False),
+    'bytecode cache': (True, False),
+    'bytecode cache + precompile': (True, True),
+}
+
+TIMER = '''
+import json, time
+from app import app
+startup = 0.0
+if {precompile}:
+    from templating import precompile_templates
+    startup = precompile_templates(app)[1]
+client = app.test_client()
+times = {{}}
+for page in {pages!r}:
+    started = time.perf_counter()
+    client.get(page)
+    times[page] = time.perf_counter() - started
+print(json.dumps({{'startup': startup, 'pages': times}}))
+'''
+
+
+def time_once(precompile, env):
+    """Precompile seconds and {page: seconds} of one fresh interpreter"""
+    result = subprocess.run([sys.executable, '-c', TIMER.format(precompile=precompile, pages=PAGES)],
+                            cwd=ROOT, env=env, check=True, capture_output=True, text=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    cache_dir = os.path.join(tmpdir, 'templates')
+    database_url = os.environ.get('DATABASE_URL', f'sqlite:///{tmpdir}/bench.db')
+    env = dict(os.environ, DATABASE_URL=database_url, RUN_JOBS='0', DEBUG='0')
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'devlog', 'init-db'], cwd=ROOT,
+                   env=dict(env, TEMPLATE_CACHE_DIR=''), check=True, capture_output=True)
+    # Filled once, like `devlog compile-templates` at build time
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'devlog', 'compile-templates'], cwd=ROOT,
+                   env=dict(env, TEMPLATE_CACHE_DIR=cache_dir), check=True, capture_output=True)
+
+    print(f'rounds: {args.rounds}, pages: {" ".join(PAGES)}')
+    print(f'{"scenario":30} {"startup ms":>10} {"1st page ms":>11} {"all pages ms":>12}')
+    for name, (cached, precompile) in SCENARIOS.items():
+        scenario_env = dict(env, TEMPLATE_CACHE_DIR=cache_dir if cached else '')
+        runs = [time_once(precompile, scenario_env) for _ in range(args.rounds)]
+        startup = statistics.median(run['startup'] for run in runs)
+        first = statistics.median(run['pages'][PAGES[0]] for run in runs)
+        total = statistics.median(sum(run['pages'].values()) for run in runs)
+        print(f'{name:30} {startup * 1000:10.1f} {first * 1000:11.1f} {total * 1000:12.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""
+Benchmark: trending scoring throughput
+Scores 1,000,000 synthetic engagement events with the same code the job uses
+Run: python benchmarks/bench_trending.py
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from trending import WEIGHTS
+from trending_scores import score_events
+
+
+EVENTS = 1_000_000
+POSTS = 50_000
+ROUNDS = 5
+
+
+def main():
+    rng = np.random.default_rng(42)
+    now = time.time()
+    post_ids = rng.integers(1, POSTS + 1, size=EVENTS, dtype=np.int64)
+    timestamps = now - rng.uniform(0, 7 * 24 * 3600, size=EVENTS)
+    weights = rng.choice(np.array(list(WEIGHTS.values())), size=EVENTS)
+
+    best = float('inf')
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        ids, scores = score_events(post_ids, timestamps, weights, now)
+        best = min(best, time.perf_counter() - started)
+
+    print(f'events:     {EVENTS:,}')
+    print(f'posts:      {len(ids):,}')
+    print(f'best time:  {best * 1000:.1f} ms (of {ROUNDS} rounds)')
+    print(f'throughput: {EVENTS / best / 1e6:.1f} M events/s')
+
+
+if __name__ == '__main__':
+    main()
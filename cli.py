@@ -0,0 +1,148 @@
+"""
+Command line tools for DevLog
+Usage: flask --app app devlog <command>
+"""
+
+import contextlib
+import sys
+import time
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from digest import DIGEST_BATCH
+from jobs import JOBS, run_job
+from transfer import IMPORTERS, EXPORTERS, FORMATS, DEFAULT_BATCH, TransferStats, guess_format, read_rows, write_rows
+
+
+devlog_cli = AppGroup('devlog', help='DevLog maintenance commands.')
+
+
+@devlog_cli.command('init-db')
+def init_db():
+    """Create missing tables and the demo users"""
+    from app import init_database
+    init_database(current_app._get_current_object())
+    click.echo('Database ready')
+
+
+@devlog_cli.command('compile-templates')
+def compile_templates_command():
+    """Compile all templates into the bytecode cache (run at build or deploy time)"""
+    from templating import precompile_templates
+    count, elapsed = precompile_templates(current_app._get_current_object())
+    click.echo(f'{count} templates in {elapsed * 1000:.0f} ms -> {current_app.config["TEMPLATE_CACHE_DIR"] or "no cache"}')
+
+
+@devlog_cli.command('jobs')
+def list_jobs():
+    """List background jobs"""
+    for name, info in sorted(JOBS.items()):
+        click.echo(f'{name:20} every {info["interval"]}s')
+
+
+@devlog_cli.command('run-job')
+@click.argument('name')
+def run_job_command(name):
+    """Run one background job now"""
+    if name not in JOBS:
+        raise click.BadParameter(f'unknown job, choose from: {", ".join(sorted(JOBS))}')
+    result = run_job(current_app._get_current_object(), name)
+    click.echo(f'{name}: {result}')
+
+
+@devlog_cli.command('backfill-rollups')
+def backfill_rollups_command():
+    """Rebuild engagement rollups from all likes, reposts and comments"""
+    from rollups import backfill_rollups
+    started = time.perf_counter()
+    result = backfill_rollups()
+    click.echo(f'{result["buckets"]:,} buckets in {time.perf_counter() - started:.1f}s')
+
+
+@devlog_cli.command('compact')
+@click.option('--tune-autovacuum', is_flag=True, help='PostgreSQL: also apply the autovacuum settings')
+def compact_command(tune_autovacuum):
+    """VACUUM/ANALYZE the database and report the reclaimed space"""
+    from maintenance import compact, format_bytes, tune_autovacuum as apply_autovacuum
+    if tune_autovacuum:
+        tables = apply_autovacuum()
+        click.echo(f'Autovacuum tuned: {", ".join(tables) or "not PostgreSQL, skipped"}')
+    started = time.perf_counter()
+    report = compact()
+    click.echo(f'{format_bytes(report["before"])} -> {format_bytes(report["after"])}, '
+               f'reclaimed {format_bytes(report["reclaimed"])} in {time.perf_counter() - started:.1f}s')
+    if 'dead_rows_removed' in report:
+        click.echo(f'{report["dead_rows_removed"]:,} dead rows removed')
+
+
+@devlog_cli.command('digest')
+@click.option('--sink', help='smtp://host:port or a directory for .eml files (default: DIGEST_SINK)')
+@click.option('--workers', type=int, help='processes for rendering (default: all CPUs, 0 renders in this process)')
+@click.option('--batch-size', default=DIGEST_BATCH, show_default=True, help='users per batch')
+@click.option('--restart', is_flag=True, help="start this week's run from the first user")
+def digest_command(sink, workers, batch_size, restart):
+    """Send this week's digest e-mails (resumes an interrupted run)"""
+    from digest import get_sink, send_digests
+    stats = send_digests(get_sink(sink or current_app.config['DIGEST_SINK']),
+                         workers=workers, batch_size=batch_size, restart=restart)
+    click.echo(str(stats), err=True)
+
+
+@devlog_cli.command('backfill-signatures')
+def backfill_signatures_command():
+    """Compute duplicate-detection signatures for posts that have none"""
+    from duplicates import backfill_signatures
+    started = time.perf_counter()
+    count = backfill_signatures()
+    click.echo(f'{count:,} signatures in {time.perf_counter() - started:.1f}s')
+
+
+def open_path(path, mode):
+    """Text file for csv/json, '-' means stdin/stdout"""
+    if path == '-':
+        return contextlib.nullcontext(sys.stdin if mode == 'r' else sys.stdout)
+    return open(path, mode, encoding='utf-8', newline='')
+
+
+@devlog_cli.command('import')
+@click.argument('kind', type=click.Choice(sorted(IMPORTERS)))
+@click.argument('path')
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help='default: from the file extension')
+@click.option('--batch-size', default=DEFAULT_BATCH, show_default=True, help='rows per INSERT')
+@click.option('--workers', type=int, help='processes for password hashing and rendering (default: all CPUs)')
+def import_command(kind, path, fmt, batch_size, workers):
+    """Bulk import users or posts from JSON Lines or CSV ('-' reads stdin)"""
+    fmt = fmt or guess_format(path)
+    with open_path(path, 'r') as file:
+        stats = IMPORTERS[kind](read_rows(file, fmt), batch_size=batch_size, workers=workers)
+    if kind == 'posts':
+        from facets import rebuild_facets
+        from feeds import touch_all
+        from duplicates import backfill_signatures
+        rebuild_facets()
+        touch_all()
+        backfill_signatures()
+    click.echo(str(stats), err=True)
+
+
+@devlog_cli.command('export')
+@click.argument('kind', type=click.Choice(sorted(EXPORTERS)))
+@click.argument('path', default='-')
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help='default: from the file extension')
+@click.option('--batch-size', default=DEFAULT_BATCH, show_default=True, help='rows per fetch')
+def export_command(kind, path, fmt, batch_size):
+    """Export users or posts as JSON Lines or CSV ('-' writes stdout)"""
+    fmt = fmt or guess_format(path)
+    export, fields = EXPORTERS[kind]
+    stats = TransferStats(kind)
+
+    def counted(rows):
+        for row in rows:
+            stats.rows += 1
+            yield row
+
+    with open_path(path, 'w') as file:
+        write_rows(file, fmt, fields, counted(export(batch_size=batch_size)))
+    click.echo(str(stats), err=True)
@@ -0,0 +1,78 @@
+"""
+Comment threads on the post page
+A reply stores the path of ids from its thread root, so all replies of a
+thread are read with one prefix query. Threads are loaded a page at a time.
+"""
+
+from collections import defaultdict
+
+from sqlalchemy.orm import selectinload
+
+from mentions import render_comment, notify_mentions
+from models import db, Comment
+
+
+# Threads (top level comments with their replies) per page
+THREADS_PER_PAGE = 20
+
+# Deeper replies are attached next to their parent instead
+MAX_DEPTH = 5
+
+# Digits per id in Comment.path, keeps paths sortable as text
+PATH_WIDTH = 10
+
+
+def make_path(comment_id, parent=None):
+    """Path of a new comment under parent"""
+    prefix = parent.path if parent is not None else ''
+    return f'{prefix}{comment_id:0{PATH_WIDTH}d}/'
+
+
+def add_comment(post, author, content, parent=None):
+    """Create a comment or a reply and notify mentioned users, returns it (caller commits)"""
+    if parent is not None and parent.depth >= MAX_DEPTH - 1:
+        parent = parent.parent
+    content_html, mentioned = render_comment(content)
+    comment = Comment(content=content, content_html=content_html, author=author, post=post, parent=parent)
+    db.session.add(comment)
+    # The path needs the new id
+    db.session.flush()
+    comment.path = make_path(comment.id, parent)
+    notify_mentions(author.id, [user_id for user_id, _ in mentioned.values()], post.id,
+                    f'{author.username}-მა მოგიხსენიათ კომენტარში "{post.title}"')
+    return comment
+
+
+def get_threads(post_id, after=None, limit=THREADS_PER_PAGE):
+    """Next page of threads -> (comments in display order, id to continue after or None)"""
+    query = Comment.query.options(selectinload(Comment.author))\
+                         .filter(Comment.post_id == post_id, Comment.parent_id.is_(None))
+    if after is not None:
+        cursor = db.session.get(Comment, after)
+        if cursor is not None:
+            query = query.filter(db.or_(
+                Comment.created_at > cursor.created_at,
+                db.and_(Comment.created_at == cursor.created_at, Comment.id > cursor.id)
+            ))
+    roots = query.order_by(Comment.created_at, Comment.id).limit(limit + 1).all()
+    next_after = roots[limit - 1].id if len(roots) > limit else None
+    roots = roots[:limit]
+    if not roots:
+        return [], None
+
+    # Every reply of these threads in one query, already in tree order
+    replies = Comment.query.options(selectinload(Comment.author))\
+                           .filter(Comment.post_id == post_id,
+                                   Comment.parent_id.isnot(None),
+                                   db.or_(*[Comment.path.startswith(root.path) for root in roots]))\
+                           .order_by(Comment.path)\
+                           .all()
+    by_thread = defaultdict(list)
+    for reply in replies:
+        by_thread[reply.path[:PATH_WIDTH + 1]].append(reply)
+
+    comments = []
+    for root in roots:
+        comments.append(root)
+        comments.extend(by_thread[root.path])
+    return comments, next_after
@@ -0,0 +1,110 @@
+"""
+Response compression for pages
+gzip or brotli, also for streamed responses
+"""
+
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+
+# Smaller bodies are sent as they are
+MIN_SIZE = 1024
+COMPRESSIBLE_TYPES = {
+    'text/html',
+    'text/plain',
+    'text/css',
+    'application/json',
+    'application/xml',
+    'application/atom+xml',
+    'application/rss+xml',
+}
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+# Streamed bodies are compressed and flushed in pieces of at least this size
+STREAM_CHUNK = 8 * 1024
+
+
+def choose_encoding():
+    """Best encoding the browser accepts"""
+    if brotli is not None and request.accept_encodings['br']:
+        return 'br'
+    if request.accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+class Compressor:
+    """Same interface for gzip and brotli: compress(chunk) / finish()"""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == 'br':
+            self.obj = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self.obj = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, chunk, flush=False):
+        if self.encoding == 'br':
+            data = self.obj.process(chunk)
+            return data + self.obj.flush() if flush else data
+        data = self.obj.compress(chunk)
+        return data + self.obj.flush(zlib.Z_SYNC_FLUSH) if flush else data
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self.obj.finish()
+        return self.obj.flush()
+
+
+def compress_stream(chunks, encoding):
+    """Compress a streamed body, flushing every STREAM_CHUNK bytes so it reaches the browser now"""
+    compressor = Compressor(encoding)
+    buffer = []
+    size = 0
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= STREAM_CHUNK:
+            yield compressor.compress(b''.join(buffer), flush=True)
+            buffer = []
+            size = 0
+    yield compressor.compress(b''.join(buffer)) + compressor.finish()
+
+
+def compress_response(response):
+    """after_request handler: compress text responses when it is worth it"""
+    if (response.status_code != 200
+            or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding()
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < MIN_SIZE:
+            return response
+        compressor = Compressor(encoding)
+        response.set_data(compressor.compress(data) + compressor.finish())
+
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_compression(app):
+    app.after_request(compress_response)
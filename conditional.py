@@ -0,0 +1,49 @@
+"""
+Conditional GET for pages
+Routes describe the data a page shows (versions, counts, viewer). When the
+browser already has that version we answer 304 before rendering anything.
+"""
+
+import hashlib
+
+from flask import g, request, session, make_response
+
+
+def page_etag(*parts):
+    """Weak ETag from the page's data versions and the viewer"""
+    key = '|'.join(str(part) for part in (session.get('user_id'),) + parts)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def not_modified(*parts):
+    """Return a 304 response if the browser's copy is current, else None
+
+    The ETag is remembered and added to the page response afterwards.
+    """
+    # Pages with flash messages are never cached
+    if session.get('_flashes'):
+        return None
+
+    etag = page_etag(request.path, request.query_string, *parts)
+    g.page_etag = etag
+    if request.if_none_match.contains_weak(etag):
+        response = make_response('', 304)
+        response.set_etag(etag, weak=True)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+    return None
+
+
+def add_page_etag(response):
+    """after_request handler: send the ETag computed by not_modified()"""
+    etag = g.get('page_etag')
+    if etag and response.status_code == 200 and 'ETag' not in response.headers:
+        response.set_etag(etag, weak=True)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    return response
+
+
+def init_conditional(app):
+    app.after_request(add_page_etag)
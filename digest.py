@@ -0,0 +1,322 @@
+"""
+Weekly e-mail digest
+Every user gets the most liked posts of the week from people they follow
+and their unread notifications. Users are read in id order, DIGEST_BATCH at
+a time; each batch needs three queries (follows, unread counts, latest
+notifications), the week's posts are loaded once per run. Messages are
+rendered and serialized in a process pool and handed to a mail sink (a
+directory of .eml files, or an SMTP server) as ready-to-send bytes.
+
+After every batch the last user id is saved as a checkpoint, so a run that
+stops is resumed where it left off. A batch that was sent but not yet
+checkpointed is sent again (at least once delivery).
+"""
+
+import base64
+import heapq
+import logging
+import os
+import smtplib
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from email.header import Header
+from email.utils import formatdate, make_msgid
+
+from flask import current_app
+
+from jobs import job, get_state, set_state
+from models import db, User, Post, Like, Notification, follow_table
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+
+# Users per batch (queries, rendering and sending)
+DIGEST_BATCH = 500
+# Posts and notifications shown in one digest
+TOP_POSTS = 5
+MAX_NOTIFICATIONS = 10
+DIGEST_DAYS = 7
+
+CHECKPOINT_KEY = 'digest:checkpoint'
+DONE_KEY = 'digest:done'
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates', 'email')
+SUBJECT = 'DevLog: კვირის მიმოხილვა'
+# Parts are base64, whose alphabet has no '-', so a fixed boundary never clashes
+BOUNDARY = '--devlog-digest--'
+ENCODED_SUBJECT = Header(SUBJECT, 'utf-8').encode()
+
+# Jinja environment of a render worker, created on first use
+_templates = None
+
+
+class DigestStats:
+    """Counts and speed of one digest run"""
+
+    def __init__(self, week):
+        self.week = week
+        self.users = 0
+        self.sent = 0
+        self.batches = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def as_dict(self):
+        return {'week': self.week, 'users': self.users, 'sent': self.sent,
+                'seconds': round(self.elapsed, 1), 'users_per_second': round(self.users / self.elapsed if self.elapsed else 0)}
+
+    def __str__(self):
+        rate = self.users / self.elapsed if self.elapsed else 0
+        return (f'digest {self.week}: {self.users:,} users, {self.sent:,} sent '
+                f'in {self.elapsed:.1f}s ({rate:,.0f} users/s)')
+
+
+# Mail sinks
+
+# A sink gets lists of (sender, recipient, message bytes) and has send(), which
+# returns how many were accepted, and close()
+
+class FileSink:
+    """Writes every message as an .eml file (development, tests)"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def send(self, messages):
+        for _, recipient, data in messages:
+            with open(os.path.join(self.directory, recipient.replace('/', '_') + '.eml'), 'wb') as file:
+                file.write(data)
+        return len(messages)
+
+    def close(self):
+        pass
+
+
+class SMTPSink:
+    """Sends messages through one SMTP connection per batch"""
+
+    def __init__(self, host, port=25):
+        self.host = host
+        self.port = port
+
+    def send(self, messages):
+        sent = 0
+        with smtplib.SMTP(self.host, self.port) as smtp:
+            for sender, recipient, data in messages:
+                # One refused address must not fail the batch: it would never be
+                # checkpointed and everyone before it would get the mail again
+                try:
+                    smtp.sendmail(sender, [recipient], data)
+                    sent += 1
+                except (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException) as e:
+                    logger.warning(f'Digest to {recipient} not sent: {e}')
+        return sent
+
+    def close(self):
+        pass
+
+
+def get_sink(url):
+    """'smtp://host:port' -> SMTPSink, anything else is a directory for FileSink"""
+    if url.startswith('smtp://'):
+        host, _, port = url[len('smtp://'):].partition(':')
+        return SMTPSink(host, int(port or 25))
+    return FileSink(url[len('file://'):] if url.startswith('file://') else url)
+
+
+# Queries
+
+def week_key(now=None):
+    """ISO week the digest belongs to, '2024-W07'"""
+    year, week, _ = (now or datetime.now()).isocalendar()
+    return f'{year}-W{week:02d}'
+
+
+def week_posts(since):
+    """{author id: [(likes, post id, post dict)]} with each author's TOP_POSTS most liked posts since the date"""
+    likes = db.select(Like.post_id, db.func.count().label('likes'))\
+              .join(Post, Post.id == Like.post_id)\
+              .where(Post.created_at >= since)\
+              .group_by(Like.post_id)\
+              .subquery()
+    rows = db.session.query(Post.id, Post.author_id, Post.title, Post.excerpt, User.username,
+                            db.func.coalesce(likes.c.likes, 0))\
+                     .join(User, User.id == Post.author_id)\
+                     .outerjoin(likes, likes.c.post_id == Post.id)\
+                     .filter(Post.is_published == db.true(), Post.created_at >= since)\
+                     .all()
+    by_author = {}
+    for post_id, author_id, title, excerpt, username, like_count in rows:
+        by_author.setdefault(author_id, []).append(
+            (like_count, post_id, {'id': post_id, 'title': title, 'excerpt': excerpt or '',
+                                   'author': username, 'likes': like_count})
+        )
+    return {author_id: heapq.nlargest(TOP_POSTS, posts) for author_id, posts in by_author.items()}
+
+
+def user_batches(after_id, batch_size):
+    """Active users with an e-mail address in id order, one list per batch"""
+    while True:
+        users = db.session.query(User.id, User.username, User.email)\
+                          .filter(User.id > after_id, User.deleted_at.is_(None), User.email.isnot(None))\
+                          .order_by(User.id)\
+                          .limit(batch_size)\
+                          .all()
+        if not users:
+            return
+        yield users
+        after_id = users[-1].id
+
+
+def followed_by(user_ids):
+    """{user id: [followed ids]} for a batch"""
+    followed = {}
+    rows = db.session.query(follow_table.c.follower_id, follow_table.c.followed_id)\
+                     .filter(follow_table.c.follower_id.in_(user_ids))
+    for follower_id, followed_id in rows:
+        followed.setdefault(follower_id, []).append(followed_id)
+    return followed
+
+
+def unread_notifications(user_ids):
+    """({user id: unread count}, {user id: latest MAX_NOTIFICATIONS unread})"""
+    counts = dict(
+        db.session.query(Notification.user_id, db.func.count())
+                  .filter(Notification.user_id.in_(user_ids), Notification.is_read == db.false())
+                  .group_by(Notification.user_id)
+    )
+    ranked = db.select(
+        Notification.user_id, Notification.message, Notification.created_at,
+        db.func.row_number().over(partition_by=Notification.user_id,
+                                  order_by=Notification.created_at.desc()).label('rank')
+    ).where(Notification.user_id.in_(user_ids), Notification.is_read == db.false()).subquery()
+    latest = {}
+    rows = db.session.execute(db.select(ranked.c.user_id, ranked.c.message, ranked.c.created_at)
+                              .where(ranked.c.rank <= MAX_NOTIFICATIONS)
+                              .order_by(ranked.c.user_id, ranked.c.rank))
+    for user_id, message, created_at in rows:
+        latest.setdefault(user_id, []).append(
+            {'message': message, 'created_at': created_at.strftime('%d.%m.%Y %H:%M') if created_at else ''}
+        )
+    return counts, latest
+
+
+def build_digests(users, posts_by_author):
+    """Plain dicts (they go to the render processes), users with nothing new are left out"""
+    user_ids = [user.id for user in users]
+    followed = followed_by(user_ids)
+    counts, latest = unread_notifications(user_ids)
+    digests = []
+    for user in users:
+        candidates = (post for author_id in followed.get(user.id, ()) for post in posts_by_author.get(author_id, ()))
+        posts = [post for _, _, post in heapq.nlargest(TOP_POSTS, candidates)]
+        if not posts and not counts.get(user.id):
+            continue
+        digests.append({'user_id': user.id, 'username': user.username, 'email': user.email, 'posts': posts,
+                        'unread': counts.get(user.id, 0), 'notifications': latest.get(user.id, [])})
+    return digests
+
+
+# Rendering (runs in worker processes, no app context)
+
+def render_digest(digest, site_url, week, sender):
+    """Digest dict -> (sender, recipient, message bytes) with text and HTML parts"""
+    global _templates
+    if _templates is None:
+        from jinja2 import Environment, FileSystemLoader, select_autoescape
+        _templates = Environment(loader=FileSystemLoader(TEMPLATE_DIR), autoescape=select_autoescape(['html']),
+                                 trim_blocks=True, lstrip_blocks=True)
+    context = dict(digest, site_url=site_url.rstrip('/'), week=week)
+    text = _templates.get_template('digest.txt').render(context)
+    html = _templates.get_template('digest.html').render(context)
+    return sender, digest['email'], mime_message(sender, digest['email'], week, text, html)
+
+
+def mime_message(sender, recipient, week, text, html):
+    """multipart/alternative message bytes
+    Built by hand: the email package spent most of a digest's time folding
+    and encoding the same few headers again for every user."""
+    recipient = recipient.replace('\r', '').replace('\n', '')
+    lines = [
+        f'From: {sender}',
+        f'To: {recipient}',
+        f'Subject: {ENCODED_SUBJECT}',
+        f'Date: {formatdate(localtime=True)}',
+        f'Message-ID: {make_msgid(domain=sender.rpartition("@")[2] or None)}',
+        f'X-DevLog-Digest: {week}',
+        'MIME-Version: 1.0',
+        f'Content-Type: multipart/alternative; boundary="{BOUNDARY}"',
+        '',
+    ]
+    for subtype, body in (('plain', text), ('html', html)):
+        lines += [
+            f'--{BOUNDARY}',
+            f'Content-Type: text/{subtype}; charset="utf-8"',
+            'Content-Transfer-Encoding: base64',
+            '',
+            base64.encodebytes(body.encode('utf-8')).decode('ascii').rstrip('\n').replace('\n', '\r\n'),
+        ]
+    lines += [f'--{BOUNDARY}--', '']
+    return '\r\n'.join(lines).encode('utf-8')
+
+
+# Pipeline
+
+def send_digests(sink, workers=None, batch_size=DIGEST_BATCH, restart=False):
+    """Build, render and send this week's digests, resuming from the checkpoint"""
+    config = current_app.config
+    now = datetime.now()
+    week = week_key(now)
+    stats = DigestStats(week)
+
+    checkpoint = get_state(CHECKPOINT_KEY, '')
+    after_id = 0
+    if not restart and checkpoint.startswith(week + ':'):
+        after_id = int(checkpoint.split(':', 1)[1])
+        logger.info(f'Digest {week}: resuming after user {after_id}')
+
+    posts_by_author = week_posts(now - timedelta(days=DIGEST_DAYS))
+    render_args = (config.get('SITE_URL', ''), week, config.get('DIGEST_FROM', 'devlog@localhost'))
+
+    # workers=0 renders in this process (background job thread)
+    pool = ProcessPoolExecutor(workers) if workers != 0 else None
+    try:
+        for users in user_batches(after_id, batch_size):
+            digests = build_digests(users, posts_by_author)
+            if digests:
+                args = [[arg] * len(digests) for arg in render_args]
+                if pool is not None:
+                    messages = list(pool.map(render_digest, digests, *args, chunksize=max(1, len(digests) // 16)))
+                else:
+                    messages = list(map(render_digest, digests, *args))
+                stats.sent += sink.send(messages)
+            set_state(CHECKPOINT_KEY, f'{week}:{users[-1].id}')
+            db.session.commit()
+            stats.users += len(users)
+            stats.batches += 1
+            if stats.batches % 10 == 0:
+                logger.info(str(stats))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        sink.close()
+
+    set_state(DONE_KEY, week)
+    db.session.commit()
+    return stats
+
+
+@job('digest', interval=3600)
+def weekly_digest():
+    """Send the digest once per ISO week (an interrupted run continues next hour)"""
+    if get_state(DONE_KEY) == week_key():
+        return None
+    config = current_app.config
+    stats = send_digests(get_sink(config.get('DIGEST_SINK', 'digests')), workers=config.get('DIGEST_WORKERS', 0))
+    return stats.as_dict()
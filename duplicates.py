@@ -0,0 +1,110 @@
+"""
+Near-duplicate detection for submitted posts
+A post's title and content are cut into word shingles and summarized by a
+MinHash signature (NUM_PERM minimum hashes) stored in post_signatures. The
+LSH index splits signatures into BANDS bands of ROWS values; posts sharing a
+band are candidates, and a candidate whose estimated Jaccard similarity
+reaches DUPLICATE_THRESHOLD is recorded as the duplicate's original and
+shown in the admin queue.
+
+Each worker keeps the band index in memory: one sorted NumPy array per band,
+searched with binary search, plus a small unsorted part for new posts.
+It is built from post_signatures on first use and picks up signatures
+written by other workers before every check. The NumPy code is in
+minhash.py, imported by the first check.
+"""
+
+import logging
+import re
+
+from jobs import set_state
+from models import db, Post, PostSignature
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+# Words per shingle
+SHINGLE_WORDS = 3
+# Estimated Jaccard similarity from which a post counts as a copy
+DUPLICATE_THRESHOLD = 0.6
+# Candidates verified per check (most shared bands first)
+MAX_CANDIDATES = 50
+# New signatures stay in the unsorted part until there are this many
+MERGE_AT = 5000
+# Post ids below the watermark checked again for signatures committed late
+# (a submission that got a lower id but committed after a newer one)
+RECHECK_WINDOW = 200
+FETCH_BATCH = 10000
+# Fixed, so every process computes the same hashes
+SEED = 20240601
+
+# Bumped when old posts get signatures (backfill), workers then rebuild
+GENERATION_KEY = 'duplicates:generation'
+
+WORD_RE = re.compile(r'\w+')
+
+
+# Checks
+
+def check_post(post_id, title, content):
+    """Store a new post's signature, returns (original post id, similarity) if it is a copy"""
+    import minhash
+    signature = minhash.minhash(title, content)
+    if signature is None:
+        return None
+    candidates = [c for c in minhash.get_index().candidates(signature) if c != post_id]
+    match = None
+    if candidates:
+        ids, others = minhash.fetch_signatures(only=candidates)
+        if len(ids):
+            scores = minhash.similarity(signature, others)
+            best = int(scores.argmax())
+            if scores[best] >= DUPLICATE_THRESHOLD:
+                match = (int(ids[best]), float(scores[best]))
+
+    db.session.add(PostSignature(post_id=post_id, signature=signature.tobytes(),
+                                 duplicate_of=match[0] if match else None,
+                                 similarity=match[1] if match else None))
+    db.session.commit()
+    minhash.add_signature(post_id, signature)
+    return match
+
+
+def duplicate_flags(post_ids):
+    """{post id: (original id, original title, similarity)} for posts flagged as copies"""
+    if not post_ids:
+        return {}
+    rows = db.session.query(PostSignature.post_id, PostSignature.duplicate_of, Post.title, PostSignature.similarity)\
+                     .join(Post, Post.id == PostSignature.duplicate_of)\
+                     .filter(PostSignature.post_id.in_(list(post_ids)))\
+                     .all()
+    return {post_id: (original_id, title, score) for post_id, original_id, title, score in rows}
+
+
+def backfill_signatures():
+    """Signatures for posts that have none (existing and imported posts), no flags"""
+    from minhash import signature_bytes
+    count = 0
+    while True:
+        posts = db.session.query(Post.id, Post.title, Post.content)\
+                          .outerjoin(PostSignature, PostSignature.post_id == Post.id)\
+                          .filter(PostSignature.post_id.is_(None))\
+                          .order_by(Post.id)\
+                          .limit(FETCH_BATCH)\
+                          .all()
+        if not posts:
+            break
+        rows = [{'post_id': post_id, 'signature': signature_bytes(title, content)}
+                for post_id, title, content in posts]
+        db.session.execute(db.insert(PostSignature), rows)
+        db.session.commit()
+        count += len(rows)
+    if count:
+        # Old post ids are below the workers' watermarks, they rebuild
+        set_state(GENERATION_KEY, str(db.session.query(db.func.count(PostSignature.post_id)).scalar()))
+        db.session.commit()
+    return count
@@ -0,0 +1,98 @@
+"""
+Engagement events (likes, reposts, comments) as NumPy arrays
+Shared by the jobs that score or aggregate engagement
+"""
+
+from collections import defaultdict
+from datetime import datetime
+
+import numpy as np
+
+from models import db, Post, Like, Repost, Comment
+
+
+# Event kind -> table it comes from
+EVENT_MODELS = {
+    'like': Like,
+    'repost': Repost,
+    'comment': Comment,
+}
+
+# Rows fetched per round trip
+FETCH_BATCH = 10000
+
+
+def to_timestamps(datetimes):
+    """List of datetimes -> float seconds"""
+    return np.fromiter((d.timestamp() for d in datetimes), dtype=np.float64, count=len(datetimes))
+
+
+def concatenate(chunks, dtype):
+    """Arrays of one column -> one array (empty if there are none)"""
+    return np.concatenate(chunks) if chunks else np.array([], dtype=dtype)
+
+
+def fetch_events(since=None, until=None, published_only=True, with_author=False):
+    """Return {kind: {'post_id', 'author_id', 'ts'}} arrays for events in (since, until]"""
+    events = {}
+    for kind, model in EVENT_MODELS.items():
+        columns = [model.post_id, model.created_at]
+        if with_author:
+            columns.append(Post.author_id)
+        query = db.select(*columns).where(model.post_id.isnot(None), model.created_at.isnot(None))
+        if published_only or with_author:
+            query = query.join(Post, Post.id == model.post_id)
+        if published_only:
+            query = query.where(Post.is_published == db.true())
+        if since is not None:
+            query = query.where(model.created_at > since)
+        if until is not None:
+            query = query.where(model.created_at <= until)
+
+        # Arrays are filled one partition at a time, the rows are never all in memory
+        post_ids, timestamps, author_ids = [], [], []
+        result = db.session.execute(query.execution_options(yield_per=FETCH_BATCH))
+        for rows in result.partitions():
+            post_ids.append(np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows)))
+            timestamps.append(to_timestamps([r[1] for r in rows]))
+            if with_author:
+                author_ids.append(np.fromiter((r[2] for r in rows), dtype=np.int64, count=len(rows)))
+        events[kind] = {
+            'post_id': concatenate(post_ids, np.int64),
+            'ts': concatenate(timestamps, np.float64),
+        }
+        if with_author:
+            events[kind]['author_id'] = concatenate(author_ids, np.int64)
+    return events
+
+
+# Buckets
+
+def bucket_starts(timestamps):
+    """Event timestamps -> (hour starts, day starts), both as timestamps"""
+    hours = np.floor(timestamps / 3600.0) * 3600.0
+    # Days follow local midnight, only the few distinct hours need converting
+    unique_hours, inverse = np.unique(hours, return_inverse=True)
+    day_of_hour = np.array([datetime.fromtimestamp(h).replace(hour=0).timestamp() for h in unique_hours])
+    return hours, day_of_hour[inverse]
+
+
+def count_buckets(events, columns):
+    """fetch_events(with_author=True) arrays -> {(scope, scope_id, period, bucket): {'author_id', column: count}}
+    columns maps each event kind to its count column"""
+    totals = defaultdict(lambda: dict({'author_id': None}, **{column: 0 for column in columns.values()}))
+    for kind, column in columns.items():
+        arrays = events[kind]
+        if not len(arrays['ts']):
+            continue
+        hours, days = bucket_starts(arrays['ts'])
+        for period, buckets in (('hour', hours), ('day', days)):
+            # One np.unique per scope: (id, author, bucket) rows -> counts
+            for scope, ids in (('post', arrays['post_id']), ('author', arrays['author_id'])):
+                keys = np.column_stack([ids, arrays['author_id'], buckets.astype(np.int64)])
+                unique_keys, counts = np.unique(keys, axis=0, return_counts=True)
+                for (scope_id, author_id, bucket), count in zip(unique_keys.tolist(), counts.tolist()):
+                    row = totals[(scope, scope_id, period, bucket)]
+                    row['author_id'] = author_id
+                    row[column] += count
+    return totals
@@ -0,0 +1,101 @@
+"""
+Post counts per language and level for the /posts filters
+Kept up to date when posts are created, approved or deleted,
+so the filter sidebar never has to count the posts table.
+"""
+
+from collections import Counter
+
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from jobs import job
+from models import db, Post, PostFacet
+
+
+def facet_key(language, level, is_published):
+    return (language or '', level or '', bool(is_published))
+
+
+def adjust(changes):
+    """Apply (language, level, is_published, delta) changes (caller commits)"""
+    totals = Counter()
+    for language, level, is_published, delta in changes:
+        totals[facet_key(language, level, is_published)] += delta
+
+    table = PostFacet.__table__
+    # INSERT ... ON CONFLICT DO UPDATE: two requests adding the first post of
+    # a language/level at once both count, neither hits the primary key
+    dialect = db.session.get_bind().dialect.name
+    insert = postgresql_insert if dialect == 'postgresql' else sqlite_insert
+    for (language, level, is_published), delta in totals.items():
+        if delta == 0:
+            continue
+        statement = insert(table).values(language=language, level=level, is_published=is_published,
+                                         count=max(delta, 0))
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=[table.c.language, table.c.level, table.c.is_published],
+            set_={'count': table.c.count + delta}
+        ))
+
+
+@job('facets', interval=24 * 3600)
+def rebuild_facets():
+    """Recount everything from the posts table (fixes any drift)"""
+    rows = db.session.query(Post.language, Post.level, Post.is_published, db.func.count(Post.id))\
+                     .group_by(Post.language, Post.level, Post.is_published)\
+                     .all()
+    counts = Counter()
+    for language, level, is_published, count in rows:
+        counts[facet_key(language, level, is_published)] += count
+
+    db.session.execute(db.delete(PostFacet))
+    if counts:
+        db.session.execute(db.insert(PostFacet), [
+            {'language': k[0], 'level': k[1], 'is_published': k[2], 'count': v}
+            for k, v in counts.items()
+        ])
+    db.session.commit()
+    return len(counts)
+
+
+def count_by(rows, language='', level=''):
+    """Rows of (language, level, count) -> counts for the two filters"""
+    languages = Counter()
+    levels = Counter()
+    for row_language, row_level, count in rows:
+        # Each filter shows counts within the other active filter
+        if not level or row_level == level:
+            languages[row_language] += count
+        if not language or row_language == language:
+            levels[row_level] += count
+    return {'language': languages, 'level': levels}
+
+
+def facet_version(search_query=None):
+    """ETag input that changes whenever facet_counts() would"""
+    if search_query is None:
+        rows = db.session.query(PostFacet.language, PostFacet.level, PostFacet.count)\
+                         .filter(PostFacet.is_published == db.true())\
+                         .all()
+        return tuple(sorted(tuple(row) for row in rows))
+    return tuple(search_query.with_entities(db.func.max(Post.updated_at), db.func.count(Post.id))
+                             .order_by(None).first())
+
+
+def facet_counts(language='', level='', search_query=None):
+    """Published post counts per language and level
+
+    Without a search the small summary table is used. With a search the
+    counts come from the same filtered query that finds the posts.
+    """
+    if search_query is None:
+        rows = db.session.query(PostFacet.language, PostFacet.level, PostFacet.count)\
+                         .filter(PostFacet.is_published == db.true())\
+                         .all()
+    else:
+        rows = search_query.with_entities(Post.language, Post.level, db.func.count(Post.id))\
+                           .group_by(Post.language, Post.level)\
+                           .order_by(None)\
+                           .all()
+    return count_by(rows, language, level)
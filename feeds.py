@@ -0,0 +1,178 @@
+"""
+Atom and RSS feeds of published posts
+There is a global feed, one per author and one per language/level filter.
+Every scope has a version in job_state ('feed:...') that is bumped when a
+post of that scope is approved or deleted. Workers keep each feed's posts
+and rendered XML until its version changes; then only posts published after
+the newest cached one are fetched and deleted ones are dropped. Responses
+carry an ETag and Last-Modified, so pollers mostly get 304s.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from flask import request, render_template, make_response
+
+from jobs import set_state
+from models import db, User, Post, JobState
+
+
+# Posts in one feed
+FEED_SIZE = 20
+# Feeds kept per worker (least recently used are dropped)
+MAX_CACHED_FEEDS = 500
+# Seconds pollers and proxies may reuse a feed without asking
+FEED_MAX_AGE = 60
+
+# format -> (template, content type)
+FORMATS = {
+    'atom': ('feeds/atom.xml', 'application/atom+xml; charset=utf-8'),
+    'rss': ('feeds/rss.xml', 'application/rss+xml; charset=utf-8'),
+}
+
+# Version of every feed (bumped by any approval or deletion, and by imports)
+ALL_KEY = 'feed:*'
+
+# (author id, language, level) -> {'version', 'posts', 'bodies', 'etag', 'last_modified'}
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def scope_keys(author_id=None, language=None, level=None):
+    """job_state names whose versions a feed depends on"""
+    keys = [ALL_KEY]
+    if author_id:
+        keys.append(f'feed:author:{author_id}')
+    if language:
+        keys.append(f'feed:language:{language}')
+    if level:
+        keys.append(f'feed:level:{level}')
+    return keys
+
+
+def touch(posts):
+    """Bump the versions of the feeds that (author_id, language, level) posts appear in"""
+    keys = set()
+    for author_id, language, level in posts:
+        keys.update(scope_keys(author_id, language, level))
+    if not keys:
+        return
+    now = datetime.now().isoformat()
+    for key in sorted(keys):
+        set_state(key, now)
+    db.session.commit()
+
+
+def posts_published(post_ids):
+    """moderation.on_published hook"""
+    touch(db.session.query(Post.author_id, Post.language, Post.level).filter(Post.id.in_(list(post_ids))))
+
+
+def posts_deleted(rows):
+    """purge.on_deleted hook, unpublished posts were in no feed"""
+    touch((row.author_id, row.language, row.level) for row in rows if row.is_published)
+
+
+def touch_all():
+    """Invalidate every feed (after imports)"""
+    set_state(ALL_KEY, datetime.now().isoformat())
+    db.session.commit()
+
+
+def scope_version(keys):
+    """(version string, time of the last change) for a feed, one query"""
+    rows = db.session.query(JobState.name, JobState.value).filter(JobState.name.in_(keys)).all()
+    values = dict(rows)
+    version = '|'.join(values.get(key, '') for key in keys)
+    changed = [datetime.fromisoformat(value) for value in values.values() if value]
+    return version, max(changed) if changed else None
+
+
+def feed_query(author_id, language, level):
+    query = db.session.query(Post.id, Post.title, Post.excerpt, Post.language, Post.level,
+                             Post.published_at, User.username)\
+                      .join(User, User.id == Post.author_id)\
+                      .filter(Post.is_published == db.true(), Post.published_at.isnot(None))
+    if author_id:
+        query = query.filter(Post.author_id == author_id)
+    if language:
+        query = query.filter(Post.language == language)
+    if level:
+        query = query.filter(Post.level == level)
+    return query.order_by(Post.published_at.desc(), Post.id.desc())
+
+
+def load_posts(author_id, language, level, cached_posts=None):
+    """Newest FEED_SIZE posts, reusing a previous list when there is one"""
+    query = feed_query(author_id, language, level)
+    if not cached_posts:
+        return [row._asdict() for row in query.limit(FEED_SIZE)]
+
+    # Only posts published since the newest cached one (same time: approved in one batch)
+    newest = cached_posts[0]['published_at']
+    new = [row._asdict() for row in query.filter(Post.published_at >= newest).limit(FEED_SIZE)]
+    cached_ids = [post['id'] for post in cached_posts]
+    alive = {post_id for (post_id,) in db.session.query(Post.id)
+             .filter(Post.id.in_(cached_ids), Post.is_published == db.true())}
+    new_ids = {post['id'] for post in new}
+    posts = new + [post for post in cached_posts if post['id'] in alive and post['id'] not in new_ids]
+    if len(posts) < FEED_SIZE and len(alive) < len(cached_ids):
+        # Deletions left the feed short, older posts move up
+        return [row._asdict() for row in query.limit(FEED_SIZE)]
+    return posts[:FEED_SIZE]
+
+
+def utc(value):
+    """Naive local time (how the app stores times) -> aware UTC, for the feeds' Z/GMT dates"""
+    return value.astimezone(timezone.utc)
+
+
+def get_feed(author_id=None, language=None, level=None):
+    """Cached feed entry for a scope, refreshed when its version changed"""
+    cache_key = (author_id, language, level)
+    version, changed_at = scope_version(scope_keys(author_id, language, level))
+    with _lock:
+        entry = _cache.get(cache_key)
+        if entry is not None and entry['version'] == version:
+            _cache.move_to_end(cache_key)
+            return entry
+
+    posts = load_posts(author_id, language, level, entry['posts'] if entry else None)
+    times = [post['published_at'] for post in posts[:1]] + ([changed_at] if changed_at else [])
+    last_modified = max(times) if times else datetime(2000, 1, 1)
+    etag = hashlib.sha1(repr((cache_key, version, [post['id'] for post in posts])).encode('utf-8')).hexdigest()
+    entry = {'version': version, 'posts': posts, 'bodies': {}, 'etag': etag,
+             'last_modified': utc(last_modified).replace(microsecond=0)}
+    with _lock:
+        _cache[cache_key] = entry
+        _cache.move_to_end(cache_key)
+        while len(_cache) > MAX_CACHED_FEEDS:
+            _cache.popitem(last=False)
+    return entry
+
+
+def feed_response(fmt, title, link, author_id=None, language=None, level=None):
+    """Atom/RSS response for a scope: 304 when the poller is current, cached XML otherwise"""
+    template, content_type = FORMATS[fmt]
+    entry = get_feed(author_id, language, level)
+    etag = f'{entry["etag"]}-{fmt}'
+    if request.if_none_match.contains(etag) or (
+            not request.if_none_match and request.if_modified_since
+            and request.if_modified_since >= entry['last_modified']):
+        response = make_response('', 304)
+    else:
+        # Rendered once per version and format (links use the host of the first request)
+        body = entry['bodies'].get(fmt)
+        if body is None:
+            body = render_template(template, title=title, link=link, posts=entry['posts'],
+                                   updated=entry['last_modified'], feed_url=request.base_url, utc=utc).encode('utf-8')
+            entry['bodies'][fmt] = body
+        response = make_response(body)
+        response.headers['Content-Type'] = content_type
+    response.set_etag(etag)
+    response.last_modified = entry['last_modified']
+    response.cache_control.public = True
+    response.cache_control.max_age = FEED_MAX_AGE
+    return response
@@ -0,0 +1,144 @@
+"""
+The follow graph as a SciPy sparse matrix, ranked into suggestions
+Imported by the suggestions job only
+"""
+
+import numpy as np
+from scipy import sparse
+
+from models import db, User, Post, follow_table
+from suggestions import (SUGGESTIONS_PER_USER, LEVEL_BONUS, LANGUAGE_BONUS, POPULAR_PER_GROUP, ROW_CHUNK,
+                         FETCH_BATCH)
+
+
+def to_codes(values):
+    """List of strings -> int array, same string same code, None -> -1"""
+    codes = {}
+    return np.array([-1 if v is None else codes.setdefault(v, len(codes)) for v in values], dtype=np.int64)
+
+
+def top_per_user(users, candidates, scores, mutual, limit):
+    """Keep the limit best candidates of every user"""
+    order = np.lexsort((-scores, users))
+    users, candidates, scores, mutual = users[order], candidates[order], scores[order], mutual[order]
+    starts = np.flatnonzero(np.r_[True, users[1:] != users[:-1]]) if len(users) else np.array([], dtype=np.int64)
+    rank = np.arange(len(users)) - np.repeat(starts, np.diff(np.r_[starts, len(users)]))
+    keep = rank < limit
+    return users[keep], candidates[keep], scores[keep], mutual[keep]
+
+
+def friends_of_friends(graph, levels, languages, limit):
+    """Best users followed by the people each user follows -> (users, candidates, scores, mutual)"""
+    n_users = graph.shape[0]
+    parts = []
+    for start in range(0, n_users, ROW_CHUNK):
+        rows = graph[start:start + ROW_CHUNK]
+        # paths[u, c] = how many people u follows follow c
+        paths = rows @ graph
+        # Not someone u already follows (those entries become 0 and are dropped), not u
+        paths = paths - paths.multiply(rows)
+        paths.eliminate_zeros()
+        paths = paths.tocoo()
+        users = paths.row.astype(np.int64) + start
+        candidates = paths.col.astype(np.int64)
+        keep = users != candidates
+        users, candidates, mutual = users[keep], candidates[keep], paths.data[keep].astype(np.int64)
+
+        same_level = (levels[users] == levels[candidates]) & (levels[users] >= 0)
+        same_language = (languages[users] == languages[candidates]) & (languages[users] >= 0)
+        scores = mutual + LEVEL_BONUS * same_level + LANGUAGE_BONUS * same_language
+        parts.append(top_per_user(users, candidates, scores, mutual, limit))
+    if not parts:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, np.array([], dtype=np.float64), empty
+    return [np.concatenate(column) for column in zip(*parts)]
+
+
+def similar_users(graph, levels, languages, taken, limit):
+    """Popular users of the same level and main language for users with short lists"""
+    n_users = graph.shape[0]
+    followers = np.bincount(graph.indices, minlength=n_users)
+
+    # Users without posts are grouped by level only
+    groups = {}
+    for user in np.argsort(-followers, kind='stable').tolist():
+        for key in {(levels[user], languages[user]), (levels[user], -1)}:
+            group = groups.setdefault(key, [])
+            if len(group) < POPULAR_PER_GROUP:
+                group.append(user)
+
+    have = np.bincount(taken[0], minlength=n_users)
+    short = have < limit
+    suggested = {}
+    for user, candidate in zip(taken[0][short[taken[0]]].tolist(), taken[1][short[taken[0]]].tolist()):
+        suggested.setdefault(user, set()).add(candidate)
+
+    top = followers.max() + 1 if n_users else 1
+    users, candidates, scores = [], [], []
+    for user in np.flatnonzero(short).tolist():
+        skip = set(graph.indices[graph.indptr[user]:graph.indptr[user + 1]].tolist())
+        skip.add(user)
+        skip |= suggested.get(user, set())
+        missing = limit - have[user]
+        for candidate in groups.get((levels[user], languages[user]), []):
+            if missing == 0:
+                break
+            if candidate in skip:
+                continue
+            users.append(user)
+            candidates.append(candidate)
+            # Always below a friend of friend (their score is at least 1)
+            scores.append(0.5 * followers[candidate] / top)
+            missing -= 1
+    users = np.array(users, dtype=np.int64)
+    return users, np.array(candidates, dtype=np.int64), np.array(scores, dtype=np.float64), np.zeros(len(users), dtype=np.int64)
+
+
+def rank_suggestions(follower, followed, levels, languages, limit=SUGGESTIONS_PER_USER):
+    """Follow edges as user indexes -> (users, candidates, scores, mutual) arrays"""
+    n_users = len(levels)
+    graph = sparse.csr_matrix((np.ones(len(follower), dtype=np.int32), (follower, followed)),
+                              shape=(n_users, n_users))
+    # Duplicate follow rows count once
+    graph.data[:] = 1
+
+    fof = friends_of_friends(graph, levels, languages, limit)
+    similar = similar_users(graph, levels, languages, fof, limit)
+    return [np.concatenate([a, b]) for a, b in zip(fof, similar)]
+
+
+def load_graph():
+    """Active users and their follows -> (user ids, levels, languages, follower idx, followed idx)"""
+    # Read one partition at a time, only the arrays are kept
+    id_chunks, user_levels = [], []
+    for users in db.session.execute(
+        db.select(User.id, User.level).where(User.deleted_at.is_(None)).order_by(User.id)
+          .execution_options(yield_per=FETCH_BATCH)
+    ).partitions():
+        id_chunks.append(np.fromiter((u[0] for u in users), dtype=np.int64, count=len(users)))
+        user_levels.extend(u[1] for u in users)
+    user_ids = np.concatenate(id_chunks) if id_chunks else np.array([], dtype=np.int64)
+    levels = to_codes(user_levels)
+
+    # Main language: the one an author wrote most published posts in
+    main_language = {}
+    for author_id, language, count in db.session.query(Post.author_id, Post.language, db.func.count(Post.id))\
+                                                .filter(Post.is_published == db.true(), Post.language.isnot(None))\
+                                                .group_by(Post.author_id, Post.language):
+        if count > main_language.get(author_id, (0, None))[0]:
+            main_language[author_id] = (count, language)
+    languages = to_codes([main_language.get(user_id, (0, None))[1] for user_id in user_ids.tolist()])
+
+    edge_chunks = [np.array(rows, dtype=np.int64).reshape(-1, 2) for rows in db.session.execute(
+        db.select(follow_table.c.follower_id, follow_table.c.followed_id)
+          .where(follow_table.c.follower_id.isnot(None), follow_table.c.followed_id.isnot(None))
+          .execution_options(yield_per=FETCH_BATCH)
+    ).partitions()]
+    edges = np.concatenate(edge_chunks) if edge_chunks else np.empty((0, 2), dtype=np.int64)
+
+    # User id -> row in the matrix, edges touching deleted users are dropped
+    index = np.searchsorted(user_ids, edges)
+    valid = (index < len(user_ids)).all(axis=1)
+    index, edges = index[valid], edges[valid]
+    valid = (user_ids[index] == edges).all(axis=1)
+    return user_ids, levels, languages, index[valid, 0], index[valid, 1]
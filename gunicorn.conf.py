@@ -0,0 +1,85 @@
+"""
+Gunicorn settings for DevLog
+Run: gunicorn -c gunicorn.conf.py app:app
+
+WORKER_CLASS=sync (default): one request at a time per worker process.
+Simple and predictable, but a slow client, a big upload or a streamed
+page keeps the whole worker busy.
+
+WORKER_CLASS=gevent: every worker serves up to WORKER_CONNECTIONS requests
+at once in greenlets. While one request waits for the network or for
+Postgres, the others keep running. Use it when there are many slow or
+long-lived connections. CPU heavy work (trending, facets rebuild) still
+blocks a worker, so keep RUN_JOBS=0 there and run jobs from cron.
+"""
+
+import os
+import subprocess
+import sys
+
+
+# Where and how many
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = os.environ.get('WORKER_CLASS', 'sync')
+
+# Requests served at the same time by one gevent worker
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 1000))
+
+# Seconds a worker may stay silent before it is restarted
+timeout = int(os.environ.get('WORKER_TIMEOUT', 30))
+keepalive = 5
+
+# Log requests to stdout
+accesslog = '-'
+
+# Import the app once in the master and fork the workers from it: workers
+# start faster and share memory. Not for gevent, there the app has to be
+# imported after the worker patched the standard library.
+preload_app = os.environ.get('PRELOAD_APP', '0' if worker_class == 'gevent' else '1') == '1'
+
+
+if worker_class == 'gevent':
+    # Many greenlets share one worker, so they need more database connections
+    # (read by app.py when the worker loads the app)
+    os.environ.setdefault('DB_POOL_SIZE', '20')
+    os.environ.setdefault('DB_MAX_OVERFLOW', '20')
+
+
+def on_starting(server):
+    """With INIT_DB=1 create tables and demo users once, before any worker starts"""
+    if os.environ.get('INIT_DB') != '1':
+        return
+    # Separate process, so the master does not import the app when preload_app is off
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'devlog', 'init-db'], check=True)
+
+
+def post_fork(server, worker):
+    """Make psycopg2 cooperative in gevent workers"""
+    if worker_class != 'gevent':
+        return
+    # psycopg2 waits for Postgres inside C code, which would block every
+    # greenlet of the worker. With the wait callback it yields to the others.
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+    server.log.info(f'Worker {worker.pid}: psycopg2 patched for gevent')
+
+
+def post_worker_init(worker):
+    """Per worker setup, runs after the worker loaded the app"""
+    from app import app, RUN_JOBS
+    from models import db
+
+    # Never share database connections the master may have opened before fork
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+    # Templates are loaded before the first request, not during it
+    from templating import precompile_templates
+    precompile_templates(app)
+
+    # Every worker runs the scheduler, the job leases in job_state let only
+    # one of them run each job
+    if RUN_JOBS:
+        from jobs import start_scheduler
+        start_scheduler(app)
@@ -0,0 +1,149 @@
+"""
+Background jobs for DevLog
+A job runs from cron (flask --app app devlog run-job NAME)
+or from a thread inside the app process (RUN_JOBS=1)
+Every gunicorn worker may run the scheduler: a job only runs in the
+process holding its lease (a job_state row), the others skip it.
+"""
+
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from models import db, JobState
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+
+# name -> {'func': function, 'interval': seconds}
+JOBS = {}
+
+# JobState key of a job's last finished run (unix time), kept across restarts
+LAST_RUN_KEY = 'last_run:{}'
+# JobState key naming the process that runs a job right now ('' when free)
+LEASE_KEY = 'lease:{}'
+# A lease older than this is taken over (its process died during the run)
+LEASE_TIMEOUT = 6 * 3600
+# Seconds before a scheduler looks again at a job another process was running
+LEASE_RETRY = 60
+
+
+def job(name, interval):
+    """Register a function as a background job"""
+    def decorator(func):
+        JOBS[name] = {'func': func, 'interval': interval}
+        return func
+    return decorator
+
+
+def get_state(name, default=None):
+    """Read a saved job value (watermark, checkpoint...)"""
+    state = db.session.get(JobState, name)
+    if state is None:
+        return default
+    return state.value
+
+
+def set_state(name, value):
+    """Save a job value (caller commits)"""
+    state = db.session.get(JobState, name)
+    if state is None:
+        state = JobState(name=name)
+        db.session.add(state)
+    state.value = str(value)
+
+
+def last_run(name):
+    """Unix time of the job's last finished run, 0 if it never ran"""
+    return float(get_state(LAST_RUN_KEY.format(name), 0))
+
+
+def acquire_lease(name, owner):
+    """Take the job's lease, False if another process holds it"""
+    key = LEASE_KEY.format(name)
+    if db.session.get(JobState, key) is None:
+        try:
+            db.session.add(JobState(name=key, value=''))
+            db.session.commit()
+        except IntegrityError:
+            # Created by another process at the same moment
+            db.session.rollback()
+    now = datetime.now()
+    # One UPDATE, so only one of the processes racing for it gets the row
+    taken = db.session.execute(
+        db.update(JobState)
+          .where(JobState.name == key,
+                 (JobState.value == '') | (JobState.updated_at < now - timedelta(seconds=LEASE_TIMEOUT)))
+          .values(value=owner, updated_at=now),
+        execution_options={'synchronize_session': False}
+    ).rowcount
+    db.session.commit()
+    return taken == 1
+
+
+def release_lease(name, owner):
+    db.session.execute(
+        db.update(JobState)
+          .where(JobState.name == LEASE_KEY.format(name), JobState.value == owner)
+          .values(value=''),
+        execution_options={'synchronize_session': False}
+    )
+    db.session.commit()
+
+
+def run_job(app, name, if_due=False):
+    """Run one job inside an app context
+    Returns None without running when another process holds the job's lease,
+    or with if_due when another process ran it within its interval."""
+    with app.app_context():
+        owner = f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'[:255]
+        if not acquire_lease(name, owner):
+            logger.info(f'Job {name} is running in another process, skipped')
+            return None
+        try:
+            if if_due and time.time() < last_run(name) + JOBS[name]['interval']:
+                return None
+            started = time.perf_counter()
+            try:
+                result = JOBS[name]['func']()
+                set_state(LAST_RUN_KEY.format(name), time.time())
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            logger.info(f'Job {name} finished in {time.perf_counter() - started:.2f}s: {result}')
+            return result
+        finally:
+            release_lease(name, owner)
+
+
+def start_scheduler(app):
+    """Run every registered job on its interval in a daemon thread
+    The interval counts from the last run saved in job_state, so a restart
+    or deploy does not run every job again."""
+    def loop():
+        with app.app_context():
+            next_run = {name: last_run(name) + info['interval'] for name, info in JOBS.items()}
+        while True:
+            for name, info in JOBS.items():
+                if time.time() >= next_run[name]:
+                    try:
+                        run_job(app, name, if_due=True)
+                        # Another process may have run it or still be running it
+                        with app.app_context():
+                            next_run[name] = max(last_run(name) + info['interval'], time.time() + LEASE_RETRY)
+                    except Exception as e:
+                        logger.error(f'Job {name} failed: {e}')
+                        next_run[name] = time.time() + info['interval']
+            time.sleep(1)
+
+    thread = threading.Thread(target=loop, name='devlog-jobs', daemon=True)
+    thread.start()
+    logger.info(f'Job scheduler started: {", ".join(JOBS)}')
+    return thread
@@ -0,0 +1,121 @@
+"""
+Database housekeeping
+Old notifications are deleted in small batches, and the database is
+compacted once a day: VACUUM + ANALYZE on SQLite, VACUUM ANALYZE of the
+busiest tables on PostgreSQL, where tune_autovacuum() also makes autovacuum
+visit those tables sooner. Every compaction reports the space it reclaimed.
+"""
+
+import logging
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from jobs import job
+from models import db, Notification
+from purge import delete_in_batches
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+
+# Tables that get many inserts and deletes
+BUSY_TABLES = ('notifications', 'messages', 'message_archives', 'likes', 'user_sessions')
+
+# PostgreSQL storage parameters for BUSY_TABLES (defaults wait for 20% dead rows)
+AUTOVACUUM_SETTINGS = {
+    'autovacuum_vacuum_scale_factor': 0.02,
+    'autovacuum_analyze_scale_factor': 0.01,
+}
+
+
+def format_bytes(size):
+    """1536 -> '1.5 KB'"""
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(size) < 1024 or unit == 'GB':
+            return f'{size:.0f} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
+        size /= 1024
+
+
+@job('retention', interval=3600)
+def apply_retention():
+    """Delete read notifications past retention, and very old unread ones"""
+    now = datetime.now()
+    read_cutoff = now - timedelta(days=current_app.config.get('NOTIFICATION_RETENTION_DAYS', 90))
+    unread_cutoff = now - timedelta(days=current_app.config.get('UNREAD_RETENTION_DAYS', 365))
+    return {
+        'read': delete_in_batches(Notification, (Notification.is_read == db.true())
+                                  & (Notification.created_at < read_cutoff)),
+        'unread': delete_in_batches(Notification, Notification.created_at < unread_cutoff),
+    }
+
+
+def database_size(conn):
+    """Bytes used by the database (SQLite: file size minus free pages)"""
+    if conn.dialect.name == 'sqlite':
+        page_size = conn.exec_driver_sql('PRAGMA page_size').scalar()
+        pages = conn.exec_driver_sql('PRAGMA page_count').scalar()
+        return {'size': page_size * pages,
+                'free': page_size * conn.exec_driver_sql('PRAGMA freelist_count').scalar()}
+    return {
+        'size': conn.execute(db.text('SELECT pg_database_size(current_database())')).scalar(),
+        'dead_rows': conn.execute(db.text(
+            'SELECT COALESCE(SUM(n_dead_tup), 0) FROM pg_stat_user_tables WHERE relname = ANY(:tables)'
+        ), {'tables': leaf_tables(conn)}).scalar(),
+    }
+
+
+def leaf_tables(conn, tables=BUSY_TABLES):
+    """PostgreSQL: tables holding the rows, a partitioned table (messages) is replaced by its partitions"""
+    leaves = []
+    for table in tables:
+        leaves.extend(conn.execute(db.text(
+            'SELECT c.relname FROM pg_partition_tree(CAST(:table AS regclass)) AS t '
+            'JOIN pg_class c ON c.oid = t.relid WHERE t.isleaf'
+        ), {'table': table}).scalars())
+    return leaves
+
+
+def compact():
+    """VACUUM and ANALYZE, returns sizes before/after and the reclaimed bytes"""
+    # VACUUM cannot run inside a transaction
+    db.session.close()
+    with db.engine.connect() as conn:
+        conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+        before = database_size(conn)
+        if conn.dialect.name == 'sqlite':
+            conn.exec_driver_sql('VACUUM')
+            conn.exec_driver_sql('ANALYZE')
+        else:
+            for table in BUSY_TABLES:
+                conn.exec_driver_sql(f'VACUUM (ANALYZE) {table}')
+        after = database_size(conn)
+    report = {'before': before['size'], 'after': after['size'], 'reclaimed': before['size'] - after['size']}
+    if 'dead_rows' in before:
+        report['dead_rows_removed'] = before['dead_rows'] - after['dead_rows']
+    logger.info(f'Compaction reclaimed {format_bytes(report["reclaimed"])} '
+                f'({format_bytes(report["before"])} -> {format_bytes(report["after"])})')
+    return report
+
+
+@job('compact', interval=24 * 3600)
+def compact_database():
+    """Daily VACUUM/ANALYZE"""
+    return compact()
+
+
+def set_autovacuum(conn, tables):
+    """Apply AUTOVACUUM_SETTINGS to tables (not to a partitioned parent, PostgreSQL rejects that)"""
+    settings = ', '.join(f'{name} = {value}' for name, value in AUTOVACUUM_SETTINGS.items())
+    for table in tables:
+        conn.exec_driver_sql(f'ALTER TABLE {table} SET ({settings})')
+
+
+def tune_autovacuum():
+    """PostgreSQL: vacuum and analyze BUSY_TABLES (their partitions) after fewer changes"""
+    if db.engine.dialect.name != 'postgresql':
+        return []
+    with db.engine.begin() as conn:
+        tables = leaf_tables(conn)
+        set_autovacuum(conn, tables)
+    return tables
@@ -0,0 +1,131 @@
+"""
+@username mentions in posts and comments
+Handles are collected from the text, resolved with one IN query and turned
+into profile links that are stored with the rendered HTML, so pages never
+look users up. Mentioned users get one notification each, written with a
+single bulk INSERT.
+"""
+
+import re
+from datetime import datetime
+
+from markupsafe import escape
+
+from models import db, User, Post, Notification
+
+
+# @name not preceded by a word character (skips e-mail addresses)
+MENTION_RE = re.compile(r'(?<![\w@/])@([A-Za-z0-9_][A-Za-z0-9_.-]{0,79})')
+# Fenced code blocks and inline code, mentions there are not real
+CODE_RE = re.compile(r'```.*?```|~~~.*?~~~|`[^`\n]*`', re.S)
+# HTML tags (split keeps them), the name of one, and tags whose text is not linked
+TAG_RE = re.compile(r'(<[^>]*>)')
+TAG_NAME_RE = re.compile(r'<(/?)([a-zA-Z0-9]+)')
+SKIP_TAGS = ('a', 'pre', 'code')
+
+# Mentions beyond this many in one text are ignored
+MAX_MENTIONS = 20
+
+PROFILE_URL = '/user/{}'
+
+
+def extract_mentions(text):
+    """Lowercased handles mentioned in the text, in order, without duplicates"""
+    handles = []
+    for match in MENTION_RE.finditer(CODE_RE.sub(' ', text or '')):
+        # A sentence may end right after the name
+        handle = match.group(1).rstrip('.-').lower()
+        if handle and handle not in handles:
+            handles.append(handle)
+            if len(handles) == MAX_MENTIONS:
+                break
+    return handles
+
+
+def resolve_mentions(handles):
+    """{lowercased handle: (user id, username)} for existing users, one query"""
+    handles = set(handles)
+    if not handles:
+        return {}
+    # Called while a new post/comment is being built, it must not be flushed half done
+    with db.session.no_autoflush:
+        rows = db.session.query(User.id, User.username)\
+                         .filter(db.func.lower(User.username).in_(handles), User.deleted_at.is_(None))\
+                         .all()
+    return {username.lower(): (user_id, username) for user_id, username in rows}
+
+
+def link_text(text, users):
+    """Replace known @handles in plain (already escaped) text with profile links"""
+    def replace(match):
+        handle = match.group(1).rstrip('.-')
+        user = users.get(handle.lower())
+        if user is None:
+            return match.group(0)
+        rest = match.group(1)[len(handle):]
+        return f'<a href="{PROFILE_URL.format(user[1])}" class="mention">@{escape(user[1])}</a>{rest}'
+    return MENTION_RE.sub(replace, text)
+
+
+def link_mentions(html, users):
+    """Link @handles in HTML text, leaving links and code alone"""
+    if not users:
+        return html
+    parts = TAG_RE.split(html)
+    skip = 0
+    for i, part in enumerate(parts):
+        if i % 2:
+            tag = TAG_NAME_RE.match(part)
+            if tag and tag.group(2).lower() in SKIP_TAGS:
+                skip += -1 if tag.group(1) else 1
+        elif part and skip <= 0:
+            parts[i] = link_text(part, users)
+    return ''.join(parts)
+
+
+def render_comment(content):
+    """Comment text -> escaped HTML with mention links, plus the mentioned users"""
+    users = resolve_mentions(extract_mentions(content))
+    return link_text(str(escape(content or '')), users), users
+
+
+def mention_notification(user_id, sender_id, post_id, message):
+    """Row for a bulk INSERT into notifications"""
+    return {
+        'user_id': user_id,
+        'sender_id': sender_id,
+        'post_id': post_id,
+        'action': 'mention',
+        'message': message,
+        'is_read': False,
+        'created_at': datetime.now(),
+    }
+
+
+def notify_mentions(sender_id, user_ids, post_id, message):
+    """One notification per mentioned user in a single INSERT (caller commits)"""
+    rows = [mention_notification(user_id, sender_id, post_id, message)
+            for user_id in dict.fromkeys(user_ids) if user_id != sender_id]
+    if rows:
+        db.session.execute(db.insert(Notification), rows)
+    return len(rows)
+
+
+def notify_post_mentions(post_ids):
+    """After approval: tell users mentioned in the published posts"""
+    posts = db.session.query(Post.id, Post.title, Post.content, Post.author_id, User.username)\
+                      .join(User, User.id == Post.author_id)\
+                      .filter(Post.id.in_(list(post_ids)))\
+                      .all()
+    handles = {post.id: extract_mentions(post.content) for post in posts}
+    # Every handle of the whole batch in one query
+    users = resolve_mentions(h for post_handles in handles.values() for h in post_handles)
+    rows = [
+        mention_notification(users[handle][0], post.author_id, post.id,
+                             f'{post.username}-მა მოგიხსენიათ პოსტში "{post.title}"')
+        for post in posts for handle in handles[post.id]
+        if handle in users and users[handle][0] != post.author_id
+    ]
+    if rows:
+        db.session.execute(db.insert(Notification), rows)
+        db.session.commit()
@@ -0,0 +1,152 @@
+"""
+Partitioned messages table on PostgreSQL
+MESSAGE_PARTITIONING picks the layout:
+  'hash'  - MESSAGE_PARTITIONS partitions by conversation_id; a thread
+            (WHERE conversation_id = ...) reads a single partition
+  'month' - one partition per month of created_at plus a default one;
+            the archive job's old-message scans only touch old months
+  ''      - a plain table (always on SQLite)
+The table is created by init_database() on a new database and converted
+by migrate_add_conversation_id.py on an existing one.
+"""
+
+import logging
+from datetime import date
+
+from flask import current_app
+
+from jobs import job
+from maintenance import set_autovacuum
+from models import db, Message
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+
+PARTITION_MODES = ('hash', 'month')
+# Monthly partitions created ahead of time (a month without one fills the default partition)
+MONTHS_AHEAD = 3
+# Rows copied per statement when converting an existing table
+COPY_BATCH = 50000
+
+COLUMNS = 'id, content, is_read, created_at, sender_id, receiver_id, conversation_id'
+
+
+def partitioning_enabled(engine):
+    mode = current_app.config.get('MESSAGE_PARTITIONING', '')
+    return mode if mode in PARTITION_MODES and engine.dialect.name == 'postgresql' else ''
+
+
+def table_ddl(mode, name='messages'):
+    """CREATE TABLE for the partitioned parent (the partition key must be in the primary key)"""
+    key, partition_by = ('conversation_id', 'HASH (conversation_id)') if mode == 'hash' \
+        else ('created_at', 'RANGE (created_at)')
+    return f"""
+        CREATE TABLE {name} (
+            id SERIAL,
+            content TEXT,
+            is_read BOOLEAN DEFAULT false,
+            created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now(),
+            sender_id INTEGER REFERENCES users (id) ON DELETE CASCADE,
+            receiver_id INTEGER REFERENCES users (id) ON DELETE CASCADE,
+            conversation_id BIGINT NOT NULL,
+            PRIMARY KEY ({key}, id)
+        ) PARTITION BY {partition_by}
+    """
+
+
+def month_start(year, month):
+    return date(year + (month - 1) // 12, (month - 1) % 12 + 1, 1)
+
+
+def create_month_partitions(conn, first, last):
+    """Partitions for every month from first to last (dates), existing ones are kept"""
+    created = []
+    current = month_start(first.year, first.month)
+    while current <= last:
+        following = month_start(current.year, current.month + 1)
+        name = f'messages_{current:%Y_%m}'
+        exists = conn.execute(db.text("SELECT to_regclass(:name)"), {'name': name}).scalar()
+        if exists is None:
+            conn.execute(db.text(
+                f"CREATE TABLE {name} PARTITION OF messages "
+                f"FOR VALUES FROM ('{current.isoformat()}') TO ('{following.isoformat()}')"
+            ))
+            created.append(name)
+        current = following
+    return created
+
+
+def create_partitioned_table(conn, mode, partitions, first_month=None):
+    """Partitioned messages table with its partitions and indexes"""
+    conn.execute(db.text(table_ddl(mode)))
+    if mode == 'hash':
+        for remainder in range(partitions):
+            conn.execute(db.text(
+                f"CREATE TABLE messages_p{remainder:02d} PARTITION OF messages "
+                f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})"
+            ))
+    else:
+        conn.execute(db.text("CREATE TABLE messages_default PARTITION OF messages DEFAULT"))
+        today = date.today()
+        create_month_partitions(conn, first_month or today, month_start(today.year, today.month + MONTHS_AHEAD))
+    # Indexes on the parent are created on every partition
+    for index in Message.__table__.indexes:
+        index.create(conn)
+
+
+def create_messages_table(engine):
+    """init_database(): the partitioned table on a new PostgreSQL database, returns True if created"""
+    mode = partitioning_enabled(engine)
+    if not mode or db.inspect(engine).has_table('messages'):
+        return False
+    # The users table first, messages refers to it
+    db.metadata.create_all(engine, tables=[t for t in db.metadata.sorted_tables if t.name != 'messages'])
+    with engine.begin() as conn:
+        create_partitioned_table(conn, mode, current_app.config.get('MESSAGE_PARTITIONS', 16))
+    logger.info(f'Partitioned messages table created ({mode})')
+    return True
+
+
+def convert_table(engine, mode, partitions):
+    """Move an existing plain messages table into a partitioned one, COPY_BATCH rows per statement
+    Run with the app stopped: messages written during the copy could be lost."""
+    with engine.begin() as conn:
+        first = conn.execute(db.text("SELECT min(created_at) FROM messages")).scalar()
+        conn.execute(db.text("ALTER TABLE messages RENAME TO messages_unpartitioned"))
+        conn.execute(db.text("ALTER TABLE messages_unpartitioned RENAME CONSTRAINT messages_pkey TO messages_unpartitioned_pkey"))
+        for index in db.inspect(conn).get_indexes('messages_unpartitioned'):
+            conn.execute(db.text(f'DROP INDEX IF EXISTS "{index["name"]}"'))
+        create_partitioned_table(conn, mode, partitions, first_month=first.date() if first else None)
+
+    copied = 0
+    with engine.connect() as conn:
+        last_id = conn.execute(db.text("SELECT COALESCE(max(id), 0) FROM messages_unpartitioned")).scalar()
+    for start in range(0, last_id, COPY_BATCH):
+        with engine.begin() as conn:
+            copied += conn.execute(db.text(
+                f"INSERT INTO messages ({COLUMNS}) "
+                f"SELECT id, content, is_read, COALESCE(created_at, now()), sender_id, receiver_id, conversation_id "
+                f"FROM messages_unpartitioned WHERE id > :start AND id <= :end"
+            ), {'start': start, 'end': start + COPY_BATCH}).rowcount
+        logger.info(f'Copied {copied:,} messages')
+
+    with engine.begin() as conn:
+        conn.execute(db.text(
+            "SELECT setval(pg_get_serial_sequence('messages', 'id'), GREATEST((SELECT max(id) FROM messages), 1))"
+        ))
+        conn.execute(db.text("DROP TABLE messages_unpartitioned"))
+    return copied
+
+
+@job('message_partitions', interval=24 * 3600)
+def add_month_partitions():
+    """'month' layout: create the partitions of the coming months, with the busy table autovacuum settings"""
+    if partitioning_enabled(db.engine) != 'month':
+        return None
+    today = date.today()
+    with db.engine.begin() as conn:
+        created = create_month_partitions(conn, today, month_start(today.year, today.month + MONTHS_AHEAD))
+        # Like the partitions tune_autovacuum() already set
+        set_autovacuum(conn, created)
+    return created
@@ -0,0 +1,97 @@
+"""
+Migration script to add ON DELETE CASCADE to foreign keys and the
+'deleted_at' column to the users table
+PostgreSQL: foreign keys are dropped and added again with ON DELETE CASCADE
+SQLite: constraints cannot be changed, tables are rebuilt and rows copied
+Run this once to update existing database
+"""
+
+from app import app, db
+
+def cascade_foreign_keys(table):
+    """(columns, referred table, referred columns) of model foreign keys with ON DELETE CASCADE"""
+    return [
+        ([c.parent.name for c in fk.elements], fk.elements[0].column.table.name,
+         [c.column.name for c in fk.elements])
+        for fk in table.foreign_key_constraints if fk.ondelete == 'CASCADE'
+    ]
+
+def migrate_postgresql(conn, inspector):
+    """Replace foreign keys that lack ON DELETE CASCADE"""
+    for table in db.metadata.sorted_tables:
+        wanted = cascade_foreign_keys(table)
+        if not wanted:
+            continue
+        for fk in inspector.get_foreign_keys(table.name):
+            key = (fk['constrained_columns'], fk['referred_table'], fk['referred_columns'])
+            if key not in wanted or (fk.get('options') or {}).get('ondelete', '').upper() == 'CASCADE':
+                continue
+            print(f"Updating {table.name}.{fk['name']}...")
+            conn.execute(db.text(
+                f"ALTER TABLE {table.name} DROP CONSTRAINT {fk['name']}, "
+                f"ADD CONSTRAINT {fk['name']} FOREIGN KEY ({', '.join(key[0])}) "
+                f"REFERENCES {key[1]} ({', '.join(key[2])}) ON DELETE CASCADE"
+            ))
+
+def migrate_sqlite(conn, inspector):
+    """Rebuild tables whose foreign keys lack ON DELETE CASCADE"""
+    for table in db.metadata.sorted_tables:
+        if not cascade_foreign_keys(table) or not inspector.has_table(table.name):
+            continue
+        current = inspector.get_foreign_keys(table.name)
+        if current and all((fk.get('options') or {}).get('ondelete', '').upper() == 'CASCADE' for fk in current):
+            continue
+        print(f"Rebuilding {table.name}...")
+        columns = [c['name'] for c in inspector.get_columns(table.name) if c['name'] in table.c]
+        column_list = ', '.join(columns)
+
+        # New table without indexes (their names are still taken by the old table)
+        new_table = table.to_metadata(db.metadata, name=f'{table.name}_new')
+        new_table.indexes.clear()
+        new_table.create(conn)
+        db.metadata.remove(new_table)
+        conn.execute(db.text(f"INSERT INTO {new_table.name} ({column_list}) SELECT {column_list} FROM {table.name}"))
+        conn.execute(db.text(f"DROP TABLE {table.name}"))
+        conn.execute(db.text(f"ALTER TABLE {new_table.name} RENAME TO {table.name}"))
+        for index in table.indexes:
+            index.create(conn)
+
+def migrate():
+    """Add users.deleted_at and ON DELETE CASCADE foreign keys"""
+    with app.app_context():
+        try:
+            columns = [c['name'] for c in db.inspect(db.engine).get_columns('users')]
+
+            with db.engine.begin() as conn:
+                if 'deleted_at' not in columns:
+                    print("Adding 'deleted_at' column to users table...")
+                    conn.execute(db.text("ALTER TABLE users ADD COLUMN deleted_at TIMESTAMP"))
+                    conn.execute(db.text("CREATE INDEX IF NOT EXISTS ix_users_deleted_at ON users (deleted_at)"))
+                    print("✓ Column added successfully!")
+                else:
+                    print("✓ Column 'deleted_at' already exists!")
+
+            with db.engine.connect() as conn:
+                if db.engine.dialect.name == 'sqlite':
+                    # Must be switched off outside a transaction, or the rebuild cascades
+                    conn.exec_driver_sql("PRAGMA foreign_keys=OFF")
+                    conn.commit()
+                    migrate_sqlite(conn, db.inspect(conn))
+                    problems = conn.exec_driver_sql("PRAGMA foreign_key_check").all()
+                    if problems:
+                        print(f"⚠ {len(problems)} rows point to missing rows (see PRAGMA foreign_key_check)")
+                    conn.commit()
+                    conn.exec_driver_sql("PRAGMA foreign_keys=ON")
+                    conn.commit()
+                else:
+                    migrate_postgresql(conn, db.inspect(conn))
+                    conn.commit()
+            print("✓ Foreign keys cascade on delete!")
+
+        except Exception as e:
+            print(f"Error during migration: {e}")
+            print("\nAlternative: You can reset the database by running:")
+            print("python reset_db.py")
+
+if __name__ == '__main__':
+    migrate()
@@ -0,0 +1,48 @@
+"""
+Migration script to add 'content_html' column to comments table
+Run this once to update existing database, it also links @mentions in old
+comments (no notifications are sent for them)
+"""
+
+from app import app, db
+from models import Comment
+from mentions import extract_mentions, resolve_mentions, link_text
+from markupsafe import escape
+
+# Comments rendered per query
+BATCH = 500
+
+def migrate():
+    """Add content_html column and render existing comments"""
+    with app.app_context():
+        try:
+            columns = [c['name'] for c in db.inspect(db.engine).get_columns('comments')]
+            
+            if 'content_html' not in columns:
+                print("Adding 'content_html' column to comments table...")
+                with db.engine.begin() as conn:
+                    conn.execute(db.text("ALTER TABLE comments ADD COLUMN content_html TEXT"))
+                print("✓ Column added successfully!")
+            else:
+                print("✓ Column 'content_html' already exists!")
+            
+            # Render comments that don't have HTML yet, one user lookup per batch
+            rendered = 0
+            while True:
+                comments = Comment.query.filter(Comment.content_html.is_(None)).limit(BATCH).all()
+                if not comments:
+                    break
+                users = resolve_mentions(h for c in comments for h in extract_mentions(c.content))
+                for comment in comments:
+                    comment.content_html = link_text(str(escape(comment.content or '')), users)
+                db.session.commit()
+                rendered += len(comments)
+            print(f"✓ Rendered {rendered} comments!")
+                    
+        except Exception as e:
+            print(f"Error during migration: {e}")
+            print("\nAlternative: You can reset the database by running:")
+            print("python reset_db.py")
+
+if __name__ == '__main__':
+    migrate()
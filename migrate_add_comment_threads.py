@@ -0,0 +1,64 @@
+"""
+Migration script to add reply threads to the comments table
+Adds 'parent_id' and 'path' columns, the comment indexes and fills
+the path of existing comments
+Run this once to update existing database
+"""
+
+from app import app, db
+from models import Comment
+from comments import make_path
+
+# Comments updated per statement
+BATCH_SIZE = 1000
+
+def migrate():
+    """Add parent_id/path columns and indexes, fill path for existing comments"""
+    with app.app_context():
+        try:
+            columns = [c['name'] for c in db.inspect(db.engine).get_columns('comments')]
+            
+            with db.engine.begin() as conn:
+                if 'parent_id' not in columns:
+                    print("Adding 'parent_id' column to comments table...")
+                    conn.execute(db.text("ALTER TABLE comments ADD COLUMN parent_id INTEGER REFERENCES comments(id)"))
+                    print("✓ Column added successfully!")
+                else:
+                    print("✓ Column 'parent_id' already exists!")
+                
+                if 'path' not in columns:
+                    print("Adding 'path' column to comments table...")
+                    conn.execute(db.text("ALTER TABLE comments ADD COLUMN path VARCHAR(255)"))
+                    print("✓ Column added successfully!")
+                else:
+                    print("✓ Column 'path' already exists!")
+            
+            print("Adding comment indexes...")
+            for index in Comment.__table__.indexes:
+                index.create(db.engine, checkfirst=True)
+            print("✓ Indexes are in place!")
+            
+            # Existing comments are all top level
+            table = Comment.__table__
+            updated = 0
+            while True:
+                with db.engine.begin() as conn:
+                    ids = conn.execute(
+                        db.select(table.c.id).where(table.c.path.is_(None)).limit(BATCH_SIZE)
+                    ).scalars().all()
+                    if not ids:
+                        break
+                    conn.execute(
+                        table.update().where(table.c.id == db.bindparam('comment_id')),
+                        [{'comment_id': i, 'path': make_path(i)} for i in ids]
+                    )
+                updated += len(ids)
+            print(f"✓ {updated} comments updated!")
+                    
+        except Exception as e:
+            print(f"Error during migration: {e}")
+            print("\nAlternative: You can reset the database by running:")
+            print("python reset_db.py")
+
+if __name__ == '__main__':
+    migrate()
@@ -0,0 +1,35 @@
+"""
+Migration script to add 'content_html' column to posts table
+Run this once to update existing database, it also renders old posts
+"""
+
+from app import app, db
+from models import Post
+from rendering import render_posts
+
+def migrate():
+    """Add content_html column and render existing posts"""
+    with app.app_context():
+        try:
+            columns = [c['name'] for c in db.inspect(db.engine).get_columns('posts')]
+            
+            if 'content_html' not in columns:
+                print("Adding 'content_html' column to posts table...")
+                with db.engine.begin() as conn:
+                    conn.execute(db.text("ALTER TABLE posts ADD COLUMN content_html TEXT"))
+                print("✓ Column added successfully!")
+            else:
+                print("✓ Column 'content_html' already exists!")
+            
+            # Render posts that don't have HTML yet
+            post_ids = [row.id for row in db.session.query(Post.id).filter(Post.content_html.is_(None))]
+            render_posts(post_ids)
+            print(f"✓ Rendered {len(post_ids)} posts!")
+                    
+        except Exception as e:
+            print(f"Error during migration: {e}")
+            print("\nAlternative: You can reset the database by running:")
+            print("python reset_db.py")
+
+if __name__ == '__main__':
+    migrate()
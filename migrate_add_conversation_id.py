@@ -0,0 +1,73 @@
+"""
+Migration script to add 'conversation_id' column to messages table
+Existing messages get the key of their two users in batches, then the
+conversation index replaces the sender/receiver pair index. With
+MESSAGE_PARTITIONING set on PostgreSQL the table is then moved into a
+partitioned one (stop the app first)
+Run this once to update existing database
+"""
+
+from app import app, db
+from models import Message
+from message_partitions import partitioning_enabled, convert_table
+
+# Messages updated per transaction
+BATCH_SIZE = 10000
+
+NEW_INDEXES = ['ix_messages_conversation_created', 'ix_messages_sender', 'ix_messages_receiver_read']
+
+# Same value as models.conversation_key(): smaller user id in the high 32 bits
+CONVERSATION_KEY_SQL = (
+    "CASE WHEN sender_id < receiver_id "
+    "THEN sender_id * 4294967296 + receiver_id "
+    "ELSE receiver_id * 4294967296 + sender_id END"
+)
+
+def migrate():
+    """Add conversation_id column, backfill it and (optionally) partition the table"""
+    with app.app_context():
+        try:
+            columns = [c['name'] for c in db.inspect(db.engine).get_columns('messages')]
+
+            if 'conversation_id' not in columns:
+                print("Adding 'conversation_id' column to messages table...")
+                with db.engine.begin() as conn:
+                    conn.execute(db.text("ALTER TABLE messages ADD COLUMN conversation_id BIGINT"))
+                print("✓ Column added successfully!")
+            else:
+                print("✓ Column 'conversation_id' already exists!")
+
+            total = 0
+            while True:
+                with db.engine.begin() as conn:
+                    result = conn.execute(db.text(
+                        f"UPDATE messages SET conversation_id = {CONVERSATION_KEY_SQL} "
+                        f"WHERE id IN (SELECT id FROM messages WHERE conversation_id IS NULL LIMIT :batch)"
+                    ), {'batch': BATCH_SIZE})
+                if not result.rowcount:
+                    break
+                total += result.rowcount
+                print(f"  {total} messages...")
+            print(f"✓ Set conversation_id for {total} messages!")
+
+            mode = partitioning_enabled(db.engine)
+            if mode:
+                print(f"Moving messages into a partitioned table ({mode})...")
+                copied = convert_table(db.engine, mode, app.config['MESSAGE_PARTITIONS'])
+                print(f"✓ Copied {copied} messages!")
+            else:
+                with db.engine.begin() as conn:
+                    conn.execute(db.text("DROP INDEX IF EXISTS ix_messages_pair_created"))
+                for name in NEW_INDEXES:
+                    index = next(i for i in Message.__table__.indexes if i.name == name)
+                    print(f"Adding '{name}' index to messages table...")
+                    index.create(db.engine, checkfirst=True)
+            print("✓ Indexes are in place!")
+
+        except Exception as e:
+            print(f"Error during migration: {e}")
+            print("\nAlternative: You can reset the database by running:")
+            print("python reset_db.py")
+
+if __name__ == '__main__':
+    migrate()
@@ -0,0 +1,28 @@
+"""
+Migration script to add post_id indexes to the likes and reposts tables
+The /posts list counts likes and reposts per post with them
+Run this once to update existing database
+"""
+
+from app import app, db
+from models import Like, Repost
+
+NEW_INDEXES = [
+    (Like, 'ix_likes_post'),
+    (Repost, 'ix_reposts_post'),
+]
+
+def migrate():
+    """Add post_id indexes for like and repost counts"""
+    with app.app_context():
+        try:
+            for model, name in NEW_INDEXES:
+                index = next(i for i in model.__table__.indexes if i.name == name)
+                print(f"Adding '{name}' index to {model.__tablename__} table...")
+                index.create(db.engine, checkfirst=True)
+            print("✓ Indexes are in place!")
+        except Exception as e:
+            print(f"Error during migration: {e}")
+
+if __name__ == '__main__':
+    migrate()
@@ -0,0 +1,43 @@
+"""
+Migration script to add 'excerpt' and 'content_length' columns to posts table
+Run this once to update existing database
+"""
+
+from app import app, db
+
+def migrate():
+    """Add excerpt/content_length columns and fill them from content"""
+    with app.app_context():
+        try:
+            columns = [c['name'] for c in db.inspect(db.engine).get_columns('posts')]
+            
+            with db.engine.begin() as conn:
+                if 'excerpt' not in columns:
+                    print("Adding 'excerpt' column to posts table...")
+                    conn.execute(db.text("ALTER TABLE posts ADD COLUMN excerpt VARCHAR(200)"))
+                    print("✓ Column added successfully!")
+                else:
+                    print("✓ Column 'excerpt' already exists!")
+                
+                if 'content_length' not in columns:
+                    print("Adding 'content_length' column to posts table...")
+                    conn.execute(db.text("ALTER TABLE posts ADD COLUMN content_length INTEGER DEFAULT 0"))
+                    print("✓ Column added successfully!")
+                else:
+                    print("✓ Column 'content_length' already exists!")
+                
+                # Fill the new columns for existing posts
+                result = conn.execute(db.text(
+                    "UPDATE posts SET excerpt = SUBSTR(COALESCE(content, ''), 1, 200), "
+                    "content_length = LENGTH(COALESCE(content, '')) "
+                    "WHERE excerpt IS NULL"
+                ))
+                print(f"✓ {result.rowcount} posts updated!")
+                    
+        except Exception as e:
+            print(f"Error during migration: {e}")
+            print("\nAlternative: You can reset the database by running:")
+            print("python reset_db.py")
+
+if __name__ == '__main__':
+    migrate()
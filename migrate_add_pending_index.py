@@ -0,0 +1,21 @@
+"""
+Migration script to add the moderation queue index to the posts table
+Run this once to update existing database
+"""
+
+from app import app, db
+from models import Post
+
+def migrate():
+    """Add partial index on unpublished posts"""
+    with app.app_context():
+        try:
+            index = next(i for i in Post.__table__.indexes if i.name == 'ix_posts_pending')
+            print("Adding 'ix_posts_pending' index to posts table...")
+            index.create(db.engine, checkfirst=True)
+            print("✓ Index is in place!")
+        except Exception as e:
+            print(f"Error during migration: {e}")
+
+if __name__ == '__main__':
+    migrate()
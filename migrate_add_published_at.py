@@ -0,0 +1,45 @@
+"""
+Migration script to add 'published_at' column to posts table
+Already published posts get their creation time, feeds are ordered by it
+Run this once to update existing database
+"""
+
+from app import app, db
+from models import Post
+
+NEW_INDEXES = ['ix_posts_published_at', 'ix_posts_author_published']
+
+def migrate():
+    """Add published_at column and its indexes"""
+    with app.app_context():
+        try:
+            columns = [c['name'] for c in db.inspect(db.engine).get_columns('posts')]
+            
+            if 'published_at' not in columns:
+                print("Adding 'published_at' column to posts table...")
+                with db.engine.begin() as conn:
+                    conn.execute(db.text("ALTER TABLE posts ADD COLUMN published_at TIMESTAMP"))
+                print("✓ Column added successfully!")
+            else:
+                print("✓ Column 'published_at' already exists!")
+            
+            with db.engine.begin() as conn:
+                result = conn.execute(db.text(
+                    "UPDATE posts SET published_at = created_at "
+                    "WHERE is_published = :published AND published_at IS NULL"
+                ), {'published': True})
+            print(f"✓ Set published_at for {result.rowcount} posts!")
+            
+            for name in NEW_INDEXES:
+                index = next(i for i in Post.__table__.indexes if i.name == name)
+                print(f"Adding '{name}' index to posts table...")
+                index.create(db.engine, checkfirst=True)
+            print("✓ Indexes are in place!")
+                    
+        except Exception as e:
+            print(f"Error during migration: {e}")
+            print("\nAlternative: You can reset the database by running:")
+            print("python reset_db.py")
+
+if __name__ == '__main__':
+    migrate()
@@ -0,0 +1,38 @@
+"""
+Migration script for notification retention and message archiving
+Adds the indexes the retention and archive jobs scan with, creates the
+message_archives table and, on PostgreSQL, tunes autovacuum for busy tables
+Run this once to update existing database
+"""
+
+from app import app, db
+from models import Notification, MessageArchive
+from maintenance import tune_autovacuum
+
+NEW_INDEXES = [
+    (Notification, 'ix_notifications_user_read'),
+    (Notification, 'ix_notifications_created'),
+]
+
+def migrate():
+    """Add retention indexes and the message archive table"""
+    with app.app_context():
+        try:
+            print("Creating 'message_archives' table...")
+            MessageArchive.__table__.create(db.engine, checkfirst=True)
+            print("✓ Table is in place!")
+
+            for model, name in NEW_INDEXES:
+                index = next(i for i in model.__table__.indexes if i.name == name)
+                print(f"Adding '{name}' index to {model.__tablename__} table...")
+                index.create(db.engine, checkfirst=True)
+            print("✓ Indexes are in place!")
+
+            tables = tune_autovacuum()
+            if tables:
+                print(f"✓ Autovacuum tuned for: {', '.join(tables)}")
+        except Exception as e:
+            print(f"Error during migration: {e}")
+
+if __name__ == '__main__':
+    migrate()
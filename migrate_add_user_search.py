@@ -0,0 +1,33 @@
+"""
+Migration script to add the user search indexes
+lower(username) index for prefix search; on PostgreSQL also the pg_trgm
+extension and a trigram index for substring search
+Run this once to update existing database
+"""
+
+from app import app, db
+from models import User
+
+def migrate():
+    """Add username search indexes"""
+    with app.app_context():
+        try:
+            index = next(i for i in User.__table__.indexes if i.name == 'ix_users_username_lower')
+            print("Adding 'ix_users_username_lower' index to users table...")
+            index.create(db.engine, checkfirst=True)
+            print("✓ Index is in place!")
+
+            if db.engine.dialect.name == 'postgresql':
+                print("Adding 'ix_users_username_trgm' index to users table...")
+                with db.engine.begin() as conn:
+                    conn.execute(db.text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                    conn.execute(db.text(
+                        "CREATE INDEX IF NOT EXISTS ix_users_username_trgm "
+                        "ON users USING gin (lower(username) gin_trgm_ops)"
+                    ))
+                print("✓ Trigram index is in place!")
+        except Exception as e:
+            print(f"Error during migration: {e}")
+
+if __name__ == '__main__':
+    migrate()
@@ -0,0 +1,195 @@
+"""
+MinHash signatures and the LSH band index, in NumPy
+Used by duplicates.py, which imports this module on the first check
+"""
+
+import logging
+import threading
+import zlib
+
+import numpy as np
+
+from duplicates import (NUM_PERM, BANDS, ROWS, SHINGLE_WORDS, MAX_CANDIDATES, MERGE_AT, RECHECK_WINDOW,
+                        FETCH_BATCH, SEED, GENERATION_KEY, WORD_RE)
+from jobs import get_state
+from models import db, PostSignature
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+
+# (a, b) of the NUM_PERM hash functions
+_hash_params = None
+# The worker's LSHIndex
+_index = None
+_lock = threading.Lock()
+
+
+# Signatures
+
+def hash_params():
+    global _hash_params
+    if _hash_params is None:
+        rng = np.random.default_rng(SEED)
+        a = rng.integers(1, 2 ** 63, size=NUM_PERM, dtype=np.uint64) | np.uint64(1)
+        b = rng.integers(0, 2 ** 63, size=NUM_PERM, dtype=np.uint64)
+        _hash_params = (a, b)
+    return _hash_params
+
+
+def shingles(text):
+    """crc32 of every SHINGLE_WORDS-word window of the lowercased words"""
+    words = WORD_RE.findall((text or '').lower())
+    if len(words) < SHINGLE_WORDS:
+        windows = [' '.join(words)] if words else []
+    else:
+        windows = [' '.join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)]
+    return np.unique(np.array([zlib.crc32(w.encode()) for w in windows], dtype=np.uint64))
+
+
+def minhash(title, content):
+    """uint32 signature of a post, or None when it has no words"""
+    values = shingles(f'{title or ""}\n{content or ""}')
+    if not len(values):
+        return None
+    a, b = hash_params()
+    # Multiply-shift hashing: uint64 arithmetic wraps, the high 32 bits are the hash
+    hashed = (values[:, None] * a[None, :] + b[None, :]) >> np.uint64(32)
+    return hashed.min(axis=0).astype(np.uint32)
+
+
+def signature_bytes(title, content):
+    """Signature as stored in post_signatures, all bits set for a post without words"""
+    signature = minhash(title, content)
+    if signature is None:
+        signature = np.full(NUM_PERM, 0xffffffff, dtype=np.uint32)
+    return signature.tobytes()
+
+
+def band_keys(signatures):
+    """(n, NUM_PERM) signatures -> (n, BANDS) uint32 keys, one hash per band"""
+    rows = signatures.reshape(len(signatures), BANDS, ROWS).astype(np.uint64)
+    keys = np.zeros((len(signatures), BANDS), dtype=np.uint64)
+    for i in range(ROWS):
+        keys = (keys ^ rows[:, :, i]) * np.uint64(0x100000001b3)
+    return ((keys >> np.uint64(32)) ^ keys).astype(np.uint32)
+
+
+def similarity(signature, others):
+    """Estimated Jaccard similarity: share of equal minimum hashes"""
+    return (others == signature[None, :]).mean(axis=1)
+
+
+# Index
+
+class LSHIndex:
+    """Band keys -> post ids, sorted per band"""
+
+    def __init__(self, post_ids, keys, watermark=0, generation=None):
+        # (BANDS, n) sorted keys and the post id of each
+        self.keys = np.zeros((BANDS, 0), dtype=np.uint32)
+        self.ids = np.zeros((BANDS, 0), dtype=np.int32)
+        self.new_ids = np.asarray(post_ids, dtype=np.int32)
+        self.new_keys = keys
+        self.watermark = watermark
+        self.generation = generation
+        # Indexed ids within RECHECK_WINDOW of the watermark
+        self.recent = {i for i in self.new_ids.tolist() if i > watermark - RECHECK_WINDOW}
+        self.merge()
+
+    @classmethod
+    def build(cls, post_ids, signatures, **kwargs):
+        return cls(post_ids, band_keys(signatures), **kwargs)
+
+    def __len__(self):
+        return self.keys.shape[1] + len(self.new_ids)
+
+    def merge(self):
+        """Move the unsorted part into the sorted arrays"""
+        keys = np.concatenate([self.keys, self.new_keys.T], axis=1)
+        ids = np.concatenate([self.ids, np.broadcast_to(self.new_ids, (BANDS, len(self.new_ids)))], axis=1)
+        order = np.argsort(keys, axis=1, kind='stable')
+        self.keys = np.take_along_axis(keys, order, axis=1)
+        self.ids = np.take_along_axis(ids, order, axis=1)
+        self.new_ids = self.new_ids[:0]
+        self.new_keys = self.new_keys[:0]
+
+    def add(self, post_ids, signatures):
+        """Add signatures, ids already indexed (in the recheck window) are skipped"""
+        post_ids = np.asarray(post_ids, dtype=np.int32)
+        fresh = np.array([i not in self.recent for i in post_ids.tolist()], dtype=bool)
+        if not fresh.any():
+            return
+        post_ids, signatures = post_ids[fresh], signatures[fresh]
+        self.new_ids = np.concatenate([self.new_ids, post_ids])
+        self.new_keys = np.concatenate([self.new_keys, band_keys(signatures)])
+        self.watermark = max(self.watermark, int(post_ids.max()))
+        self.recent.update(post_ids.tolist())
+        self.recent = {i for i in self.recent if i > self.watermark - RECHECK_WINDOW}
+        if len(self.new_ids) >= MERGE_AT:
+            self.merge()
+
+    def unseen_recent(self):
+        """post_signatures ids in the recheck window that are not indexed yet"""
+        rows = db.session.query(PostSignature.post_id)\
+                         .filter(PostSignature.post_id > self.watermark - RECHECK_WINDOW,
+                                 PostSignature.post_id <= self.watermark)
+        return [row[0] for row in rows if row[0] not in self.recent]
+
+    def candidates(self, signature, limit=MAX_CANDIDATES):
+        """Post ids sharing at least one band, most shared bands first"""
+        keys = band_keys(signature[None, :])[0]
+        found = [self.new_ids[(self.new_keys == keys[None, :]).any(axis=1)]]
+        for band in range(BANDS):
+            start = np.searchsorted(self.keys[band], keys[band], side='left')
+            end = np.searchsorted(self.keys[band], keys[band], side='right')
+            if end > start:
+                found.append(self.ids[band, start:end])
+        ids, counts = np.unique(np.concatenate(found), return_counts=True)
+        return ids[np.argsort(-counts, kind='stable')[:limit]].tolist()
+
+
+def fetch_signatures(after_id=0, only=None):
+    """(post ids, (n, NUM_PERM) signatures) of post_signatures rows after a post id (or of some ids)"""
+    post_ids, blobs = [], []
+    while True:
+        query = db.session.query(PostSignature.post_id, PostSignature.signature)
+        if only is not None:
+            query = query.filter(PostSignature.post_id.in_(only))
+        rows = query.filter(PostSignature.post_id > after_id)\
+                    .order_by(PostSignature.post_id)\
+                    .limit(FETCH_BATCH)\
+                    .all()
+        if not rows:
+            break
+        post_ids.extend(row[0] for row in rows)
+        blobs.extend(row[1] for row in rows)
+        after_id = rows[-1][0]
+    signatures = np.frombuffer(b''.join(blobs), dtype=np.uint32).reshape(len(blobs), NUM_PERM)
+    return np.array(post_ids, dtype=np.int64), signatures
+
+
+def get_index():
+    """This worker's index, with signatures other workers added since the last call"""
+    global _index
+    generation = get_state(GENERATION_KEY)
+    with _lock:
+        if _index is None or _index.generation != generation:
+            post_ids, signatures = fetch_signatures()
+            _index = LSHIndex.build(post_ids, signatures, watermark=int(post_ids.max()) if len(post_ids) else 0,
+                                    generation=generation)
+            logger.info(f'Duplicate index built: {len(_index):,} posts')
+        else:
+            late = _index.unseen_recent()
+            if late:
+                _index.add(*fetch_signatures(only=late))
+            post_ids, signatures = fetch_signatures(_index.watermark)
+            _index.add(post_ids, signatures)
+        return _index
+
+
+def add_signature(post_id, signature):
+    """Index the signature of a post this worker just checked"""
+    with _lock:
+        if _index is not None:
+            _index.add([post_id], signature[None, :])
@@ -2,17 +2,30 @@
 Database models
 """
 
+import sqlite3
+
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from datetime import datetime
 
 db = SQLAlchemy()
 
 
+# SQLite only enforces foreign keys (and ON DELETE CASCADE) when asked to
+@event.listens_for(Engine, 'connect')
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
+
+
 # Follow table
 follow_table = db.Table(
     'follow_table',
-    db.Column('follower_id', db.Integer, db.ForeignKey('users.id')),
-    db.Column('followed_id', db.Integer, db.ForeignKey('users.id'))
+    db.Column('follower_id', db.Integer, db.ForeignKey('users.id', ondelete='CASCADE')),
+    db.Column('followed_id', db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'))
 )
 
 
@@ -29,60 +42,104 @@ class User(db.Model):
     profile_photo = db.Column(db.String(255), default='/static/images/avatar-default.png')
     bio = db.Column(db.Text, default='')
     created_at = db.Column(db.DateTime, default=datetime.now)
+    # Set when the account is deleted, the purge job removes it later
+    deleted_at = db.Column(db.DateTime, index=True)
     
-    posts = db.relationship('Post', backref='author')
-    comments = db.relationship('Comment', backref='author')
-    likes = db.relationship('Like', backref='author')
-    reposts = db.relationship('Repost', backref='author')
-    notifications = db.relationship('Notification', backref='recipient', foreign_keys='Notification.user_id')
-    sent_notifications = db.relationship('Notification', backref='sender', foreign_keys='Notification.sender_id')
-    messages_sent = db.relationship('Message', backref='sender', foreign_keys='Message.sender_id')
-    messages_received = db.relationship('Message', backref='receiver', foreign_keys='Message.receiver_id')
+    # The database removes dependent rows (ON DELETE CASCADE), they are never loaded for that
+    posts = db.relationship('Post', backref='author', passive_deletes=True)
+    comments = db.relationship('Comment', backref='author', passive_deletes=True)
+    likes = db.relationship('Like', backref='author', passive_deletes=True)
+    reposts = db.relationship('Repost', backref='author', passive_deletes=True)
+    notifications = db.relationship('Notification', backref='recipient', foreign_keys='Notification.user_id', passive_deletes=True)
+    sent_notifications = db.relationship('Notification', backref='sender', foreign_keys='Notification.sender_id', passive_deletes=True)
+    messages_sent = db.relationship('Message', backref='sender', foreign_keys='Message.sender_id', passive_deletes=True)
+    messages_received = db.relationship('Message', backref='receiver', foreign_keys='Message.receiver_id', passive_deletes=True)
     
     following = db.relationship(
         'User',
         secondary=follow_table,
         primaryjoin=follow_table.c.follower_id == id,
         secondaryjoin=follow_table.c.followed_id == id,
-        backref='followers'
+        backref=db.backref('followers', passive_deletes=True),
+        passive_deletes=True
     )
     
     def __repr__(self):
         return f'User({self.username})'
 
 
+# Case-insensitive username prefix search (user_search.py)
+db.Index('ix_users_username_lower', db.func.lower(User.username))
+
+
 class Post(db.Model):
     __tablename__ = 'posts'
     
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200))
-    content = db.Column(db.Text)
+    # Full text is only loaded on the post page, lists use excerpt
+    content = db.deferred(db.Column(db.Text), group='body')
+    content_html = db.deferred(db.Column(db.Text), group='body')
+    excerpt = db.Column(db.String(200))
+    content_length = db.Column(db.Integer, default=0)
     language = db.Column(db.String(50))
     level = db.Column(db.String(50))
     photo = db.Column(db.String(255))
     is_published = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.now)
-    updated_at = db.Column(db.DateTime, default=datetime.now)
+    # Changes whenever the post or its like/repost/comment counts change
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+    # Set when an admin approves the post, feeds are ordered by it
+    published_at = db.Column(db.DateTime)
     
-    author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    author_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'))
     
-    comments = db.relationship('Comment', backref='post', cascade='all, delete-orphan')
-    likes = db.relationship('Like', backref='post', cascade='all, delete-orphan')
-    reposts = db.relationship('Repost', backref='post', cascade='all, delete-orphan')
-    notifications = db.relationship('Notification', backref='post', cascade='all, delete-orphan')
+    comments = db.relationship('Comment', backref='post', cascade='all, delete-orphan', passive_deletes=True)
+    likes = db.relationship('Like', backref='post', cascade='all, delete-orphan', passive_deletes=True)
+    reposts = db.relationship('Repost', backref='post', cascade='all, delete-orphan', passive_deletes=True)
+    notifications = db.relationship('Notification', backref='post', cascade='all, delete-orphan', passive_deletes=True)
     
     def __repr__(self):
         return f'Post({self.title})'
 
 
+# Characters of content kept in Post.excerpt
+EXCERPT_LENGTH = 200
+
+
+@event.listens_for(Post.content, 'set')
+def update_excerpt(post, value, oldvalue, initiator):
+    """Keep excerpt and content_length in sync with content"""
+    value = value or ''
+    post.excerpt = value[:EXCERPT_LENGTH]
+    post.content_length = len(value)
+
+
+# Moderation queue: only unpublished posts, in submission order
+db.Index(
+    'ix_posts_pending',
+    Post.created_at,
+    postgresql_where=Post.is_published == db.false(),
+    sqlite_where=Post.is_published == db.false()
+)
+
+# Feeds: newest published posts, overall and per author (feeds.py)
+db.Index('ix_posts_published_at', Post.published_at)
+db.Index('ix_posts_author_published', Post.author_id, Post.published_at)
+
+
 class Like(db.Model):
     __tablename__ = 'likes'
     
     id = db.Column(db.Integer, primary_key=True)
     created_at = db.Column(db.DateTime, default=datetime.now)
     
-    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'))
-    author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id', ondelete='CASCADE'))
+    author_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'))
+
+
+# Like counts of the /posts list
+db.Index('ix_likes_post', Like.post_id)
 
 
 class Repost(db.Model):
@@ -91,8 +148,11 @@ class Repost(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     created_at = db.Column(db.DateTime, default=datetime.now)
     
-    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'))
-    author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id', ondelete='CASCADE'))
+    author_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'))
+
+
+db.Index('ix_reposts_post', Repost.post_id)
 
 
 class Comment(db.Model):
@@ -100,15 +160,32 @@ class Comment(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text)
+    # Escaped content with @mentions linked, filled when the comment is written
+    content_html = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.now)
     
-    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'))
-    author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id', ondelete='CASCADE'))
+    author_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'))
+    
+    # Replies: ids from the thread root down to this comment, e.g. '0000000007/0000000012/'
+    parent_id = db.Column(db.Integer, db.ForeignKey('comments.id', ondelete='CASCADE'))
+    path = db.Column(db.String(255), index=True)
+    
+    replies = db.relationship('Comment', backref=db.backref('parent', remote_side=[id]), passive_deletes=True)
+    
+    @property
+    def depth(self):
+        """0 for a comment on the post, 1 for a reply to it and so on"""
+        return self.path.count('/') - 1 if self.path else 0
     
     def __repr__(self):
         return f'Comment({self.content[:20]})'
 
 
+# Comments of a post in the order they were written
+db.Index('ix_comments_post_created', Comment.post_id, Comment.created_at)
+
+
 class Notification(db.Model):
     __tablename__ = 'notifications'
     
@@ -118,9 +195,27 @@ class Notification(db.Model):
     is_read = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.now)
     
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
-    sender_id = db.Column(db.Integer, db.ForeignKey('users.id'))
-    post_id = db.Column(db.Integer, db.ForeignKey('posts.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'))
+    sender_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'))
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id', ondelete='CASCADE'))
+
+
+# Unread count in the navbar of every page
+db.Index('ix_notifications_user_read', Notification.user_id, Notification.is_read)
+# Retention: old notifications first
+db.Index('ix_notifications_created', Notification.created_at)
+
+
+def conversation_key(user_id, other_id):
+    """Same number for both directions of a conversation: smaller user id in the high 32 bits"""
+    low, high = sorted((user_id, other_id))
+    return (low << 32) | high
+
+
+def default_conversation_id(context):
+    """Column default, also used by Core bulk inserts"""
+    params = context.get_current_parameters()
+    return conversation_key(params['sender_id'], params['receiver_id'])
 
 
 class Message(db.Model):
@@ -131,8 +226,129 @@ class Message(db.Model):
     is_read = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.now)
     
-    sender_id = db.Column(db.Integer, db.ForeignKey('users.id'))
-    receiver_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    sender_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'))
+    receiver_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'))
+    # conversation_key() of the two users; PostgreSQL may partition by it (message_partitions.py)
+    conversation_id = db.Column(db.BigInteger, default=default_conversation_id)
     
     def __repr__(self):
         return f'Message({self.content[:20]})'
+
+
+# A conversation in order (both directions)
+db.Index('ix_messages_conversation_created', Message.conversation_id, Message.created_at)
+# Conversation list and unread messages of a user
+db.Index('ix_messages_sender', Message.sender_id)
+db.Index('ix_messages_receiver_read', Message.receiver_id, Message.is_read)
+
+
+class MessageArchive(db.Model):
+    __tablename__ = 'message_archives'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    # The two users of the conversation, smaller id first
+    user_a_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'))
+    user_b_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'))
+    first_at = db.Column(db.DateTime)
+    last_at = db.Column(db.DateTime)
+    count = db.Column(db.Integer, default=0)
+    # zlib-compressed JSON list of messages (see archive.py)
+    data = db.Column(db.LargeBinary)
+
+
+db.Index('ix_message_archives_pair', MessageArchive.user_a_id, MessageArchive.user_b_id, MessageArchive.last_at)
+db.Index('ix_message_archives_user_b', MessageArchive.user_b_id)
+
+
+class UserSession(db.Model):
+    __tablename__ = 'user_sessions'
+    
+    id = db.Column(db.String(64), primary_key=True)
+    data = db.Column(db.Text)
+    expires_at = db.Column(db.DateTime, index=True)
+    
+    user_id = db.Column(db.Integer, index=True)
+
+
+class PostScore(db.Model):
+    __tablename__ = 'post_scores'
+    
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id', ondelete='CASCADE'), primary_key=True)
+    score = db.Column(db.Float, default=0.0, index=True)
+    
+    post = db.relationship('Post')
+
+
+class JobState(db.Model):
+    __tablename__ = 'job_state'
+    
+    name = db.Column(db.String(100), primary_key=True)
+    value = db.Column(db.String(255))
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+
+class PostFacet(db.Model):
+    __tablename__ = 'post_facets'
+    
+    language = db.Column(db.String(50), primary_key=True, default='')
+    level = db.Column(db.String(50), primary_key=True, default='')
+    is_published = db.Column(db.Boolean, primary_key=True, default=False)
+    count = db.Column(db.Integer, default=0)
+
+
+class EngagementRollup(db.Model):
+    __tablename__ = 'engagement_rollups'
+    
+    # scope 'post' (scope_id = post id) or 'author' (scope_id = user id)
+    scope = db.Column(db.String(10), primary_key=True)
+    scope_id = db.Column(db.Integer, primary_key=True)
+    # period 'hour' or 'day', bucket = start of the hour/day
+    period = db.Column(db.String(10), primary_key=True)
+    bucket = db.Column(db.DateTime, primary_key=True)
+    author_id = db.Column(db.Integer)
+    likes = db.Column(db.Integer, default=0)
+    reposts = db.Column(db.Integer, default=0)
+    comments = db.Column(db.Integer, default=0)
+
+
+# Best posts of an author
+db.Index('ix_engagement_rollups_author', EngagementRollup.author_id, EngagementRollup.period, EngagementRollup.bucket)
+
+
+class FollowSuggestion(db.Model):
+    __tablename__ = 'follow_suggestions'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    suggested_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    score = db.Column(db.Float, default=0.0)
+    # Followed users of user_id who follow suggested_id (0 for same level/language picks)
+    mutual = db.Column(db.Integer, default=0)
+    
+    suggested = db.relationship('User', foreign_keys=[suggested_id])
+
+
+# Suggestions of a user, best first
+db.Index('ix_follow_suggestions_user_score', FollowSuggestion.user_id, FollowSuggestion.score)
+
+
+class RelatedPost(db.Model):
+    __tablename__ = 'related_posts'
+    
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id', ondelete='CASCADE'), primary_key=True)
+    related_id = db.Column(db.Integer, db.ForeignKey('posts.id', ondelete='CASCADE'), primary_key=True)
+    score = db.Column(db.Float, default=0.0)
+
+
+# Related posts of a post, best first
+db.Index('ix_related_posts_post_score', RelatedPost.post_id, RelatedPost.score)
+
+
+class PostSignature(db.Model):
+    __tablename__ = 'post_signatures'
+    
+    post_id = db.Column(db.Integer, db.ForeignKey('posts.id', ondelete='CASCADE'), primary_key=True)
+    # MinHash of the post's shingles, uint32 values (see duplicates.py)
+    signature = db.Column(db.LargeBinary)
+    # Most similar older post when it looks like a copy
+    duplicate_of = db.Column(db.Integer, db.ForeignKey('posts.id', ondelete='SET NULL'))
+    similarity = db.Column(db.Float)
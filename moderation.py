@@ -0,0 +1,117 @@
+"""
+Moderation queue for the admin panel
+Approve or reject many posts in one transaction
+"""
+
+from datetime import datetime
+
+from sqlalchemy.orm import joinedload
+
+import facets
+from models import db, Post, Comment, Like, Repost, Notification
+from purge import remove_upload, run_hooks
+
+
+# Posts shown per page in the admin queue
+PENDING_PER_PAGE = 20
+
+# Most posts one bulk action may touch
+MAX_BATCH = 500
+
+# Follow-up work: functions called once per batch with the list of post ids
+on_published = []
+on_rejected = []
+
+
+def get_pending_page(page, per_page=PENDING_PER_PAGE):
+    """One page of unpublished posts, oldest submission first"""
+    query = Post.query.options(joinedload(Post.author))\
+                      .filter(Post.is_published == db.false())\
+                      .order_by(Post.created_at.asc(), Post.id.asc())
+    return query.paginate(page=page, per_page=per_page, error_out=False)
+
+
+def approve_posts(post_ids, admin):
+    """Publish posts and notify their authors, returns the approved posts"""
+    post_ids = list(post_ids)[:MAX_BATCH]
+    if not post_ids:
+        return []
+
+    pending = db.session.query(Post.id, Post.title, Post.author_id, Post.language, Post.level)\
+                        .filter(Post.id.in_(post_ids), Post.is_published == db.false())\
+                        .all()
+    if not pending:
+        return []
+    ids = [p.id for p in pending]
+
+    now = datetime.now()
+    db.session.execute(
+        db.update(Post)
+          .where(Post.id.in_(ids))
+          .values(is_published=True, published_at=now, updated_at=now)
+    )
+    facets.adjust(
+        [(p.language, p.level, False, -1) for p in pending]
+        + [(p.language, p.level, True, 1) for p in pending]
+    )
+    notifications = [
+        {
+            'user_id': p.author_id,
+            'sender_id': admin.id,
+            'post_id': p.id,
+            'action': 'approve',
+            'message': f'თქვენი პოსტი "{p.title}" დადასტურებულია!',
+            'is_read': False,
+            'created_at': datetime.now(),
+        }
+        for p in pending if p.author_id != admin.id
+    ]
+    if notifications:
+        db.session.execute(db.insert(Notification), notifications)
+    db.session.commit()
+
+    run_hooks(on_published, ids)
+    return pending
+
+
+def reject_posts(post_ids, admin):
+    """Delete pending posts and tell their authors, returns the rejected posts"""
+    post_ids = list(post_ids)[:MAX_BATCH]
+    if not post_ids:
+        return []
+
+    pending = db.session.query(Post.id, Post.title, Post.author_id, Post.language, Post.level)\
+                        .filter(Post.id.in_(post_ids), Post.is_published == db.false())\
+                        .all()
+    if not pending:
+        return []
+    ids = [p.id for p in pending]
+    photos = [photo for (photo,) in db.session.query(Post.photo).filter(Post.id.in_(ids), Post.photo.isnot(None))]
+
+    # Remove everything attached to the posts with one DELETE per table
+    for model in (Comment, Like, Repost, Notification):
+        db.session.execute(db.delete(model).where(model.post_id.in_(ids)))
+    db.session.execute(db.delete(Post).where(Post.id.in_(ids)))
+    facets.adjust([(p.language, p.level, False, -1) for p in pending])
+
+    notifications = [
+        {
+            'user_id': p.author_id,
+            'sender_id': admin.id,
+            'post_id': None,
+            'action': 'reject',
+            'message': f'თქვენი პოსტი "{p.title}" უარყოფილია.',
+            'is_read': False,
+            'created_at': datetime.now(),
+        }
+        for p in pending if p.author_id != admin.id
+    ]
+    if notifications:
+        db.session.execute(db.insert(Notification), notifications)
+    db.session.commit()
+
+    # Files go after the commit, like purge.delete_posts()
+    for photo in photos:
+        remove_upload('posts', photo)
+    run_hooks(on_rejected, ids)
+    return pending
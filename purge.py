@@ -0,0 +1,137 @@
+"""
+Removing posts and deleted accounts
+Rows that hang off a post or user (likes, comments, notifications...) are
+removed by the database (ON DELETE CASCADE). Accounts are only flagged when
+the user deletes them; a background job removes their content in small
+batches, so no single transaction gets huge.
+"""
+
+import logging
+import os
+
+from flask import current_app
+
+import facets
+from jobs import job
+from models import db, User, Post, Comment, Like, Repost, Notification, Message, EngagementRollup, follow_table
+from user_cache import invalidate_user
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+
+# Rows deleted per statement/transaction
+PURGE_BATCH = 500
+# Accounts handled per job run
+USERS_PER_RUN = 10
+
+DEFAULT_PHOTO = '/static/images/avatar-default.png'
+
+# Follow-up work after posts are deleted, called with their (id, author_id, language, level, is_published, photo) rows
+on_deleted = []
+
+
+def remove_upload(*parts):
+    """Delete an uploaded file under static/uploads (missing files are fine)"""
+    uploads = os.path.join(current_app.static_folder, 'uploads')
+    path = os.path.realpath(os.path.join(uploads, *parts))
+    if not path.startswith(os.path.realpath(uploads) + os.sep):
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f'Could not remove {path}: {e}')
+
+
+def run_hooks(hooks, posts):
+    """Call every hook; the posts are already committed, so a failing hook is only logged"""
+    for hook in hooks:
+        try:
+            hook(posts)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f'{hook.__module__}.{hook.__name__} failed: {e}')
+
+
+def delete_posts(post_ids):
+    """Delete posts, their likes/comments/... and photos, returns the count"""
+    rows = db.session.query(Post.id, Post.author_id, Post.language, Post.level, Post.is_published, Post.photo)\
+                     .filter(Post.id.in_(post_ids))\
+                     .all()
+    if not rows:
+        return 0
+    ids = [r.id for r in rows]
+    db.session.execute(db.delete(Post).where(Post.id.in_(ids)))
+    db.session.execute(db.delete(EngagementRollup).where(
+        EngagementRollup.scope == 'post', EngagementRollup.scope_id.in_(ids)
+    ))
+    facets.adjust([(r.language, r.level, r.is_published, -1) for r in rows])
+    db.session.commit()
+
+    # Files go after the commit, a rollback must not leave posts without photos
+    for row in rows:
+        if row.photo:
+            remove_upload('posts', row.photo)
+    run_hooks(on_deleted, rows)
+    return len(rows)
+
+
+def delete_in_batches(model, condition):
+    """Delete matching rows PURGE_BATCH at a time, returns the count"""
+    deleted = 0
+    while True:
+        ids = db.session.execute(db.select(model.id).where(condition).limit(PURGE_BATCH)).scalars().all()
+        if not ids:
+            return deleted
+        db.session.execute(db.delete(model).where(model.id.in_(ids)))
+        db.session.commit()
+        deleted += len(ids)
+
+
+def purge_user(user_id):
+    """Remove a flagged account and everything it wrote, returns row counts"""
+    counts = {'posts': 0}
+    while True:
+        post_ids = db.session.execute(
+            db.select(Post.id).where(Post.author_id == user_id).limit(PURGE_BATCH)
+        ).scalars().all()
+        if not post_ids:
+            break
+        counts['posts'] += delete_posts(post_ids)
+
+    for name, model, condition in (
+        ('comments', Comment, Comment.author_id == user_id),
+        ('likes', Like, Like.author_id == user_id),
+        ('reposts', Repost, Repost.author_id == user_id),
+        ('notifications', Notification, (Notification.user_id == user_id) | (Notification.sender_id == user_id)),
+        ('messages', Message, (Message.sender_id == user_id) | (Message.receiver_id == user_id)),
+    ):
+        counts[name] = delete_in_batches(model, condition)
+
+    db.session.execute(follow_table.delete().where(
+        (follow_table.c.follower_id == user_id) | (follow_table.c.followed_id == user_id)
+    ))
+    db.session.execute(db.delete(EngagementRollup).where(EngagementRollup.author_id == user_id))
+    photo = db.session.query(User.profile_photo).filter(User.id == user_id).scalar()
+    db.session.execute(db.delete(User).where(User.id == user_id))
+    db.session.commit()
+
+    if photo and photo != DEFAULT_PHOTO and photo.startswith('/static/uploads/'):
+        remove_upload(*photo[len('/static/uploads/'):].split('/'))
+    current_app.session_interface.store.delete_for_user(user_id)
+    invalidate_user(user_id)
+    return counts
+
+
+@job('purge_users', interval=600)
+def purge_deleted_users():
+    """Remove accounts flagged as deleted"""
+    user_ids = db.session.execute(
+        db.select(User.id).where(User.deleted_at.isnot(None)).order_by(User.deleted_at).limit(USERS_PER_RUN)
+    ).scalars().all()
+    for user_id in user_ids:
+        counts = purge_user(user_id)
+        logger.info(f'Purged user {user_id}: {counts}')
+    return len(user_ids)
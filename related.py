@@ -0,0 +1,162 @@
+"""
+Related posts ("read next" on the post page)
+Published posts become TF-IDF vectors over the hashed words of their title
+and content. The nearest posts by cosine similarity, with a small bonus for
+the same language and level, are stored in related_posts; the post page
+only reads that table.
+
+A daily job rebuilds everything and saves the vectors to INDEX_PATH.
+A job every few minutes loads that file, adds the posts approved since the
+rebuild, and gives the newly approved ones related lists (and a place in
+the lists of their nearest posts). Only the rebuild writes the file, under
+an exclusive file lock; old vectors keep their weights until then.
+The NumPy/SciPy vector code is in tfidf.py, which only the jobs import.
+"""
+
+import contextlib
+import logging
+import os
+import re
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows: no file lock, run a single worker there
+    fcntl = None
+
+from jobs import job, get_state, set_state
+from models import db, Post, RelatedPost
+from rollups import SETTLE_DELAY
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+
+RELATED_PER_POST = 5
+# Hashed vocabulary size
+N_FEATURES = 2 ** 18
+# Title words count this many times
+TITLE_WEIGHT = 3
+# Words in more posts than this share (or floor) say nothing about a post
+MAX_DF = 0.01
+MAX_DF_FLOOR = 20
+# Strongest words kept per post, keeps the index small
+MAX_TERMS = 20
+LANGUAGE_BONUS = 0.1
+LEVEL_BONUS = 0.05
+# Weaker text matches are not stored, whatever the bonus
+MIN_SCORE = 0.05
+# Posts compared per sparse product
+CHUNK = 1000
+FETCH_BATCH = 2000
+WRITE_BATCH = 5000
+
+INDEX_PATH = os.environ.get(
+    'RELATED_INDEX_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'related_index.npz')
+)
+
+# Held while the saved index or the related lists are changed by the jobs
+LOCK_PATH = f'{INDEX_PATH}.lock'
+
+# Start of the last rebuild / of the posts add_new_posts() has not seen yet
+BUILT_KEY = 'related:built'
+WATERMARK_KEY = 'related:watermark'
+
+WORD_RE = re.compile(r'\w{2,}')
+
+
+@contextlib.contextmanager
+def index_lock():
+    """Exclusive lock on the saved index across processes"""
+    with open(LOCK_PATH, 'a') as file:
+        if fcntl is not None:
+            fcntl.flock(file, fcntl.LOCK_EX)
+        yield
+
+
+# Building and updating
+
+def published_posts(post_ids=None):
+    """(id, title, content, language, level) of published posts, oldest first"""
+    query = db.select(Post.id, Post.title, Post.content, Post.language, Post.level)\
+              .where(Post.is_published == db.true())\
+              .order_by(Post.id)
+    if post_ids is not None:
+        query = query.where(Post.id.in_(list(post_ids)))
+    return [tuple(row) for row in db.session.execute(query.execution_options(yield_per=FETCH_BATCH))]
+
+
+def replace_lists(post_ids, related_ids, scores, only=None):
+    """Write related lists, all of them or only for some posts (caller commits)"""
+    query = db.delete(RelatedPost)
+    if only is not None:
+        query = query.where(RelatedPost.post_id.in_(list(only)))
+    db.session.execute(query)
+    rows = [{'post_id': p, 'related_id': r, 'score': s}
+            for p, r, s in zip(post_ids.tolist(), related_ids.tolist(), scores.tolist())]
+    for start in range(0, len(rows), WRITE_BATCH):
+        db.session.execute(db.insert(RelatedPost), rows[start:start + WRITE_BATCH])
+    return len(rows)
+
+
+@job('related', interval=24 * 3600)
+def rebuild_related():
+    """Recompute vectors and related lists of all published posts"""
+    from tfidf import RelatedIndex
+    # Posts approved from here on are left to add_new_posts()
+    started = datetime.now() - SETTLE_DELAY
+    posts = published_posts()
+    index = RelatedIndex.build(posts)
+    post_ids, related_ids, scores = index.nearest()
+    with index_lock():
+        saved = replace_lists(post_ids, related_ids, scores)
+        set_state(BUILT_KEY, started.timestamp())
+        set_state(WATERMARK_KEY, started.timestamp())
+        db.session.commit()
+        index.save()
+    return {'posts': len(posts), 'related': saved}
+
+
+@job('related_updates', interval=300)
+def add_new_posts():
+    """Give posts approved since the last run related lists and add them to their neighbours' lists
+    The saved file is not changed: posts approved since the rebuild are added
+    to the loaded index on every run."""
+    from tfidf import RelatedIndex, update_lists
+    with index_lock():
+        built, watermark = get_state(BUILT_KEY), get_state(WATERMARK_KEY)
+        if built is None or not os.path.exists(INDEX_PATH):
+            # Nothing built yet, the rebuild will include these posts
+            return None
+        since = datetime.fromtimestamp(float(watermark))
+        until = datetime.now() - SETTLE_DELAY
+        new_ids = [row[0] for row in db.session.query(Post.id).filter(Post.is_published == db.true(),
+                                                                       Post.published_at > since,
+                                                                       Post.published_at <= until)]
+        set_state(WATERMARK_KEY, until.timestamp())
+        if not new_ids:
+            db.session.commit()
+            return {'posts': 0}
+
+        index = RelatedIndex.load()
+        known = set(index.post_ids.tolist())
+        since_rebuild = [row[0] for row in db.session.query(Post.id).filter(
+            Post.is_published == db.true(), Post.published_at >= datetime.fromtimestamp(float(built)))]
+        added = [p for p in published_posts(set(since_rebuild) | set(new_ids)) if p[0] not in known]
+        if added:
+            index.add(added)
+        rows = index.rows_of(new_ids)
+        posts, neighbours = update_lists(index, rows)
+        db.session.commit()
+    logger.info(f'Related: added {posts} posts, updated {neighbours} lists')
+    return {'posts': posts, 'neighbours': neighbours}
+
+
+def related_posts(post_id, limit=RELATED_PER_POST):
+    """Stored related posts of a post, best first"""
+    return Post.query.join(RelatedPost, RelatedPost.related_id == Post.id)\
+                     .filter(RelatedPost.post_id == post_id, Post.is_published == db.true())\
+                     .order_by(RelatedPost.score.desc())\
+                     .limit(limit)\
+                     .all()
@@ -0,0 +1,106 @@
+"""
+Turns post content (Markdown) into safe HTML with highlighted code
+Runs once when a post is created or approved, pages just print content_html
+"""
+
+import logging
+
+from sqlalchemy.orm import load_only
+
+from mentions import extract_mentions, resolve_mentions, link_mentions
+from models import db, Post
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+
+# Post.language -> Pygments lexer used for code blocks without a language
+LEXERS = {
+    'Python': 'python',
+    'JavaScript': 'javascript',
+    'HTML': 'html',
+    'CSS': 'css',
+    'Bash': 'bash',
+    'C++': 'cpp',
+    'Java': 'java',
+}
+
+# HTML that may stay in the rendered content
+ALLOWED_TAGS = [
+    'p', 'br', 'hr', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+    'strong', 'em', 'b', 'i', 'del', 'blockquote',
+    'ul', 'ol', 'li', 'a', 'code', 'pre', 'span', 'div',
+    'table', 'thead', 'tbody', 'tr', 'th', 'td',
+]
+ALLOWED_ATTRIBUTES = {
+    'a': ['href', 'title', 'rel'],
+    'span': ['class'],
+    'div': ['class'],
+    'code': ['class'],
+    'pre': ['class'],
+    'th': ['align'],
+    'td': ['align'],
+}
+ALLOWED_PROTOCOLS = ['http', 'https', 'mailto']
+
+# Posts rendered per query when filling content_html for many posts
+RENDER_BATCH = 200
+
+
+def add_default_language(content, lexer):
+    """Give ``` code blocks without a language the post's language"""
+    lines = []
+    in_code = False
+    for line in content.split('\n'):
+        stripped = line.strip()
+        if stripped.startswith('```') or stripped.startswith('~~~'):
+            if not in_code and stripped in ('```', '~~~'):
+                line = line.rstrip() + lexer
+            in_code = not in_code
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def render_content(content, language=None):
+    """Markdown -> sanitized HTML with server-side syntax highlighting"""
+    # Imported here: only needed when a post is written, not at app startup
+    import bleach
+    import markdown
+
+    content = content or ''
+    lexer = LEXERS.get(language)
+    if lexer:
+        content = add_default_language(content, lexer)
+
+    html = markdown.markdown(
+        content,
+        extensions=['fenced_code', 'codehilite', 'tables', 'sane_lists', 'nl2br'],
+        extension_configs={'codehilite': {'guess_lang': False, 'css_class': 'codehilite'}}
+    )
+    html = bleach.clean(html, tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRIBUTES,
+                        protocols=ALLOWED_PROTOCOLS)
+    return bleach.linkify(html, skip_tags=['pre', 'code'])
+
+
+def render_post(post, users=None):
+    """Fill post.content_html with @mentions linked (caller commits)"""
+    if users is None:
+        users = resolve_mentions(extract_mentions(post.content))
+    post.content_html = link_mentions(render_content(post.content, post.language), users)
+
+
+def render_posts(post_ids):
+    """Render posts that have no content_html yet (used after approval)"""
+    post_ids = list(post_ids)
+    for start in range(0, len(post_ids), RENDER_BATCH):
+        batch = post_ids[start:start + RENDER_BATCH]
+        posts = Post.query.options(load_only(Post.id, Post.content, Post.content_html, Post.language))\
+                          .filter(Post.id.in_(batch), Post.content_html.is_(None))\
+                          .all()
+        # Mentions of the whole batch in one query
+        users = resolve_mentions(h for post in posts for h in extract_mentions(post.content))
+        for post in posts:
+            render_post(post, users)
+        if posts:
+            db.session.commit()
+            logger.info(f'Rendered {len(posts)} posts')
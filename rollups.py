@@ -0,0 +1,147 @@
+"""
+Engagement rollups for author stats
+Likes, reposts and comments are counted per hour and per day, for every
+post and every author. A job adds new events from a watermark; the stats
+page and API only read the engagement_rollups table.
+
+Events are counted when they happen: an unlike or a deleted comment does
+not lower old buckets until the next backfill.
+"""
+
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from jobs import job, get_state, set_state
+from models import db, Post, EngagementRollup
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+
+# Event kind -> rollup column
+KIND_COLUMNS = {
+    'like': 'likes',
+    'repost': 'reposts',
+    'comment': 'comments',
+}
+COUNT_COLUMNS = ('likes', 'reposts', 'comments')
+
+WATERMARK_KEY = 'rollups:watermark'
+# Events younger than this are left for the next run (their transactions may still be open)
+SETTLE_DELAY = timedelta(minutes=1)
+# Hourly buckets are dropped after this, daily buckets are kept
+HOUR_RETENTION = timedelta(days=30)
+# Rows per INSERT when writing buckets
+WRITE_BATCH = 5000
+
+
+def to_rows(totals):
+    """count_buckets() result -> dicts for engagement_rollups"""
+    return [
+        dict(scope=scope, scope_id=scope_id, period=period, bucket=datetime.fromtimestamp(bucket), **counts)
+        for (scope, scope_id, period, bucket), counts in totals.items()
+    ]
+
+
+def add_to_rollups(rows):
+    """Add counts to existing buckets, create missing ones (caller commits)"""
+    table = EngagementRollup.__table__
+    dialect = db.session.get_bind().dialect.name
+    insert = postgresql_insert if dialect == 'postgresql' else sqlite_insert
+    statement = insert(table)
+    # One upsert per bucket, safe when the backfill and the job overlap
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.scope, table.c.scope_id, table.c.period, table.c.bucket],
+        set_={column: table.c[column] + statement.excluded[column] for column in COUNT_COLUMNS}
+    )
+    for start in range(0, len(rows), WRITE_BATCH):
+        db.session.execute(statement, rows[start:start + WRITE_BATCH])
+
+
+def drop_old_hours(now):
+    """Remove hourly buckets past HOUR_RETENTION (caller commits)"""
+    db.session.execute(db.delete(EngagementRollup).where(
+        EngagementRollup.period == 'hour', EngagementRollup.bucket < now - HOUR_RETENTION
+    ))
+
+
+@job('rollups', interval=300)
+def update_rollups():
+    """Add events since the last run to the rollups"""
+    from engagement import fetch_events, count_buckets
+
+    watermark = get_state(WATERMARK_KEY)
+    if watermark is None:
+        return backfill_rollups()
+
+    until = datetime.now() - SETTLE_DELAY
+    since = datetime.fromtimestamp(float(watermark))
+    events = fetch_events(since=since, until=until, published_only=False, with_author=True)
+    totals = count_buckets(events, KIND_COLUMNS)
+    add_to_rollups(to_rows(totals))
+    drop_old_hours(until)
+    set_state(WATERMARK_KEY, until.timestamp())
+    db.session.commit()
+    return {'buckets': len(totals)}
+
+
+def backfill_rollups():
+    """Rebuild all rollups from the full event history"""
+    from engagement import fetch_events, count_buckets
+
+    until = datetime.now() - SETTLE_DELAY
+    totals = count_buckets(fetch_events(until=until, published_only=False, with_author=True), KIND_COLUMNS)
+    cutoff = (until - HOUR_RETENTION).timestamp()
+    rows = to_rows({key: counts for key, counts in totals.items() if key[2] == 'day' or key[3] >= cutoff})
+
+    db.session.execute(db.delete(EngagementRollup))
+    for start in range(0, len(rows), WRITE_BATCH):
+        db.session.execute(db.insert(EngagementRollup), rows[start:start + WRITE_BATCH])
+    set_state(WATERMARK_KEY, until.timestamp())
+    db.session.commit()
+    return {'buckets': len(rows), 'full': True}
+
+
+# Reading
+
+def author_series(author_id, period='day', since=None):
+    """Buckets of one author, oldest first"""
+    query = db.session.query(EngagementRollup.bucket, EngagementRollup.likes,
+                             EngagementRollup.reposts, EngagementRollup.comments)\
+                      .filter(EngagementRollup.scope == 'author',
+                              EngagementRollup.scope_id == author_id,
+                              EngagementRollup.period == period)
+    if since is not None:
+        query = query.filter(EngagementRollup.bucket >= since)
+    return query.order_by(EngagementRollup.bucket).all()
+
+
+def top_posts(author_id, since, limit=5):
+    """Author's posts with the most engagement since a date -> [(post, likes, reposts, comments)]"""
+    total = EngagementRollup.likes + EngagementRollup.reposts + EngagementRollup.comments
+    rows = db.session.query(EngagementRollup.scope_id,
+                            db.func.sum(EngagementRollup.likes),
+                            db.func.sum(EngagementRollup.reposts),
+                            db.func.sum(EngagementRollup.comments))\
+                     .filter(EngagementRollup.author_id == author_id,
+                             EngagementRollup.period == 'day',
+                             EngagementRollup.scope == 'post',
+                             EngagementRollup.bucket >= since)\
+                     .group_by(EngagementRollup.scope_id)\
+                     .order_by(db.func.sum(total).desc())\
+                     .limit(limit)\
+                     .all()
+    posts = {p.id: p for p in Post.query.filter(Post.id.in_([r[0] for r in rows]))}
+    return [(posts[r[0]], r[1], r[2], r[3]) for r in rows if r[0] in posts]
+
+
+def series_totals(series):
+    """Sum of likes/reposts/comments over buckets"""
+    return {
+        'likes': sum(row.likes for row in series),
+        'reposts': sum(row.reposts for row in series),
+        'comments': sum(row.comments for row in series),
+    }
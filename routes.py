@@ -4,12 +4,31 @@ All routes for DevLog app
 
 import os
 import logging
-from datetime import datetime
-from flask import render_template, request, redirect, url_for, flash, session
+from datetime import datetime, timedelta
+from flask import render_template, stream_template, get_flashed_messages, request, redirect, url_for, flash, session, jsonify
 from werkzeug.utils import secure_filename
 from werkzeug.security import check_password_hash, generate_password_hash
+from sqlalchemy.orm import joinedload, undefer_group
 
-from models import db, User, Post, Comment, Like, Repost, Notification, Message
+from models import db, User, Post, Comment, Like, Repost, Notification, Message, PostScore, FollowSuggestion, follow_table, conversation_key
+from sessions import revoke_user_sessions
+from moderation import get_pending_page, approve_posts, reject_posts
+from rendering import render_post
+from trending import trending_posts
+from suggestions import suggestions_for
+from related import related_posts
+from duplicates import check_post, duplicate_flags
+from archive import archived_count, archived_partners, load_archive
+import comments
+import facets
+import feeds
+from assets import content_hash
+from conditional import not_modified
+from jobs import get_state
+from user_cache import invalidate_user
+from purge import delete_posts
+from user_search import search_users, forget_users
+import rollups
 
 # Setup logging
 logger = logging.getLogger(__name__)
@@ -20,15 +39,45 @@ ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif'}
 MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB
 
 
+# Rows loaded per query batch on streamed pages
+STREAM_BATCH = 100
+
+# Time ranges on the author stats page
+STATS_DAYS = 30
+STATS_HOURS = 48
+
+
 def allowed_file(filename):
     """Check if file extension is allowed"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def stream_page(template_name, **context):
+    """Render a long page while it is being sent to the browser"""
+    # The session is saved before the body is streamed, so read flash messages now
+    get_flashed_messages(with_categories=True)
+    return stream_template(template_name, **context)
+
+
+def following_ids_of(user_id):
+    """Ids of the users someone follows"""
+    if user_id is None:
+        return set()
+    rows = db.session.query(follow_table.c.followed_id).filter(follow_table.c.follower_id == user_id)
+    return {row[0] for row in rows}
+
+
 def setup_routes(app):
     """Setup all routes"""
     
-    from app import get_current_user
+    from app import get_current_user, get_current_user_info, get_unread_count
+
+    def viewer_version():
+        """Parts of every page that depend on the logged in user (navbar)"""
+        info = get_current_user_info()
+        if info is None:
+            return ()
+        return (info.username, info.role, info.profile_photo, get_unread_count())
 
     # Delete post
     @app.route('/post/<int:post_id>/delete', methods=['POST'])
@@ -51,8 +100,8 @@ def setup_routes(app):
                 flash('You cannot delete this post', 'danger')
                 return redirect(url_for('post_detail', post_id=post_id))
 
-            db.session.delete(post)
-            db.session.commit()
+            # Likes, comments and notifications are removed by the database
+            delete_posts([post.id])
             flash('Post deleted', 'success')
 
             if user.role == 'admin':
@@ -67,11 +116,13 @@ def setup_routes(app):
     @app.route('/')
     def index():
         """Home page"""
-        posts = Post.query.filter_by(is_published=True)
+        posts = Post.query.options(joinedload(Post.author)).filter_by(is_published=True)
         posts = posts.order_by(Post.created_at.desc())
         posts = posts.limit(6)
         posts = posts.all()
-        return render_template('index.html', posts=posts)
+        user = get_current_user_info()
+        who_to_follow = suggestions_for(user.id, limit=4) if user else []
+        return render_template('index.html', posts=posts, trending=trending_posts(limit=3), who_to_follow=who_to_follow)
     
     
     # All posts
@@ -82,8 +133,9 @@ def setup_routes(app):
             q = request.args.get('q', '')
             language = request.args.get('language', '')
             level = request.args.get('level', '')
+            sort = request.args.get('sort', 'new')
             
-            # Get all posts that are published
+            # Get all posts that are published (content column is not loaded)
             posts_list = Post.query.filter_by(is_published=True)
             
             # Filter by search using SQL LIKE
@@ -93,6 +145,9 @@ def setup_routes(app):
                     (Post.content.ilike(f'%{q}%'))
                 )
             
+            # Post counts for the filter options come from the search before the filters
+            search_query = posts_list if q else None
+            
             # Filter by language
             if language:
                 posts_list = posts_list.filter_by(language=language)
@@ -101,17 +156,38 @@ def setup_routes(app):
             if level:
                 posts_list = posts_list.filter_by(level=level)
             
-            # Sort by newest first
-            posts_list = posts_list.order_by(Post.created_at.desc()).all()
+            # Browser already has this version of the page?
+            version = posts_list.with_entities(db.func.max(Post.updated_at), db.func.count(Post.id)).first()
+            trending_version = get_state('trending:watermark') if sort == 'trending' else None
+            cached = not_modified(tuple(version), facets.facet_version(search_query), trending_version,
+                                  *viewer_version())
+            if cached is not None:
+                return cached
+            counts = facets.facet_counts(language, level, search_query)
+            
+            # Like and repost counts as numbers, not every Like/Repost row
+            like_count = db.select(db.func.count(Like.id)).where(Like.post_id == Post.id).scalar_subquery()
+            repost_count = db.select(db.func.count(Repost.id)).where(Repost.post_id == Post.id).scalar_subquery()
+            posts_list = posts_list.options(joinedload(Post.author))\
+                                   .add_columns(like_count.label('like_count'), repost_count.label('repost_count'))
+            
+            # Sort by trending score or newest first
+            if sort == 'trending':
+                posts_list = posts_list.join(PostScore, PostScore.post_id == Post.id)\
+                                       .order_by(PostScore.score.desc())
+            else:
+                posts_list = posts_list.order_by(Post.created_at.desc())
+            posts_list = posts_list.yield_per(STREAM_BATCH)
             
             # Save active filters
             active_filters = {
                 'q': q,
                 'language': language,
-                'level': level
+                'level': level,
+                'sort': sort
             }
             
-            return render_template('posts.html', posts=posts_list, filters=active_filters)
+            return stream_page('posts.html', posts=posts_list, filters=active_filters, facets=counts)
         except Exception as e:
             flash('Error loading posts', 'danger')
             return redirect(url_for('index'))
@@ -128,10 +204,25 @@ def setup_routes(app):
     @app.route('/post/<int:post_id>')
     def post_detail(post_id):
         """View a single post with comments"""
-        post = Post.query.get(post_id)
+        post = Post.query.options(undefer_group('body')).get(post_id)
+        if post is None:
+            return "Post not found", 404
+        thread, next_after = comments.get_threads(post.id)
+        comment_count = Comment.query.filter_by(post_id=post.id).count()
+        return render_template('post_detail.html', post=post, comments=thread, next_after=next_after,
+                               comment_count=comment_count, related=related_posts(post.id))
+    
+    
+    # More comments (load more button on the post page)
+    @app.route('/post/<int:post_id>/comments')
+    def post_comments(post_id):
+        """Next page of comment threads as an HTML fragment"""
+        post = db.session.get(Post, post_id)
         if post is None:
             return "Post not found", 404
-        return render_template('post_detail.html', post=post)
+        after = request.args.get('after', type=int)
+        thread, next_after = comments.get_threads(post.id, after=after)
+        return render_template('comment_list.html', post=post, comments=thread, next_after=next_after)
     
     
     # Create post
@@ -170,10 +261,10 @@ def setup_routes(app):
                         posts_dir = os.path.join('static', 'uploads', 'posts')
                         os.makedirs(posts_dir, exist_ok=True)
                         
-                        # Save file with secure filename
+                        # Save file with secure filename (content hash keeps names unique for caching)
                         filename = secure_filename(photo.filename)
                         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_')
-                        filename = timestamp + filename
+                        filename = f'{timestamp}{content_hash(photo)}_{filename}'
                         photo.save(os.path.join(posts_dir, filename))
                         photo_filename = filename
                 
@@ -187,10 +278,19 @@ def setup_routes(app):
                     photo=photo_filename,
                     is_published=False  # Admin needs to approve
                 )
+                render_post(new_post)
                 
                 db.session.add(new_post)
+                facets.adjust([(language, level, False, 1)])
                 db.session.commit()
                 
+                # Flag copies of existing posts for the moderators, the post is saved either way
+                try:
+                    check_post(new_post.id, title, content)
+                except Exception as e:
+                    db.session.rollback()
+                    logger.warning(f'Duplicate check failed for post {new_post.id}: {e}')
+                
                 flash('პოსტი დაიპოსტა, ადმინდა დაადასტურა', 'success')
                 return redirect(url_for('my_posts'))
             except Exception as e:
@@ -226,14 +326,16 @@ def setup_routes(app):
         
         content = request.form.get('content')
         if content:
-            new_comment = Comment(
-                content=content,
-                author=get_current_user(),
-                post=post
-            )
-            db.session.add(new_comment)
+            # Reply to another comment of the same post
+            parent = None
+            parent_id = request.form.get('parent_id', type=int)
+            if parent_id:
+                parent = Comment.query.filter_by(id=parent_id, post_id=post.id).first()
+            new_comment = comments.add_comment(post, user, content, parent=parent)
+            post.updated_at = datetime.now()
             db.session.commit()
             flash('კომენტარი დამატებულია!', 'success')
+            return redirect(url_for('post_detail', post_id=post_id, _anchor=f'comment-{new_comment.id}'))
         
         return redirect(url_for('post_detail', post_id=post_id))
     
@@ -246,8 +348,10 @@ def setup_routes(app):
         if user is None or user.role != 'admin':
             flash('Access denied', 'danger')
             return redirect(url_for('index'))
-        pending = Post.query.filter_by(is_published=False).all()
-        return render_template('admin.html', pending_posts=pending)
+        page = request.args.get('page', 1, type=int)
+        pending = get_pending_page(page)
+        duplicates = duplicate_flags([post.id for post in pending.items])
+        return render_template('admin.html', pending_posts=pending.items, pagination=pending, duplicates=duplicates)
     
     
     # Approve post
@@ -261,12 +365,44 @@ def setup_routes(app):
         post = Post.query.get(post_id)
         if post is None:
             return "Post not found", 404
-        post.is_published = True
-        db.session.commit()
+        approve_posts([post.id], user)
         flash(f'პოსტი "{post.title}" დადასტურებულია!', 'success')
         return redirect(url_for('admin'))
     
     
+    # Approve or reject many posts at once
+    @app.route('/admin/bulk', methods=['POST'])
+    def bulk_moderate():
+        """Admin approves or rejects the selected posts"""
+        user = get_current_user()
+        if user is None or user.role != 'admin':
+            flash('Access denied', 'danger')
+            return redirect(url_for('index'))
+        action = request.form.get('action', '')
+        post_ids = request.form.getlist('post_ids', type=int)
+        page = request.form.get('page', 1, type=int)
+        
+        if not post_ids:
+            flash('პოსტი არ არის არჩეული.', 'warning')
+            return redirect(url_for('admin', page=page))
+        
+        try:
+            if action == 'approve':
+                done = approve_posts(post_ids, user)
+                flash(f'{len(done)} პოსტი დადასტურებულია!', 'success')
+            elif action == 'reject':
+                done = reject_posts(post_ids, user)
+                flash(f'{len(done)} პოსტი უარყოფილია.', 'info')
+            else:
+                flash('Unknown action', 'danger')
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f'Bulk moderation failed: {e}')
+            flash('Error moderating posts', 'danger')
+        
+        return redirect(url_for('admin', page=page))
+    
+    
     # Login
     @app.route('/login', methods=['GET', 'POST'])
     def login():
@@ -281,12 +417,12 @@ def setup_routes(app):
                 flash('Username and password required', 'danger')
                 return redirect(url_for('login'))
             
-            user = User.query.filter_by(username=username).first()
+            user = User.query.filter_by(username=username, deleted_at=None).first()
             
             if not user:
                 logger.warning(f"User not found: {username}")
                 flash('Wrong username or password', 'danger')
-            elif check_password_hash(user.password, password):
+            elif user.password and check_password_hash(user.password, password):
                 session['user_id'] = user.id
                 logger.info(f"✓ Login successful for: {username}")
                 flash('Login successful!', 'success')
@@ -352,6 +488,7 @@ def setup_routes(app):
                 
                 db.session.add(new_user)
                 db.session.commit()
+                forget_users()
                 
                 flash('Registration successful! Please log in.', 'success')
                 return redirect(url_for('login'))
@@ -434,8 +571,12 @@ def setup_routes(app):
                 user.password = generate_password_hash(new_password)
                 db.session.commit()
                 
-                # Clear the reset token
-                session.pop(f'reset_token_{user_id}', None)
+                # Log the user out on every device
+                revoke_user_sessions(app, user.id)
+                
+                # This session too: saved with the user still in it, the revoked
+                # session would be written back. Clearing the user gives it a new id.
+                session.clear()
                 
                 flash('პაროლი წარმატებით აღდგა! გთხოვთ შედით ახალი პაროლით.', 'success')
                 return redirect(url_for('login'))
@@ -465,7 +606,7 @@ def setup_routes(app):
                 return redirect(url_for('reset_password'))
             
             # Verify old password
-            if not check_password_hash(current_user.password, old_password):
+            if not current_user.password or not check_password_hash(current_user.password, old_password):
                 flash('ძველი პაროლი არასწორია.', 'danger')
                 return redirect(url_for('reset_password'))
             
@@ -482,11 +623,40 @@ def setup_routes(app):
             # Update password
             current_user.password = generate_password_hash(new_password)
             db.session.commit()
+            
+            # Log out other devices, keep this session
+            revoke_user_sessions(app, current_user.id, keep_sid=session.sid)
             flash('პაროლი წარმატებით შეიცვალა!', 'success')
             return redirect(url_for('user_profile', username=current_user.username))
         
         return render_template('reset_password.html')
     
+    
+    # Delete account
+    @app.route('/delete-account', methods=['POST'])
+    def delete_account():
+        """Flag the account as deleted, the purge job removes its content"""
+        user = get_current_user()
+        if user is None:
+            flash('Please log in first', 'warning')
+            return redirect(url_for('login'))
+        
+        password = request.form.get('password', '')
+        if not user.password or not check_password_hash(user.password, password):
+            flash('პაროლი არასწორია.', 'danger')
+            return redirect(url_for('reset_password'))
+        
+        user.deleted_at = datetime.now()
+        db.session.commit()
+        
+        # Log out everywhere, including this browser
+        revoke_user_sessions(app, user.id)
+        invalidate_user(user.id)
+        forget_users()
+        session.clear()
+        flash('ანგარიში წაიშალა.', 'info')
+        return redirect(url_for('index'))
+    
     # Like post
     @app.route('/post/<int:post_id>/like', methods=['POST'])
     def like_post(post_id):
@@ -507,6 +677,7 @@ def setup_routes(app):
             if already_liked:
                 # If already liked, remove the like (unlike)
                 db.session.delete(already_liked)
+                post.updated_at = datetime.now()
                 db.session.commit()
                 flash('პოსტზე მოწონება გააუქმეთ!', 'info')
             else:
@@ -516,6 +687,7 @@ def setup_routes(app):
                     author_id=user.id
                 )
                 db.session.add(new_like)
+                post.updated_at = datetime.now()
                 if post.author_id != user.id:
                     db.session.add(Notification(
                         user_id=post.author_id,
@@ -553,6 +725,7 @@ def setup_routes(app):
             if already_reposted:
                 # If already reposted, remove the repost
                 db.session.delete(already_reposted)
+                post.updated_at = datetime.now()
                 db.session.commit()
                 flash('რეპოსტი წაშლილია.', 'info')
             else:
@@ -562,6 +735,7 @@ def setup_routes(app):
                     author_id=user.id
                 )
                 db.session.add(new_repost)
+                post.updated_at = datetime.now()
                 if post.author_id != user.id:
                     db.session.add(Notification(
                         user_id=post.author_id,
@@ -590,10 +764,33 @@ def setup_routes(app):
     @app.route('/user/<username>')
     def user_profile(username):
         """Show user profile with their posts and reposts"""
-        user = User.query.filter_by(username=username).first()
+        user = User.query.filter_by(username=username, deleted_at=None).first()
         if user is None:
             return "User not found", 404
         
+        # Browser already has this version of the page?
+        viewer_id = session.get('user_id')
+        posts_version = db.session.query(db.func.max(Post.updated_at), db.func.count(Post.id))\
+                                  .filter(Post.author_id == user.id).first()
+        reposts_version = db.session.query(db.func.max(Repost.id), db.func.count(Repost.id))\
+                                    .filter(Repost.author_id == user.id).first()
+        # The page shows follower/following counts and the viewer's follow buttons
+        follower, followed = follow_table.c.follower_id, follow_table.c.followed_id
+        def counted(condition):
+            return db.func.sum(db.case((condition, 1), else_=0))
+        follows_version = db.session.query(
+            counted(followed == user.id), counted(follower == user.id),
+            counted((follower == viewer_id) & (followed == user.id)),
+            counted((follower == user.id) & (followed == viewer_id))
+        ).filter((follower == user.id) | (followed == user.id)).first()
+        cached = not_modified(
+            user.username, user.bio, user.level, user.profile_photo,
+            tuple(posts_version), tuple(reposts_version), tuple(follows_version), viewer_id,
+            *viewer_version()
+        )
+        if cached is not None:
+            return cached
+        
         # Get user's own posts
         user_posts_all = Post.query.filter_by(author_id=user.id).all()
         user_posts = sorted(user_posts_all, key=lambda p: p.created_at, reverse=True)
@@ -619,6 +816,101 @@ def setup_routes(app):
         return render_template('user_profile.html', user=user, posts=user_posts, reposts=user_reposts, is_following=is_following, is_mutual_follow=is_mutual_follow)
     
     
+    # Author stats
+    def stats_owner(username):
+        """User whose stats may be seen by the logged in user, or None"""
+        viewer = get_current_user_info()
+        if viewer is None:
+            return None
+        user = User.query.filter_by(username=username, deleted_at=None).first()
+        if user is None or (viewer.id != user.id and viewer.role != 'admin'):
+            return None
+        return user
+    
+    
+    @app.route('/user/<username>/stats')
+    def user_stats(username):
+        """Engagement on the user's posts (own profile or admin)"""
+        user = stats_owner(username)
+        if user is None:
+            flash('Access denied', 'danger')
+            return redirect(url_for('index'))
+        
+        now = datetime.now()
+        daily = rollups.author_series(user.id, 'day', since=now - timedelta(days=STATS_DAYS))
+        hourly = rollups.author_series(user.id, 'hour', since=now - timedelta(hours=STATS_HOURS))
+        top = rollups.top_posts(user.id, since=now - timedelta(days=STATS_DAYS))
+        busiest = max([row.likes + row.reposts + row.comments for row in daily] + [1])
+        return render_template('user_stats.html', user=user, daily=daily, hourly=hourly, top_posts=top,
+                               totals=rollups.series_totals(daily), busiest=busiest, days=STATS_DAYS)
+    
+    
+    @app.route('/api/users/<username>/stats')
+    def user_stats_api(username):
+        """Engagement buckets as JSON: ?period=day|hour&days=N"""
+        user = stats_owner(username)
+        if user is None:
+            return jsonify({'error': 'forbidden'}), 403
+        
+        period = request.args.get('period', 'day')
+        if period not in ('day', 'hour'):
+            return jsonify({'error': 'period must be day or hour'}), 400
+        days = min(max(request.args.get('days', STATS_DAYS, type=int), 1), 365)
+        since = datetime.now() - timedelta(days=days)
+        series = rollups.author_series(user.id, period, since=since)
+        return jsonify({
+            'user': user.username,
+            'period': period,
+            'since': since.isoformat(),
+            'totals': rollups.series_totals(series),
+            'buckets': [
+                {'start': row.bucket.isoformat(), 'likes': row.likes, 'reposts': row.reposts, 'comments': row.comments}
+                for row in series
+            ],
+            'top_posts': [
+                {'id': post.id, 'title': post.title, 'likes': likes, 'reposts': reposts, 'comments': comments}
+                for post, likes, reposts, comments in rollups.top_posts(user.id, since=since)
+            ],
+        })
+    
+    
+    # User search (autocomplete)
+    @app.route('/api/users/search')
+    def user_search_api():
+        """Users whose name starts with ?q= as JSON"""
+        limit = min(max(request.args.get('limit', 10, type=int), 1), 20)
+        users = search_users(request.args.get('q', ''), limit=limit)
+        response = jsonify([{'username': username, 'profile_photo': photo} for username, photo in users])
+        # Same keystrokes again (backspace) are answered by the browser
+        response.headers['Cache-Control'] = 'public, max-age=30'
+        return response
+    
+    
+    # Atom/RSS feeds
+    @app.route('/feed.<fmt>')
+    def posts_feed(fmt):
+        """Newest posts, optionally for one ?language= and/or ?level="""
+        if fmt not in feeds.FORMATS:
+            return "Feed not found", 404
+        language = request.args.get('language', '')[:50] or None
+        level = request.args.get('level', '')[:50] or None
+        title = ' — '.join(['DevLog'] + [part for part in (language, level) if part])
+        link = url_for('posts', language=language, level=level, _external=True)
+        return feeds.feed_response(fmt, title, link, language=language, level=level)
+    
+    
+    @app.route('/user/<username>/feed.<fmt>')
+    def user_feed(username, fmt):
+        """Newest posts of one author"""
+        if fmt not in feeds.FORMATS:
+            return "Feed not found", 404
+        user = db.session.query(User.id, User.username).filter_by(username=username, deleted_at=None).first()
+        if user is None:
+            return "User not found", 404
+        link = url_for('user_profile', username=user.username, _external=True)
+        return feeds.feed_response(fmt, f'DevLog — {user.username}', link, author_id=user.id)
+    
+    
     # Update bio
     @app.route('/user/update-bio', methods=['POST'])
     def update_bio():
@@ -690,8 +982,8 @@ def setup_routes(app):
                 upload_dir = os.path.join('static', 'uploads', 'profiles')
                 os.makedirs(upload_dir, exist_ok=True)
                 
-                # Generate unique filename
-                filename = secure_filename(f"{user.id}_{file.filename}")
+                # Generate unique filename (content hash, so browsers can cache it forever)
+                filename = secure_filename(f"{user.id}_{content_hash(file)}_{file.filename}")
                 filepath = os.path.join(upload_dir, filename)
                 
                 # Save file
@@ -700,6 +992,8 @@ def setup_routes(app):
                 # Update user's profile_photo
                 user.profile_photo = f'/{filepath.replace(chr(92), "/")}'
                 db.session.commit()
+                invalidate_user(user.id)
+                forget_users()
                 
                 flash('ფოტო განახლებულია!', 'success')
             except Exception as e:
@@ -733,6 +1027,7 @@ def setup_routes(app):
             flash('თქვენ უკვე აfolloweბთ ამ მომხმარებელს.', 'info')
         else:
             current_user.following.append(user_to_follow)
+            FollowSuggestion.query.filter_by(user_id=current_user.id, suggested_id=user_to_follow.id).delete()
             if user_to_follow.id != current_user.id:
                 db.session.add(Notification(
                     user_id=user_to_follow.id,
@@ -750,21 +1045,23 @@ def setup_routes(app):
     @app.route('/notifications')
     def notifications():
         """List notifications for the current user and mark them read"""
-        user = get_current_user()
+        user = get_current_user_info()
         if user is None:
             flash('Please log in first', 'warning')
             return redirect(url_for('login'))
-        notifications = Notification.query.filter_by(user_id=user.id)\
-                          .order_by(Notification.created_at.desc())\
-                          .all()
-
-        unread = [n for n in notifications if not n.is_read]
-        for note in unread:
-            note.is_read = True
-        if unread:
+        
+        # Mark everything read in one UPDATE, the page shows them as read
+        updated = Notification.query.filter_by(user_id=user.id, is_read=False)\
+                                    .update({'is_read': True}, synchronize_session=False)
+        if updated:
             db.session.commit()
+        
+        notifications = Notification.query.options(joinedload(Notification.sender), joinedload(Notification.post))\
+                          .filter_by(user_id=user.id)\
+                          .order_by(Notification.created_at.desc())\
+                          .yield_per(STREAM_BATCH)
 
-        return render_template('notifications.html', notifications=notifications)
+        return stream_page('notifications.html', notifications=notifications, following_ids=following_ids_of(user.id))
     
     
     # Messages
@@ -776,41 +1073,34 @@ def setup_routes(app):
             flash('Please log in first', 'warning')
             return redirect(url_for('login'))
         
-        # Get all messages
-        sent_messages = Message.query.filter_by(sender_id=current_user.id).all()
-        received_messages = Message.query.filter_by(receiver_id=current_user.id).all()
-        all_messages = sent_messages + received_messages
-        
-        # Find unique users
-        convo_user_ids = set()
-        for msg in sent_messages:
-            convo_user_ids.add(msg.receiver_id)
-        for msg in received_messages:
-            convo_user_ids.add(msg.sender_id)
-        
+        # One row per conversation: newest message id and unread count
+        mine = (Message.sender_id == current_user.id) | (Message.receiver_id == current_user.id)
+        unread = db.case(((Message.receiver_id == current_user.id) & (Message.is_read == db.false()), 1), else_=0)
+        summary = db.session.query(Message.conversation_id, db.func.max(Message.id), db.func.sum(unread))\
+                            .filter(mine)\
+                            .group_by(Message.conversation_id)\
+                            .all()
+        last_messages = {}
+        if summary:
+            last_messages = {m.conversation_id: m for m in Message.query.filter(
+                Message.conversation_id.in_([row[0] for row in summary]),
+                Message.id.in_([row[1] for row in summary])
+            )}
+
+        # The other user of each conversation, plus conversations that are only archived
+        partners = {}
+        for conversation_id, _, unread_count in summary:
+            low, high = conversation_id >> 32, conversation_id & 0xffffffff
+            partners[high if low == current_user.id else low] = (last_messages.get(conversation_id), unread_count or 0)
+        for user_id in archived_partners(current_user.id):
+            partners.setdefault(user_id, (None, 0))
+        users = User.query.filter(User.id.in_(list(partners))).all() if partners else []
+
         # Build conversations list
-        conversations = []
-        for user_id in convo_user_ids:
-            other_user = User.query.get(user_id)
-            if other_user:
-                # Find last message with this user
-                msgs_with_user = [m for m in all_messages if (m.sender_id == current_user.id and m.receiver_id == user_id) or (m.sender_id == user_id and m.receiver_id == current_user.id)]
-                if msgs_with_user:
-                    last_msg = sorted(msgs_with_user, key=lambda m: m.created_at)[-1]
-                else:
-                    last_msg = None
-                
-                # Count unread
-                unread_count = 0
-                for msg in received_messages:
-                    if msg.sender_id == user_id and not msg.is_read:
-                        unread_count = unread_count + 1
-                
-                conversations.append({
-                    'user': other_user,
-                    'last_message': last_msg,
-                    'unread_count': unread_count
-                })
+        conversations = [
+            {'user': other_user, 'last_message': partners[other_user.id][0], 'unread_count': partners[other_user.id][1]}
+            for other_user in users
+        ]
         
         # Sort by latest message
         conversations.sort(key=lambda x: x['last_message'].created_at if x['last_message'] else datetime.min, reverse=True)
@@ -850,18 +1140,31 @@ def setup_routes(app):
                 flash('შეტყობინება ცარიელია.', 'danger')
             return redirect(url_for('message_thread', username=other_user.username))
 
-        messages = Message.query.filter_by(sender_id=current_user.id, receiver_id=other_user.id).all()
-        messages2 = Message.query.filter_by(sender_id=other_user.id, receiver_id=current_user.id).all()
-        messages = messages + messages2
-        messages = sorted(messages, key=lambda m: m.created_at)
+        # Both directions share conversation_id (one partition on PostgreSQL)
+        conversation_id = conversation_key(current_user.id, other_user.id)
 
-        unread = [m for m in messages if m.receiver_id == current_user.id and not m.is_read]
-        for m in unread:
-            m.is_read = True
-        if unread:
+        # Mark received messages read first, the commit would expire loaded messages
+        marked = db.session.execute(
+            db.update(Message)
+              .where(Message.conversation_id == conversation_id, Message.receiver_id == current_user.id,
+                     Message.is_read == db.false())
+              .values(is_read=True),
+            execution_options={'synchronize_session': False}
+        )
+        if marked.rowcount:
             db.session.commit()
 
-        return render_template('messages_thread.html', other=other_user, messages=messages)
+        messages = Message.query.filter(Message.conversation_id == conversation_id)\
+                                .order_by(Message.created_at).all()
+
+        # Older messages live in the compressed archive, loaded only on request
+        archived = archived_count(current_user.id, other_user.id)
+        show_archive = archived and request.args.get('archive') == '1'
+        if show_archive:
+            messages = load_archive(current_user.id, other_user.id) + messages
+
+        return render_template('messages_thread.html', other=other_user, messages=messages,
+                               archived=archived, show_archive=show_archive)
 
 
     # View followers
@@ -871,8 +1174,12 @@ def setup_routes(app):
         user = User.query.filter_by(username=username).first()
         if user is None:
             return "User not found", 404
-        followers = user.followers
-        return render_template('followers_list.html', user=user, followers=followers)
+        followers = User.query.join(follow_table, follow_table.c.follower_id == User.id)\
+                              .filter(follow_table.c.followed_id == user.id)\
+                              .order_by(User.username)
+        total = followers.count()
+        return stream_page('followers_list.html', user=user, followers=followers.yield_per(STREAM_BATCH),
+                           total=total, following_ids=following_ids_of(session.get('user_id')))
 
 
     # View following
@@ -882,8 +1189,12 @@ def setup_routes(app):
         user = User.query.filter_by(username=username).first()
         if user is None:
             return "User not found", 404
-        following = user.following
-        return render_template('following_list.html', user=user, following=following)
+        following = User.query.join(follow_table, follow_table.c.followed_id == User.id)\
+                              .filter(follow_table.c.follower_id == user.id)\
+                              .order_by(User.username)
+        total = following.count()
+        return stream_page('following_list.html', user=user, following=following.yield_per(STREAM_BATCH),
+                           total=total, following_ids=following_ids_of(session.get('user_id')))
 
 
     # Follow back
@@ -0,0 +1,223 @@
+"""
+Server-side sessions for DevLog
+The cookie only keeps a signed session id, the data lives in a store
+"""
+
+import secrets
+import threading
+from datetime import datetime
+
+from flask import current_app
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import Signer, BadSignature
+from werkzeug.datastructures import CallbackDict
+
+from jobs import job
+from models import db, UserSession
+
+
+serializer = TaggedJSONSerializer()
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Session dict that remembers its id and whether it changed"""
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        # Used to give the session a new id after login/logout
+        self.loaded_user_id = self.get('user_id')
+        self.expires_at = None
+
+
+class SqlSessionStore:
+    """Keep sessions in the user_sessions table"""
+
+    def load(self, sid):
+        """Return (data, expires_at) or None if missing/expired"""
+        table = UserSession.__table__
+        with db.engine.connect() as conn:
+            row = conn.execute(
+                db.select(table.c.data, table.c.expires_at).where(table.c.id == sid)
+            ).first()
+        if row is None or row.expires_at < datetime.now():
+            return None
+        return serializer.loads(row.data), row.expires_at
+
+    def save(self, sid, data, expires_at):
+        table = UserSession.__table__
+        values = {
+            'data': serializer.dumps(data),
+            'expires_at': expires_at,
+            'user_id': data.get('user_id'),
+        }
+        with db.engine.begin() as conn:
+            result = conn.execute(table.update().where(table.c.id == sid).values(**values))
+            if result.rowcount == 0:
+                conn.execute(table.insert().values(id=sid, **values))
+
+    def delete(self, sid):
+        table = UserSession.__table__
+        with db.engine.begin() as conn:
+            conn.execute(table.delete().where(table.c.id == sid))
+
+    def delete_for_user(self, user_id, keep_sid=None):
+        table = UserSession.__table__
+        query = table.delete().where(table.c.user_id == user_id)
+        if keep_sid is not None:
+            query = query.where(table.c.id != keep_sid)
+        with db.engine.begin() as conn:
+            result = conn.execute(query)
+        return result.rowcount
+
+    def cleanup(self):
+        """Remove expired sessions"""
+        table = UserSession.__table__
+        with db.engine.begin() as conn:
+            result = conn.execute(table.delete().where(table.c.expires_at < datetime.now()))
+        return result.rowcount
+
+
+class LocalSessionStore:
+    """Keep sessions in a dict (single process, good for local development)"""
+
+    def __init__(self):
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def load(self, sid):
+        with self.lock:
+            item = self.sessions.get(sid)
+        if item is None or item[2] < datetime.now():
+            return None
+        return serializer.loads(item[0]), item[2]
+
+    def save(self, sid, data, expires_at):
+        with self.lock:
+            self.sessions[sid] = (serializer.dumps(data), data.get('user_id'), expires_at)
+
+    def delete(self, sid):
+        with self.lock:
+            self.sessions.pop(sid, None)
+
+    def delete_for_user(self, user_id, keep_sid=None):
+        with self.lock:
+            sids = [sid for sid, item in self.sessions.items()
+                    if item[1] == user_id and sid != keep_sid]
+            for sid in sids:
+                del self.sessions[sid]
+        return len(sids)
+
+    def cleanup(self):
+        now = datetime.now()
+        with self.lock:
+            sids = [sid for sid, item in self.sessions.items() if item[2] < now]
+            for sid in sids:
+                del self.sessions[sid]
+        return len(sids)
+
+
+SESSION_STORES = {
+    'sql': SqlSessionStore,
+    'local': LocalSessionStore,
+}
+
+
+class ServerSessionInterface(SessionInterface):
+    """Flask session interface backed by one of the stores above"""
+
+    salt = 'devlog-session'
+
+    def __init__(self, store):
+        self.store = store
+
+    def get_signer(self, app):
+        return Signer(app.secret_key, salt=self.salt)
+
+    def get_lifetime(self, app):
+        return app.permanent_session_lifetime
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self.get_signer(app).unsign(cookie).decode()
+            except BadSignature:
+                sid = None
+            if sid:
+                loaded = self.store.load(sid)
+                if loaded is not None:
+                    session = ServerSession(loaded[0], sid=sid)
+                    session.expires_at = loaded[1]
+                    return session
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        # Pages depend on who is logged in
+        response.vary.add('Cookie')
+
+        # Empty session: forget it on the server and in the browser
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path, secure=secure,
+                                       samesite=samesite, httponly=httponly)
+            return
+
+        # New session id when the logged in user changes (session fixation)
+        if session.get('user_id') != session.loaded_user_id and not session.new:
+            self.store.delete(session.sid)
+            session.sid = secrets.token_urlsafe(32)
+            session.new = True
+
+        # Only write when something changed or half of the lifetime has passed
+        lifetime = self.get_lifetime(app)
+        now = datetime.now()
+        refresh = session.expires_at is None or session.expires_at - now < lifetime / 2
+        if not (session.modified or session.new or refresh):
+            return
+
+        self.store.save(session.sid, dict(session), now + lifetime)
+        if session.new or session.permanent:
+            response.set_cookie(
+                name,
+                self.get_signer(app).sign(session.sid).decode(),
+                expires=self.get_expiration_time(app, session),
+                httponly=httponly,
+                domain=domain,
+                path=path,
+                secure=secure,
+                samesite=samesite,
+            )
+
+
+def init_sessions(app):
+    """Switch the app to server-side sessions"""
+    backend = app.config.get('SESSION_BACKEND', 'sql')
+    if backend not in SESSION_STORES:
+        raise ValueError(f'Unknown session backend: {backend}')
+    app.session_interface = ServerSessionInterface(SESSION_STORES[backend]())
+
+
+def revoke_user_sessions(app, user_id, keep_sid=None):
+    """Log a user out everywhere (optionally keep the current session)"""
+    return app.session_interface.store.delete_for_user(user_id, keep_sid=keep_sid)
+
+
+@job('sessions', interval=3600)
+def cleanup_sessions():
+    """Remove expired sessions from the store"""
+    return current_app.session_interface.store.cleanup()
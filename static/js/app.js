@@ -200,6 +200,148 @@
         });
     }
 
+    // ============================================
+    // LOAD MORE COMMENTS
+    // ============================================
+    function initLoadMoreComments() {
+        document.addEventListener('click', function(e) {
+            const button = e.target.closest('.comments-load-more');
+            if (!button) {
+                return;
+            }
+            button.disabled = true;
+            fetch(button.dataset.url)
+                .then(response => {
+                    if (!response.ok) {
+                        throw new Error(response.statusText);
+                    }
+                    return response.text();
+                })
+                .then(html => {
+                    // The fragment brings its own "load more" button when there is more
+                    button.closest('.comments-more').outerHTML = html;
+                })
+                .catch(() => {
+                    button.disabled = false;
+                });
+        });
+    }
+
+    // ============================================
+    // USERNAME AUTOCOMPLETE
+    // ============================================
+    // data-user-autocomplete="mention": completes @name in a textarea
+    // data-user-autocomplete="pick": opens data-href with __username__ replaced
+    function initUserAutocomplete() {
+        document.querySelectorAll('[data-user-autocomplete]').forEach(field => {
+            const mode = field.dataset.userAutocomplete;
+            const list = document.createElement('div');
+            list.className = 'list-group user-suggestions d-none';
+            field.insertAdjacentElement('afterend', list);
+
+            let timer = null;
+            let controller = null;
+            let active = -1;
+
+            function currentQuery() {
+                if (mode === 'pick') {
+                    return field.value.trim().replace(/^@/, '');
+                }
+                const before = field.value.slice(0, field.selectionStart);
+                const match = before.match(/(?:^|\s)@([\w.-]{1,80})$/);
+                return match ? match[1] : '';
+            }
+
+            function hide() {
+                list.classList.add('d-none');
+                list.innerHTML = '';
+                active = -1;
+            }
+
+            function choose(username) {
+                if (mode === 'pick') {
+                    window.location = field.dataset.href.replace('__username__', encodeURIComponent(username));
+                    return;
+                }
+                const caret = field.selectionStart;
+                const before = field.value.slice(0, caret).replace(/@[\w.-]*$/, '@' + username + ' ');
+                field.value = before + field.value.slice(caret);
+                field.setSelectionRange(before.length, before.length);
+                field.focus();
+                hide();
+            }
+
+            function show(users) {
+                list.innerHTML = '';
+                active = -1;
+                users.forEach(user => {
+                    const item = document.createElement('button');
+                    item.type = 'button';
+                    item.className = 'list-group-item list-group-item-action d-flex align-items-center gap-2';
+                    const img = document.createElement('img');
+                    img.src = user.profile_photo;
+                    img.className = 'rounded-circle';
+                    img.width = 24;
+                    img.height = 24;
+                    item.appendChild(img);
+                    item.appendChild(document.createTextNode('@' + user.username));
+                    // mousedown fires before the field loses focus
+                    item.addEventListener('mousedown', e => {
+                        e.preventDefault();
+                        choose(user.username);
+                    });
+                    list.appendChild(item);
+                });
+                list.classList.toggle('d-none', users.length === 0);
+            }
+
+            function highlight(index) {
+                const items = list.querySelectorAll('.list-group-item');
+                if (!items.length) {
+                    return;
+                }
+                active = (index + items.length) % items.length;
+                items.forEach((item, i) => item.classList.toggle('active', i === active));
+            }
+
+            field.addEventListener('input', () => {
+                clearTimeout(timer);
+                const query = currentQuery();
+                if (!query) {
+                    hide();
+                    return;
+                }
+                timer = setTimeout(() => {
+                    if (controller) {
+                        controller.abort();
+                    }
+                    controller = new AbortController();
+                    fetch('/api/users/search?q=' + encodeURIComponent(query), { signal: controller.signal })
+                        .then(response => response.ok ? response.json() : [])
+                        .then(show)
+                        .catch(() => {});
+                }, 150);
+            });
+
+            field.addEventListener('keydown', e => {
+                if (list.classList.contains('d-none')) {
+                    return;
+                }
+                if (e.key === 'ArrowDown' || e.key === 'ArrowUp') {
+                    e.preventDefault();
+                    highlight(active + (e.key === 'ArrowDown' ? 1 : -1));
+                } else if (e.key === 'Enter' && active >= 0) {
+                    e.preventDefault();
+                    choose(list.querySelectorAll('.list-group-item')[active].textContent.slice(1));
+                } else if (e.key === 'Escape') {
+                    hide();
+                }
+            });
+
+            field.addEventListener('blur', hide);
+        });
+    }
+
     // ============================================
     // INITIALIZE ALL ON DOM READY
     // ============================================
@@ -225,6 +367,8 @@
         initAutoSubmitSearch();
         initScrollAnimations();
         initCodeBlockCopy();
+        initLoadMoreComments();
+        initUserAutocomplete();
     }
 
     // Start initialization
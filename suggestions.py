@@ -0,0 +1,91 @@
+"""
+"Who to follow" suggestions
+A job loads the whole follow graph into a SciPy sparse matrix and ranks, for
+every user, the people followed by the people they follow (friends of
+friends). Users with few of those get popular users of the same level and
+main language. Results go to follow_suggestions, pages only read that table.
+The NumPy/SciPy ranking is in follow_graph.py, which only the job imports.
+"""
+
+import logging
+import time
+from collections import defaultdict
+
+from jobs import job
+from models import db, User, FollowSuggestion, follow_table
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+
+SUGGESTIONS_PER_USER = 10
+# Extra score of a friend of friend with the same level / main language
+LEVEL_BONUS = 0.5
+LANGUAGE_BONUS = 0.5
+# Most followed users per level/language group, used to fill short lists
+POPULAR_PER_GROUP = 100
+# Users per sparse product, bounds the memory of one friends-of-friends step
+ROW_CHUNK = 20000
+# Rows fetched per round trip / per INSERT
+FETCH_BATCH = 10000
+WRITE_BATCH = 5000
+# Scores are compared at this precision when looking for changed lists
+SCORE_DIGITS = 6
+
+
+def save_suggestions(user_ids, users, candidates, scores, mutual):
+    """Rewrite the suggestions of users whose lists changed (caller commits)
+    Unchanged lists are not touched, so an hourly run writes little and
+    holds the write lock briefly on SQLite. Returns (suggestions, users written)."""
+    lists = defaultdict(set)
+    for u, c, s, m in zip(user_ids[users].tolist(), user_ids[candidates].tolist(), scores.tolist(), mutual.tolist()):
+        lists[u].add((c, round(s, SCORE_DIGITS), m))
+
+    current = defaultdict(set)
+    for rows in db.session.execute(
+        db.select(FollowSuggestion.user_id, FollowSuggestion.suggested_id, FollowSuggestion.score,
+                  FollowSuggestion.mutual).execution_options(yield_per=FETCH_BATCH)
+    ).partitions():
+        for u, c, s, m in rows:
+            current[u].add((c, round(s, SCORE_DIGITS), m))
+
+    changed = sorted(u for u in set(lists) | set(current) if lists.get(u) != current.get(u))
+    # About WRITE_BATCH rows per INSERT
+    per_batch = max(1, WRITE_BATCH // SUGGESTIONS_PER_USER)
+    for start in range(0, len(changed), per_batch):
+        batch = changed[start:start + per_batch]
+        db.session.execute(db.delete(FollowSuggestion).where(FollowSuggestion.user_id.in_(batch)))
+        rows = [{'user_id': u, 'suggested_id': c, 'score': s, 'mutual': m}
+                for u in batch for c, s, m in lists.get(u, ())]
+        if rows:
+            db.session.execute(db.insert(FollowSuggestion), rows)
+    return sum(len(items) for items in lists.values()), len(changed)
+
+
+@job('suggestions', interval=3600)
+def update_suggestions():
+    """Recompute follow suggestions for every user"""
+    from follow_graph import load_graph, rank_suggestions
+    started = time.perf_counter()
+    user_ids, levels, languages, follower, followed = load_graph()
+    loaded = time.perf_counter()
+    users, candidates, scores, mutual = rank_suggestions(follower, followed, levels, languages)
+    ranked = time.perf_counter()
+    saved, changed = save_suggestions(user_ids, users, candidates, scores, mutual)
+    db.session.commit()
+    logger.info(f'Suggestions: load {loaded - started:.1f}s, rank {ranked - loaded:.1f}s, '
+                f'save {time.perf_counter() - ranked:.1f}s')
+    return {'users': len(user_ids), 'edges': len(follower), 'suggestions': saved, 'changed': changed}
+
+
+def suggestions_for(user_id, limit=5):
+    """Suggested users, best first -> [(user, mutual)], skipping people followed since the last run"""
+    followed = db.select(follow_table.c.followed_id).where(follow_table.c.follower_id == user_id)
+    return db.session.query(User, FollowSuggestion.mutual)\
+                     .join(FollowSuggestion, FollowSuggestion.suggested_id == User.id)\
+                     .filter(FollowSuggestion.user_id == user_id,
+                             User.deleted_at.is_(None),
+                             User.id.notin_(followed))\
+                     .order_by(FollowSuggestion.score.desc())\
+                     .limit(limit)\
+                     .all()
@@ -0,0 +1,43 @@
+"""
+Template compilation
+Jinja compiles a template to Python code the first time it is rendered,
+in every worker process. Compiled templates are kept as bytecode in
+TEMPLATE_CACHE_DIR, so a new worker (after a deploy or a recycle) loads them
+instead of compiling, and precompile_templates() loads all of them before
+the first request. A changed template has a different checksum and is
+compiled again, even with auto reload off.
+"""
+
+import logging
+import os
+import time
+
+from jinja2 import FileSystemBytecodeCache
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+
+# Rendered by digest.py with its own environment
+SKIP_PREFIXES = ('email/',)
+
+
+def init_templates(app):
+    """Bytecode cache and auto reload for the app's Jinja environment"""
+    cache_dir = app.config.get('TEMPLATE_CACHE_DIR')
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+    # Checking every template file for changes on each render is for development only
+    app.jinja_env.auto_reload = app.config['TEMPLATES_AUTO_RELOAD']
+
+
+def precompile_templates(app):
+    """Load (and compile if needed) every template, returns (count, seconds)"""
+    started = time.perf_counter()
+    names = [n for n in app.jinja_env.list_templates() if not n.startswith(SKIP_PREFIXES)]
+    for name in names:
+        app.jinja_env.get_template(name)
+    elapsed = time.perf_counter() - started
+    logger.info(f'{len(names)} templates ready in {elapsed * 1000:.0f} ms')
+    return len(names), elapsed
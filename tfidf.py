@@ -0,0 +1,198 @@
+"""
+TF-IDF vectors and nearest posts for related.py, in NumPy and SciPy
+Imported by the related jobs only
+"""
+
+import os
+import zlib
+
+import numpy as np
+from scipy import sparse
+
+from models import db, Post, RelatedPost
+from related import (RELATED_PER_POST, N_FEATURES, TITLE_WEIGHT, MAX_DF, MAX_DF_FLOOR, MAX_TERMS,
+                     LANGUAGE_BONUS, LEVEL_BONUS, MIN_SCORE, CHUNK, INDEX_PATH, WORD_RE, replace_lists)
+
+
+# Vectors
+
+def term_counts(docs):
+    """[(title, content)] -> sparse matrix of hashed word counts"""
+    rows, features = [], []
+    # Most words repeat across posts, hash each one once
+    hashed = {}
+    for row, (title, content) in enumerate(docs):
+        words = WORD_RE.findall((title or '').lower()) * TITLE_WEIGHT + WORD_RE.findall((content or '').lower())
+        for word in words:
+            feature = hashed.get(word)
+            if feature is None:
+                feature = hashed[word] = zlib.crc32(word.encode()) % N_FEATURES
+            features.append(feature)
+        rows.extend([row] * len(words))
+    counts = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.float32), (np.array(rows, dtype=np.int64), np.array(features, dtype=np.int64))),
+        shape=(len(docs), N_FEATURES)
+    )
+    counts.sum_duplicates()
+    return counts
+
+
+def weigh(counts, df, n_docs):
+    """Word counts -> pruned, L2-normalized TF-IDF rows"""
+    idf = (np.log((1.0 + n_docs) / (1.0 + df)) + 1.0).astype(np.float32)
+    idf[df > max(MAX_DF * n_docs, MAX_DF_FLOOR)] = 0.0
+
+    tfidf = counts.copy()
+    np.log1p(tfidf.data, out=tfidf.data)
+    tfidf.data *= idf[tfidf.indices]
+
+    # Keep the MAX_TERMS strongest words of every post
+    for row in range(tfidf.shape[0]):
+        start, end = tfidf.indptr[row], tfidf.indptr[row + 1]
+        if end - start > MAX_TERMS:
+            values = tfidf.data[start:end]
+            values[values < np.partition(values, -MAX_TERMS)[-MAX_TERMS]] = 0.0
+    tfidf.eliminate_zeros()
+
+    norms = np.sqrt(np.asarray(tfidf.multiply(tfidf).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return sparse.csr_matrix(sparse.diags(1.0 / norms, dtype=np.float32) @ tfidf, dtype=np.float32)
+
+
+def nearest(vectors, languages, levels, rows, limit=RELATED_PER_POST):
+    """Top posts for some rows of the index -> (row, other row, score) arrays
+    languages and levels are integer codes, one per row"""
+    sources, targets, scores = [], [], []
+    # Many blocks: transpose the matrix once; a few new posts: transpose only them
+    transposed = vectors.T.tocsr() if len(rows) > CHUNK else None
+    for start in range(0, len(rows), CHUNK):
+        block = rows[start:start + CHUNK]
+        # Only posts sharing a word get a score, the product stays sparse
+        if transposed is not None:
+            similarity = (vectors[block] @ transposed).tocsr()
+        else:
+            similarity = (vectors @ vectors[block].T).T.tocsr()
+        source = np.repeat(block, np.diff(similarity.indptr))
+        other = similarity.indices
+        score = similarity.data
+        weak = (source == other) | (score < MIN_SCORE)
+        score += LANGUAGE_BONUS * (languages[source] == languages[other])
+        score += LEVEL_BONUS * (levels[source] == levels[other])
+        score[weak] = 0.0
+
+        for i in range(len(block)):
+            begin, end = similarity.indptr[i], similarity.indptr[i + 1]
+            if end - begin > limit:
+                top = begin + np.argpartition(score[begin:end], -limit)[-limit:]
+            else:
+                top = np.arange(begin, end)
+            top = top[score[top] > 0]
+            sources.append(source[top])
+            targets.append(other[top].astype(np.int64))
+            scores.append(score[top])
+    if not sources:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+    return np.concatenate(sources), np.concatenate(targets), np.concatenate(scores)
+
+
+# The saved index
+
+class RelatedIndex:
+    """Post vectors with the document frequencies they were weighed with
+    Languages and levels are kept as codes into names"""
+
+    def __init__(self, post_ids, languages, levels, names, vectors, df, n_docs):
+        self.post_ids = post_ids
+        self.languages = languages
+        self.levels = levels
+        self.names = list(names)
+        self.vectors = vectors
+        self.df = df
+        self.n_docs = n_docs
+
+    @classmethod
+    def build(cls, posts):
+        """posts: [(id, title, content, language, level)]"""
+        index = cls(np.array([], dtype=np.int64), np.array([], dtype=np.int32), np.array([], dtype=np.int32), [],
+                    sparse.csr_matrix((0, N_FEATURES), dtype=np.float32),
+                    np.zeros(N_FEATURES, dtype=np.int64), 0)
+        index.add(posts)
+        return index
+
+    def encode(self, values):
+        """Language/level names -> codes, new names get new codes"""
+        codes = {name: code for code, name in enumerate(self.names)}
+        for value in values:
+            if (value or '') not in codes:
+                codes[value or ''] = len(self.names)
+                self.names.append(value or '')
+        return np.array([codes[value or ''] for value in values], dtype=np.int32)
+
+    def add(self, posts):
+        """Append posts, returns their rows"""
+        counts = term_counts([(p[1], p[2]) for p in posts])
+        self.df += np.bincount(counts.indices, minlength=N_FEATURES)
+        self.n_docs += len(posts)
+        first = len(self.post_ids)
+        self.post_ids = np.concatenate([self.post_ids, np.array([p[0] for p in posts], dtype=np.int64)])
+        self.languages = np.concatenate([self.languages, self.encode([p[3] for p in posts])])
+        self.levels = np.concatenate([self.levels, self.encode([p[4] for p in posts])])
+        self.vectors = sparse.vstack([self.vectors, weigh(counts, self.df, self.n_docs)], format='csr')
+        return np.arange(first, len(self.post_ids))
+
+    def rows_of(self, post_ids):
+        """Rows of the posts that are in the index"""
+        return np.flatnonzero(np.isin(self.post_ids, list(post_ids)))
+
+    def nearest(self, rows=None):
+        """(post id, related post id, score) arrays for some rows (all by default)"""
+        if rows is None:
+            rows = np.arange(len(self.post_ids))
+        sources, targets, scores = nearest(self.vectors, self.languages, self.levels, rows)
+        return self.post_ids[sources], self.post_ids[targets], scores
+
+    def save(self, path=INDEX_PATH):
+        """Write the index (atomically, other workers may be reading it)"""
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as file:
+            np.savez(file, post_ids=self.post_ids, languages=self.languages, levels=self.levels,
+                     names=np.array(self.names, dtype=str), data=self.vectors.data,
+                     indices=self.vectors.indices, indptr=self.vectors.indptr, df=self.df, n_docs=self.n_docs)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path=INDEX_PATH):
+        with np.load(path) as saved:
+            vectors = sparse.csr_matrix((saved['data'], saved['indices'], saved['indptr']),
+                                        shape=(len(saved['post_ids']), N_FEATURES))
+            return cls(saved['post_ids'], saved['languages'], saved['levels'], saved['names'].tolist(),
+                       vectors, saved['df'], int(saved['n_docs']))
+
+
+# Related lists
+
+def update_lists(index, rows):
+    """Related lists of some rows of the index, merged into their neighbours' lists (caller commits)"""
+    new_ids, related_ids, scores = index.nearest(rows)
+    # Posts deleted since the last rebuild are still in the index
+    alive = {row[0] for row in db.session.query(Post.id).filter(Post.id.in_(set(related_ids.tolist())))}
+    keep = np.isin(related_ids, list(alive))
+    new_ids, related_ids, scores = new_ids[keep], related_ids[keep], scores[keep]
+
+    # Similarity is symmetric: a new post may belong in the lists of its own neighbours
+    neighbours = set(related_ids.tolist()) - set(new_ids.tolist())
+    current = db.session.query(RelatedPost.post_id, RelatedPost.related_id, RelatedPost.score)\
+                        .filter(RelatedPost.post_id.in_(neighbours))\
+                        .all() if neighbours else []
+    merged = {}
+    for post_id, related_id, score in list(current) + list(zip(related_ids.tolist(), new_ids.tolist(), scores.tolist())):
+        if post_id in neighbours:
+            merged.setdefault(post_id, []).append((score, related_id))
+    lists = [(post_id, related_id, score)
+             for post_id, items in merged.items()
+             for score, related_id in sorted(items, reverse=True)[:RELATED_PER_POST]]
+
+    replace_lists(new_ids, related_ids, scores, only=index.post_ids[rows].tolist())
+    if lists:
+        replace_lists(*(np.array(column) for column in zip(*lists)), only=neighbours)
+    return len(rows), len(neighbours)
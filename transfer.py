@@ -0,0 +1,297 @@
+"""
+Bulk import and export of users and posts
+Used by `flask devlog import` / `flask devlog export`. Files are JSON Lines
+or CSV and are read and written row by row, so memory stays flat.
+
+Ids are not copied between databases: users are matched by username and
+posts point to their author by username.
+"""
+
+import csv
+import io
+import itertools
+import json
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from werkzeug.security import generate_password_hash
+
+from mentions import extract_mentions, resolve_mentions, link_mentions
+from models import db, User, Post, EXCERPT_LENGTH
+from rendering import render_content
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+
+# Columns in export files, in this order
+USER_FIELDS = ['id', 'username', 'email', 'password_hash', 'role', 'level', 'gender',
+               'profile_photo', 'bio', 'created_at']
+POST_FIELDS = ['id', 'author', 'title', 'content', 'language', 'level', 'photo',
+               'is_published', 'created_at']
+
+FORMATS = ('jsonl', 'csv')
+# Rows per INSERT / per fetch
+DEFAULT_BATCH = 1000
+
+
+class TransferStats:
+    """Row counts and speed of one import/export"""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.rows = 0
+        self.skipped = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def __str__(self):
+        rate = self.rows / self.elapsed if self.elapsed else 0
+        text = f'{self.kind}: {self.rows:,} rows in {self.elapsed:.1f}s ({rate:,.0f} rows/s)'
+        if self.skipped:
+            text += f', {self.skipped:,} skipped'
+        return text
+
+
+def guess_format(path):
+    """'csv' for .csv files, JSON Lines otherwise"""
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+
+def batched(iterable, size):
+    """Yield lists of up to size items"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+# Reading and writing files
+
+def read_rows(file, fmt):
+    """Yield dicts from a JSON Lines or CSV file"""
+    if fmt == 'csv':
+        for row in csv.DictReader(file):
+            # Empty CSV cells mean "no value"
+            yield {key: value if value != '' else None for key, value in row.items()}
+    else:
+        for line in file:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def write_rows(file, fmt, fields, rows):
+    """Write dicts as JSON Lines or CSV"""
+    if fmt == 'csv':
+        writer = csv.DictWriter(file, fieldnames=fields)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+    else:
+        for row in rows:
+            file.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+
+def to_value(value):
+    """Database value -> file value"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def parse_datetime(value):
+    if not value:
+        return None
+    return datetime.fromisoformat(value)
+
+
+def parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes')
+
+
+# Bulk inserts
+
+def copy_rows(table, rows):
+    """PostgreSQL: load rows with COPY ... FROM STDIN"""
+    columns = list(rows[0])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(['\\N' if row[c] is None else row[c] for c in columns])
+    buffer.seek(0)
+
+    dbapi_connection = db.session.connection().connection.dbapi_connection
+    with dbapi_connection.cursor() as cursor:
+        cursor.copy_expert(
+            f'COPY {table.name} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv, NULL \'\\N\')',
+            buffer
+        )
+
+
+def insert_rows(table, rows):
+    """Insert a batch in one round trip (COPY on PostgreSQL, executemany elsewhere)"""
+    if not rows:
+        return
+    if db.engine.dialect.name == 'postgresql':
+        copy_rows(table, rows)
+    else:
+        db.session.execute(table.insert(), rows)
+
+
+# Import
+
+def import_users(rows, batch_size=DEFAULT_BATCH, workers=None):
+    """Insert users, skipping usernames/emails that already exist and rows without a password"""
+    stats = TransferStats('users')
+    # Only started when a batch has plain passwords to hash
+    pool = None
+    try:
+        for batch in batched(rows, batch_size):
+            usernames = [row.get('username') for row in batch]
+            emails = [row.get('email') for row in batch if row.get('email')]
+            taken_usernames, taken_emails = set(), set()
+            for username, email in db.session.query(User.username, User.email)\
+                                            .filter(User.username.in_(usernames) | User.email.in_(emails)):
+                taken_usernames.add(username)
+                if email:
+                    taken_emails.add(email)
+
+            new_rows = []
+            for row in batch:
+                email = row.get('email') or None
+                if not row.get('username') or row['username'] in taken_usernames or email in taken_emails:
+                    stats.skipped += 1
+                    continue
+                # Without a password the account could never log in
+                if not row.get('password_hash') and not row.get('password'):
+                    stats.skipped += 1
+                    continue
+                taken_usernames.add(row['username'])
+                if email:
+                    taken_emails.add(email)
+                new_rows.append({
+                    'username': row['username'],
+                    'email': email,
+                    'password': row.get('password_hash'),
+                    'role': row.get('role') or 'user',
+                    'level': row.get('level') or 'beginner',
+                    'gender': row.get('gender') or 'other',
+                    'profile_photo': row.get('profile_photo') or '/static/images/avatar-default.png',
+                    'bio': row.get('bio') or '',
+                    'created_at': parse_datetime(row.get('created_at')) or datetime.now(),
+                    # Plain password from a CSV made by hand, hashed below
+                    '_plain': row.get('password'),
+                })
+
+            # Hashing is slow on purpose, spread it over all CPUs
+            plain = [row for row in new_rows if not row['password'] and row['_plain']]
+            if plain:
+                if pool is None:
+                    pool = ProcessPoolExecutor(workers)
+                for row, hashed in zip(plain, pool.map(generate_password_hash, [r['_plain'] for r in plain],
+                                                        chunksize=max(1, len(plain) // 16))):
+                    row['password'] = hashed
+            for row in new_rows:
+                del row['_plain']
+
+            insert_rows(User.__table__, new_rows)
+            db.session.commit()
+            stats.rows += len(new_rows)
+            logger.info(str(stats))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return stats
+
+
+def import_posts(rows, batch_size=DEFAULT_BATCH, workers=None):
+    """Insert posts for existing authors, rendering their HTML in a process pool"""
+    stats = TransferStats('posts')
+    author_ids = {}
+    with ProcessPoolExecutor(workers) as pool:
+        for batch in batched(rows, batch_size):
+            missing = {row.get('author') for row in batch} - set(author_ids)
+            if missing:
+                author_ids.update(db.session.query(User.username, User.id).filter(User.username.in_(missing)))
+
+            new_rows = []
+            for row in batch:
+                author_id = author_ids.get(row.get('author'))
+                if author_id is None:
+                    stats.skipped += 1
+                    continue
+                content = row.get('content') or ''
+                created_at = parse_datetime(row.get('created_at')) or datetime.now()
+                is_published = parse_bool(row.get('is_published'))
+                new_rows.append({
+                    'author_id': author_id,
+                    'title': row.get('title'),
+                    'content': content,
+                    'excerpt': content[:EXCERPT_LENGTH],
+                    'content_length': len(content),
+                    'language': row.get('language'),
+                    'level': row.get('level'),
+                    'photo': row.get('photo'),
+                    'is_published': is_published,
+                    'created_at': created_at,
+                    'updated_at': created_at,
+                    'published_at': created_at if is_published else None,
+                })
+
+            htmls = pool.map(render_content, [r['content'] for r in new_rows], [r['language'] for r in new_rows],
+                             chunksize=max(1, len(new_rows) // 16))
+            users = resolve_mentions(h for r in new_rows for h in extract_mentions(r['content']))
+            for row, html in zip(new_rows, htmls):
+                row['content_html'] = link_mentions(html, users)
+
+            insert_rows(Post.__table__, new_rows)
+            db.session.commit()
+            stats.rows += len(new_rows)
+            logger.info(str(stats))
+    return stats
+
+
+# Export
+
+def stream_query(query, batch_size):
+    """Rows of a select, fetched through a server-side cursor"""
+    result = db.session.execute(query.execution_options(yield_per=batch_size))
+    for row in result.mappings():
+        yield {key: to_value(value) for key, value in row.items()}
+
+
+def export_users(batch_size=DEFAULT_BATCH):
+    query = db.select(
+        User.id, User.username, User.email, User.password.label('password_hash'), User.role,
+        User.level, User.gender, User.profile_photo, User.bio, User.created_at
+    ).order_by(User.id)
+    return stream_query(query, batch_size)
+
+
+def export_posts(batch_size=DEFAULT_BATCH):
+    query = db.select(
+        Post.id, User.username.label('author'), Post.title, Post.content, Post.language,
+        Post.level, Post.photo, Post.is_published, Post.created_at
+    ).outerjoin(User, User.id == Post.author_id).order_by(Post.id)
+    return stream_query(query, batch_size)
+
+
+IMPORTERS = {
+    'users': import_users,
+    'posts': import_posts,
+}
+
+EXPORTERS = {
+    'users': (export_users, USER_FIELDS),
+    'posts': (export_posts, POST_FIELDS),
+}
@@ -0,0 +1,99 @@
+"""
+Trending posts
+Each like/repost/comment adds points that lose half their value every
+HALF_LIFE_HOURS. A background job keeps the scores in post_scores, pages
+only read that table; the NumPy scoring is in trending_scores.py, which
+only the job imports.
+"""
+
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy.orm import joinedload
+
+from jobs import job, get_state, set_state
+from models import db, Post, PostScore
+from rollups import SETTLE_DELAY
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+
+# Points per event kind
+WEIGHTS = {
+    'like': 1.0,
+    'comment': 2.0,
+    'repost': 3.0,
+}
+HALF_LIFE_HOURS = 24.0
+
+# Only events this old or newer are read when rebuilding from scratch
+FULL_WINDOW = timedelta(days=7)
+# Rebuild from scratch this often (picks up unlikes and deleted comments)
+FULL_EVERY = timedelta(hours=24)
+# Scores below this are dropped from the table
+MIN_SCORE = 0.01
+
+# Events are read up to the watermark, scores are as of SCORED_KEY
+WATERMARK_KEY = 'trending:watermark'
+SCORED_KEY = 'trending:scored'
+FULL_KEY = 'trending:full'
+
+
+def save_scores(post_ids, scores):
+    """Replace the ranked table (caller commits)"""
+    keep = scores >= MIN_SCORE
+    db.session.execute(db.delete(PostScore))
+    rows = [{'post_id': int(p), 'score': float(s)} for p, s in zip(post_ids[keep], scores[keep])]
+    if rows:
+        db.session.execute(db.insert(PostScore), rows)
+    return len(rows)
+
+
+@job('trending', interval=300)
+def update_trending(full=False):
+    """Bring post_scores up to date, incrementally from the last run"""
+    from engagement import fetch_events
+    from trending_scores import combine_events, score_events, add_old_scores
+
+    now_dt = datetime.now()
+    now = now_dt.timestamp()
+    # Like the rollups, the newest events wait for the next run (their transactions may still be open)
+    until = now_dt - SETTLE_DELAY
+    watermark = get_state(WATERMARK_KEY)
+    scored = get_state(SCORED_KEY)
+    last_full = get_state(FULL_KEY)
+    if watermark is None or scored is None or last_full is None \
+            or now - float(last_full) > FULL_EVERY.total_seconds():
+        full = True
+
+    if full:
+        since = now_dt - FULL_WINDOW
+        post_ids, timestamps, weights = combine_events(fetch_events(since=since, until=until))
+        new_events = len(post_ids)
+        post_ids, scores = score_events(post_ids, timestamps, weights, now)
+    else:
+        since = datetime.fromtimestamp(float(watermark))
+        post_ids, timestamps, weights = combine_events(fetch_events(since=since, until=until))
+        new_events = len(post_ids)
+
+        old = db.session.query(PostScore.post_id, PostScore.score).all()
+        post_ids, scores = add_old_scores(old, now - float(scored), post_ids, timestamps, weights, now)
+
+    saved = save_scores(post_ids, scores)
+    set_state(WATERMARK_KEY, until.timestamp())
+    set_state(SCORED_KEY, now)
+    if full:
+        set_state(FULL_KEY, now)
+    db.session.commit()
+    return {'events': new_events, 'posts': saved, 'full': full}
+
+
+def trending_posts(limit=6):
+    """Top published posts by score"""
+    return Post.query.options(joinedload(Post.author))\
+                     .join(PostScore, PostScore.post_id == Post.id)\
+                     .filter(Post.is_published == db.true())\
+                     .order_by(PostScore.score.desc())\
+                     .limit(limit)\
+                     .all()
@@ -0,0 +1,39 @@
+"""
+Trending scores in NumPy
+Imported by the trending job only
+"""
+
+import numpy as np
+
+from trending import HALF_LIFE_HOURS, WEIGHTS
+
+
+def decay(ages_seconds):
+    """Factor an event of this age still counts with"""
+    return np.exp2(-ages_seconds / (HALF_LIFE_HOURS * 3600.0))
+
+
+def score_events(post_ids, timestamps, weights, now):
+    """Sum of decayed weights per post -> (unique post ids, scores)"""
+    contributions = weights * decay(now - timestamps)
+    unique_ids, inverse = np.unique(post_ids, return_inverse=True)
+    return unique_ids, np.bincount(inverse, weights=contributions)
+
+
+def combine_events(events):
+    """Event dict from fetch_events -> (post_ids, timestamps, weights)"""
+    post_ids = np.concatenate([e['post_id'] for e in events.values()])
+    timestamps = np.concatenate([e['ts'] for e in events.values()])
+    weights = np.concatenate([np.full(len(e['post_id']), WEIGHTS[kind]) for kind, e in events.items()])
+    return post_ids, timestamps, weights
+
+
+def add_old_scores(old, age_seconds, post_ids, timestamps, weights, now):
+    """Scores computed age_seconds ago [(post id, score)] plus new events -> (unique post ids, scores)
+    Old scores only decay, new events are added on top"""
+    old_ids = np.array([r[0] for r in old], dtype=np.int64)
+    old_scores = np.array([r[1] for r in old], dtype=np.float64) * decay(age_seconds)
+    post_ids = np.concatenate([old_ids, post_ids])
+    timestamps = np.concatenate([np.full(len(old_ids), now), timestamps])
+    weights = np.concatenate([old_scores, weights])
+    return score_events(post_ids, timestamps, weights, now)
@@ -0,0 +1,59 @@
+"""
+Small in-process cache for the logged in user
+Keeps only the fields every page needs (navbar, permissions)
+"""
+
+import threading
+import time
+
+from models import db, User
+
+
+# Seconds a cached user stays valid
+CACHE_TTL = 30
+# Expired entries are dropped once the cache grows past this size
+CACHE_MAX_SIZE = 10000
+
+_cache = {}
+_lock = threading.Lock()
+
+
+class CachedUser:
+    """Hot fields of a user, safe to pass to templates"""
+
+    is_authenticated = True
+
+    def __init__(self, id, username, role, profile_photo):
+        self.id = id
+        self.username = username
+        self.role = role
+        self.profile_photo = profile_photo
+
+    def __repr__(self):
+        return f'CachedUser({self.username})'
+
+
+def get_cached_user(user_id):
+    """Return a CachedUser for user_id, loading it at most once per TTL"""
+    now = time.monotonic()
+    with _lock:
+        item = _cache.get(user_id)
+    if item is not None and item[0] > now:
+        return item[1]
+
+    row = db.session.query(User.id, User.username, User.role, User.profile_photo)\
+                    .filter(User.id == user_id)\
+                    .first()
+    cached = CachedUser(*row) if row else None
+    with _lock:
+        if len(_cache) >= CACHE_MAX_SIZE:
+            for key in [k for k, v in _cache.items() if v[0] <= now]:
+                del _cache[key]
+        _cache[user_id] = (now + CACHE_TTL, cached)
+    return cached
+
+
+def invalidate_user(user_id):
+    """Forget a cached user (call after changing username, role or photo)"""
+    with _lock:
+        _cache.pop(user_id, None)
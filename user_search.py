@@ -0,0 +1,115 @@
+"""
+User search for @username autocomplete
+Usernames are matched by prefix, case-insensitively. Each worker keeps a
+sorted list of lowercased usernames and answers prefixes with a binary
+search; it is rebuilt every CACHE_TTL seconds. Without the list (too many
+users) a range scan over the lower(username) index is used instead.
+On PostgreSQL short result lists are topped up with usernames that contain
+the query, found through a pg_trgm index.
+"""
+
+import bisect
+import threading
+import time
+
+from models import db, User
+
+
+SEARCH_LIMIT = 10
+MAX_QUERY_LENGTH = 80
+# Seconds the sorted username list stays valid
+CACHE_TTL = 60
+# Above this many users no list is kept, every search goes to the database
+CACHE_MAX_USERS = 200000
+# Substring matches (PostgreSQL) need at least one trigram
+MIN_SUBSTRING_LENGTH = 3
+
+# (expires, lowercased usernames, (username, profile_photo) rows), both sorted
+_index = None
+_lock = threading.Lock()
+
+
+def normalize(query):
+    """'@Nika ' -> 'nika'"""
+    return (query or '').strip().lstrip('@').lower()[:MAX_QUERY_LENGTH]
+
+
+def active_users():
+    return db.session.query(User.username, User.profile_photo)\
+                     .filter(User.deleted_at.is_(None), User.username.isnot(None))
+
+
+def load_index():
+    """Sorted username list, or None when there are too many users"""
+    rows = active_users().limit(CACHE_MAX_USERS + 1).all()
+    if len(rows) > CACHE_MAX_USERS:
+        return None
+    rows.sort(key=lambda row: row[0].lower())
+    return [row[0].lower() for row in rows], [tuple(row) for row in rows]
+
+
+def get_index():
+    """The cached list, rebuilt when it is older than CACHE_TTL"""
+    global _index
+    now = time.monotonic()
+    index = _index
+    if index is not None and index[0] > now:
+        return index[1]
+    with _lock:
+        # Another thread may have rebuilt it while we waited
+        if _index is not None and _index[0] > now:
+            return _index[1]
+        _index = (now + CACHE_TTL, load_index())
+        return _index[1]
+
+
+def forget_users():
+    """Drop this worker's list (call after adding, renaming or deleting users)"""
+    global _index
+    _index = None
+
+
+def search_cached(index, query, limit):
+    """Prefix matches from the sorted list"""
+    keys, rows = index
+    start = bisect.bisect_left(keys, query)
+    end = bisect.bisect_left(keys, query + '\U0010ffff', lo=start, hi=min(len(keys), start + limit))
+    return rows[start:end]
+
+
+def like_pattern(text):
+    """Escape LIKE wildcards in user input"""
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def search_prefix(query, limit):
+    """Usernames starting with the query, from the database"""
+    lower = db.func.lower(User.username)
+    if db.engine.dialect.name == 'postgresql':
+        prefix = lower.like(like_pattern(query) + '%', escape='\\')
+    else:
+        # Range over the lower(username) index, LIKE would not use it in SQLite
+        prefix = (lower >= query) & (lower < query + '\U0010ffff')
+    return [tuple(row) for row in active_users().filter(prefix).order_by(lower).limit(limit)]
+
+
+def search_substring(query, limit, found):
+    """PostgreSQL: usernames containing the query (pg_trgm index), shortest first"""
+    lower = db.func.lower(User.username)
+    rows = active_users().filter(lower.like('%' + like_pattern(query) + '%', escape='\\'),
+                                 User.username.notin_(found))\
+                         .order_by(db.func.length(User.username), lower)\
+                         .limit(limit)
+    return [tuple(row) for row in rows]
+
+
+def search_users(query, limit=SEARCH_LIMIT):
+    """Users whose name starts with (or on PostgreSQL contains) the query -> [(username, profile_photo)]"""
+    query = normalize(query)
+    if not query:
+        return []
+    index = get_index()
+    rows = search_cached(index, query, limit) if index is not None else search_prefix(query, limit)
+    if len(rows) < limit and len(query) >= MIN_SUBSTRING_LENGTH and db.engine.dialect.name == 'postgresql':
+        rows += search_substring(query, limit - len(rows), [row[0] for row in rows])
+    return rows